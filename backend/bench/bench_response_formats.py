@@ -0,0 +1,149 @@
+"""
+Benchmark das respostas grandes: JSON padrão do FastAPI (jsonable_encoder + json.dumps)
+vs. JSON com orjson vs. formato colunar (dictionary encoding) vs. Arrow IPC.
+Mede o tempo de codificação e o tamanho cru, com gzip e com brotli.
+
+Uso (a partir de backend/):  python -m bench.bench_response_formats
+
+orjson, brotli e pyarrow são opcionais. Sem eles, as linhas correspondentes somem
+(ou o "orjson" cai no json da stdlib).
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+
+from src.api import encoding
+
+random.seed(11)
+NOW = datetime(2024, 5, 20, 12, 0, 0, tzinfo=timezone.utc)
+DTCS = {
+    "P0100": "Sensor de fluxo de massa de ar - circuito com mau funcionamento",
+    "P0299": "Turbocompressor - condição de baixa pressão de sobrealimentação",
+    "P2002": "Eficiência do filtro de partículas diesel abaixo do limite",
+    "P0401": "Fluxo insuficiente no sistema de recirculação de gases (EGR)",
+    "U0100": "Perda de comunicação com o módulo de controle do motor",
+    "P20EE": "Eficiência do catalisador SCR abaixo do limite",
+}
+CUSTOMERS = [f"TRANSPORTADORA EXEMPLO {i:02d} LTDA" for i in range(12)]
+
+
+def _vehicle(i: int) -> Dict[str, Any]:
+    return {
+        "customer_name": CUSTOMERS[i % len(CUSTOMERS)],
+        "chassi": f"9BM958074NL{i:06d}",
+        "chassi_last8": f"NL{i:06d}",
+        "plate": f"ABC{i % 10}D{i % 100:02d}",
+    }
+
+
+def _overview(events: int, vehicles: int) -> Dict[str, Any]:
+    items = []
+    per_vehicle = max(1, events // vehicles)
+    for v in range(vehicles):
+        vehicle = _vehicle(v)
+        rows = []
+        for e in range(per_vehicle):
+            dtc = random.choice(list(DTCS))
+            rows.append(
+                {
+                    "dtc": dtc,
+                    "dtc_description": DTCS[dtc],
+                    "timestamp": (NOW - timedelta(minutes=13 * (v * per_vehicle + e))).isoformat(),
+                    "status": random.choice(["ATIVO", "INATIVO"]),
+                    "lat": -23.5 + random.random(),
+                    "lon": -46.6 + random.random(),
+                    "imei": f"8600000000{v:05d}",
+                }
+            )
+        items.append(
+            {
+                "customer_name": vehicle["customer_name"],
+                "chassi_last8": vehicle["chassi_last8"],
+                "plate": vehicle["plate"],
+                "dtc_count": len(rows),
+                "most_recent": rows[0]["timestamp"],
+                "events": rows,
+            }
+        )
+    return {"items": items}
+
+
+def _history(rows: int, vehicles: int) -> Dict[str, Any]:
+    items = []
+    for i in range(rows):
+        dtc = random.choice(list(DTCS))
+        items.append(
+            {
+                "timestamp": (NOW - timedelta(minutes=3 * i)).isoformat(),
+                **_vehicle(random.randrange(vehicles)),
+                "dtc": dtc,
+                "dtc_description": DTCS[dtc],
+                "status": random.choice(["ATIVO", "INATIVO"]),
+            }
+        )
+    return {
+        "items": items,
+        "pagination": {"page": 1, "page_size": rows, "total_items": rows * 7, "total_pages": 7},
+        "range": {"start_date": "2024-05-14", "end_date": "2024-05-20"},
+    }
+
+
+def _fastapi_default(payload: Any) -> bytes:
+    # o que o FastAPI faz para um dict devolvido sem response_model (JSONResponse.render)
+    return json.dumps(
+        jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _timed(fn: Callable[[], bytes], repeat: int = 5) -> tuple[float, bytes]:
+    best, body = float("inf"), b""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, body
+
+
+def _encoders(payload: Dict, to_columnar: Callable, arrow_rows: Callable) -> List[tuple[str, Callable[[], bytes]]]:
+    encoders = [
+        ("json (fastapi)", lambda: _fastapi_default(payload)),
+        ("json (orjson)" if encoding.orjson else "json (stdlib)", lambda: encoding.dumps(payload)),
+        ("columnar", lambda: encoding.dumps(to_columnar(payload))),
+    ]
+    if encoding.pa is not None:
+        encoders.append(("arrow ipc", lambda: encoding.arrow_ipc(*arrow_rows(payload))))
+    return encoders
+
+
+def main() -> None:
+    cases = [
+        ("overview 500 eventos", _overview(500, 60), encoding.overview_columnar, encoding.overview_arrow),
+        ("overview 5000 eventos", _overview(5000, 400), encoding.overview_columnar, encoding.overview_arrow),
+        ("history 200 linhas", _history(200, 80), encoding.history_columnar, encoding.history_arrow),
+        ("history 5000 linhas", _history(5000, 400), encoding.history_columnar, encoding.history_arrow),
+    ]
+    header = f"{'payload':24} {'formato':16} {'encode ms':>10} {'bytes':>10} {'gzip':>9}"
+    if encoding.brotli is not None:
+        header += f" {'br':>9}"
+    print(header + "   (encode vs. fastapi)")
+    for name, payload, to_columnar, arrow_rows in cases:
+        baseline = None
+        for label, fn in _encoders(payload, to_columnar, arrow_rows):
+            ms, body = _timed(fn)
+            baseline = baseline or ms
+            line = f"{name:24} {label:16} {ms:10.2f} {len(body):10d} {len(gzip.compress(body, 5)):9d}"
+            if encoding.brotli is not None:
+                line += f" {len(encoding.brotli.compress(body, quality=5)):9d}"
+            print(f"{line}   ({baseline / ms:4.1f}x)")
+        print()
+
+
+if __name__ == "__main__":
+    main()
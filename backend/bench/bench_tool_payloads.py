@@ -0,0 +1,148 @@
+"""
+Benchmark de tokens: formato antigo das tools (lista de dicts 'slim') vs. formato
+compacto (header + dict + cols/rows) de src.agent.compact.
+
+Uso (a partir de backend/):  python -m bench.bench_tool_payloads
+
+Usa o tokenizador do tiktoken quando instalado (aproximação razoável para o Gemini);
+sem ele, conta pedaços de palavra/pontuação como estimativa.
+"""
+from __future__ import annotations
+
+import json
+import random
+import re
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from src.agent.compact import (
+    CODE_DICTS,
+    DTC_EPISODE_COLS,
+    DTC_EVENT_COLS,
+    SUMMARY_COLS,
+    SUMMARY_DICTS,
+    SUMMARY_HEADER,
+    TELEMETRY_BUCKET_COLS,
+    VEHICLE_HEADER,
+    encode_rows,
+    slim_dtc_episode,
+    slim_dtc_event,
+    slim_summary,
+    slim_telemetry_bucket,
+)
+
+random.seed(7)
+NOW = datetime(2024, 5, 20, 12, 0, 0)
+DTCS = {
+    "P0100": "Sensor de fluxo de massa de ar - circuito com mau funcionamento",
+    "P0299": "Turbocompressor - condição de baixa pressão de sobrealimentação",
+    "P2002": "Eficiência do filtro de partículas diesel abaixo do limite",
+    "P0401": "Fluxo insuficiente no sistema de recirculação de gases (EGR)",
+    "U0100": "Perda de comunicação com o módulo de controle do motor",
+    "P20EE": "Eficiência do catalisador SCR abaixo do limite",
+}
+FMIS = {
+    1: "Dados válidos, mas abaixo da faixa normal de operação (mais grave)",
+    3: "Tensão acima do normal ou em curto com fonte de tensão alta",
+    4: "Tensão abaixo do normal ou em curto com fonte de tensão baixa",
+    18: "Dados válidos, mas abaixo da faixa normal de operação (moderado)",
+}
+VEHICLE = {
+    "plate": "ABC1D23",
+    "customer_name": "TRANSPORTADORA EXEMPLO LTDA",
+    "chassi_last8": "NL123456",
+    "plan_active": True,
+    "plan_type": "GOBRAX PRO",
+}
+ACTIONS = {
+    "persistente": "Atuar imediatamente (falha ativa/persistente).",
+    "intermitente": "Monitorar; revisar condições que dispararam a falha.",
+    "provavelmente resolvido": "Sem recorrência recente; tratar como resolvida (confirmar com cliente).",
+}
+
+
+def _warehouse_row(i: int) -> Dict[str, Any]:
+    dtc = random.choice(list(DTCS))
+    fmi = random.choice(list(FMIS))
+    ts = NOW - timedelta(minutes=7 * i)
+    return {
+        **VEHICLE,
+        "ts": ts,
+        "start_ts": ts - timedelta(minutes=random.randint(1, 90)),
+        "end_ts": ts,
+        "events": random.randint(2, 400),
+        "dtc": dtc,
+        "fmi": fmi,
+        "spn": random.randint(100, 5000),
+        "status": random.choice(["ATIVO", "INATIVO"]),
+        "last_status": random.choice(["ATIVO", "INATIVO"]),
+        "dtc_description": DTCS[dtc],
+        "fmi_pt": FMIS[fmi],
+    }
+
+
+def _bucket_row(i: int) -> Dict[str, Any]:
+    return {
+        "time": NOW - timedelta(minutes=5 * i),
+        "events": random.randint(0, 60),
+        "dtcs": random.sample(list(DTCS), k=random.randint(0, 3)),
+        "first_status": "ATIVO",
+        "last_status": random.choice(["ATIVO", "INATIVO"]),
+    }
+
+
+def _summary_row(i: int) -> Dict[str, Any]:
+    base = _warehouse_row(i)
+    label = random.choice(list(ACTIONS))
+    return {
+        **base,
+        "status_label": label,
+        "recommended_action": ACTIONS[label],
+        "events_total": random.randint(1, 5000),
+        "ev_24h": random.randint(0, 300),
+        "ev_7d": random.randint(0, 2000),
+        "days_with_events": random.randint(1, 30),
+        "first_seen_utc": base["start_ts"],
+        "last_seen_utc": base["end_ts"],
+        "gap_hours_since_last": random.random() * 100,
+        "severity": random.choice(["Alta", "Média", "Baixa"]),
+        "can_run": random.choice([True, False]),
+    }
+
+
+def _count_tokens() -> Callable[[str], int]:
+    try:
+        import tiktoken  # opcional
+
+        enc = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(enc.encode(text))
+    except ImportError:
+        pattern = re.compile(r"\w{1,4}|[^\w\s]", re.UNICODE)
+        return lambda text: len(pattern.findall(text))
+
+
+def _cases() -> List[tuple[str, List[Dict[str, Any]], Dict[str, Any]]]:
+    events = [slim_dtc_event(_warehouse_row(i)) for i in range(50)]
+    episodes = [slim_dtc_episode(_warehouse_row(i)) for i in range(50)]
+    buckets = [slim_telemetry_bucket(_bucket_row(i)) for i in range(200)]
+    summary = [{**slim_summary(r), "severity": r["severity"], "can_run": r["can_run"]}
+               for r in (_summary_row(i) for i in range(30))]
+    return [
+        ("fetch_dtcs events (50)", events, encode_rows(events, DTC_EVENT_COLS, VEHICLE_HEADER, CODE_DICTS)),
+        ("fetch_dtcs episodes (50)", episodes, encode_rows(episodes, DTC_EPISODE_COLS, VEHICLE_HEADER, CODE_DICTS)),
+        ("fetch_telemetry buckets (200)", buckets, encode_rows(buckets, TELEMETRY_BUCKET_COLS)),
+        ("fetch_vehicle_summary (30)", summary, encode_rows(summary, SUMMARY_COLS, SUMMARY_HEADER, SUMMARY_DICTS)),
+    ]
+
+
+def main() -> None:
+    count = _count_tokens()
+    print(f"{'payload':32} {'tokens antes':>13} {'tokens depois':>14} {'redução':>8}")
+    for name, legacy, compact in _cases():
+        before = count(json.dumps(legacy, ensure_ascii=False, default=str))
+        after = count(json.dumps(compact, ensure_ascii=False, default=str))
+        print(f"{name:32} {before:13d} {after:14d} {1 - after / before:8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,291 @@
 # src/agent/agent.py
 from __future__ import annotations
 
+import contextvars
+import json
+import logging
 import os
-from typing import Any, Dict, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
 
 from agno.agent import Agent
+from agno.run import RunContext
 from agno.tools import tool
 
+from src.agent import sessions
+
+from src.agent.compact import (
+    CODE_DICTS,
+    CUSTOMER_SUMMARY_COLS,
+    DTC_EPISODE_COLS,
+    DTC_EVENT_COLS,
+    FORMAT_HINT,
+    SUMMARY_COLS,
+    SUMMARY_DICTS,
+    SUMMARY_HEADER,
+    TELEMETRY_BUCKET_COLS,
+    TELEMETRY_RAW_COLS,
+    VEHICLE_HEADER,
+    encode_rows,
+    short_ts,
+    slim_dtc_episode,
+    slim_dtc_event,
+    slim_summary,
+    slim_telemetry_bucket,
+    slim_telemetry_point,
+)
 from src.services import bq_client  # suas consultas BigQuery
+from src.services import kb as kb_service
+from src.services.fault_snapshot import fault_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------- consultas slim --------------------
+# Funções puras usadas pelas tools e pelo pré-carregamento de contexto da API.
+# As linhas 'slim' (src.agent.compact) são codificadas por encode_rows antes de ir ao LLM.
+def dtcs_payload(vehicle_key: str, hours: int = 24, mode: str = "episodes") -> Dict[str, Any]:
+    if (mode or "").lower() == "events":
+        rows = bq_client.get_dtcs(vehicle_key=vehicle_key, hours=hours) or []
+        slim = [slim_dtc_event(r) for r in rows[:50]]
+        return encode_rows(slim, DTC_EVENT_COLS, VEHICLE_HEADER, CODE_DICTS)
+
+    rows = bq_client.get_dtcs(vehicle_key=vehicle_key, hours=hours, mode="episodes") or []
+    slim = [slim_dtc_episode(r) for r in rows[:50]]
+    return encode_rows(slim, DTC_EPISODE_COLS, VEHICLE_HEADER, CODE_DICTS)
 
 
-# ----------------------- helpers -----------------------
-def _ts(v) -> str:
-    """Formata timestamp de forma curtinha para não inflar o payload do LLM."""
+def telemetry_payload(vehicle_key: str, minutes: int = 60, resolution: str = "auto") -> Dict[str, Any]:
+    if (resolution or "").lower() == "raw":
+        data = bq_client.get_telemetry(vehicle_key=vehicle_key, minutes=minutes) or {}
+        points = data.get("time_series", []) or []
+        slim = [slim_telemetry_point(p) for p in points[:200]]
+        return {"resolution": "raw", **encode_rows(slim, TELEMETRY_RAW_COLS)}
+
+    data = bq_client.get_telemetry(
+        vehicle_key=vehicle_key, minutes=minutes, resolution=resolution or "auto"
+    ) or {}
+    slim = [slim_telemetry_bucket(p) for p in data.get("time_series", []) or []]
+    return {"resolution": data.get("resolution"), **encode_rows(slim, TELEMETRY_BUCKET_COLS)}
+
+
+STATUS_RANK = {"persistente": 0, "intermitente": 1, "provavelmente resolvido": 2}
+def kb_info(spn: Any, fmi: Any) -> Dict[str, Any]:
+    if spn is None or fmi is None or not kb_service.available():
+        return {"severity": None}
     try:
-        return str(v).replace("T", " ")[:19]
-    except Exception:
-        return str(v)
+        item = kb_service.lookup(int(spn), int(fmi))
+    except ValueError:
+        return {"severity": None}
+    return {"severity": item.get("severity"), "can_run": item.get("can_run")}
 
 
-# ----------------------- tools -------------------------
-@tool
-def fetch_dtcs(vehicle_key: str, hours: int = 24) -> List[Dict[str, Any]]:
-    """Busca DTCs recentes do veículo (placa/IMEI/chassi 8). Retorna até 50 linhas 'slim'."""
-    rows = bq_client.get_dtcs(vehicle_key=vehicle_key, hours=hours) or []
-    slim: List[Dict[str, Any]] = []
-    for r in rows[:50]:
-        slim.append(
-            {
-                "timestamp": _ts(r.get("ts") or r.get("timestamp") or r.get("time")),
-                "dtc": r.get("dtc"),
-                "fmi": r.get("fmi"),
-                "spn": r.get("spn"),
-                "status": r.get("status"),
-                "plate": r.get("plate"),
-                "customer": r.get("customer_name"),
-                "plan_active": r.get("plan_active"),
-                "plan_type": r.get("plan_type"),
-                "dtc_description": r.get("dtc_description"),
-                "fmi_pt": r.get("fmi_pt"),
-            }
+def rank_faults(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Linhas do resumo -> falhas slim + severidade da kb, ordenadas por persistência e severidade."""
+    faults = [{**slim_summary(r), **kb_info(r.get("spn"), r.get("fmi"))} for r in rows]
+    # mais recentes primeiro dentro de cada (persistência, severidade)
+    faults.sort(key=lambda f: f["last_seen"] or "", reverse=True)
+    faults.sort(
+        key=lambda f: (
+            STATUS_RANK.get(f["status_label"], 3),
+            -kb_service.severity_weight(f.get("severity")),
         )
-    return slim
+    )
+    return faults
 
 
-@tool
-def fetch_telemetry(vehicle_key: str, minutes: int = 60) -> Dict[str, Any]:
-    """Busca telemetria bruta recente (placa/IMEI/chassi 8). Retorna até 200 pontos."""
-    data = bq_client.get_telemetry(vehicle_key=vehicle_key, minutes=minutes) or {}
-    points = data.get("time_series", []) or []
-    slim_points = [
+def vehicle_summary_payload(vehicle_key: str, days: int = 30) -> Dict[str, Any]:
+    """Resumo agregado por DTC/FMI (rótulo de persistência já calculado) + severidade da kb."""
+    rows = fault_snapshot.vehicle_summary(vehicle_key, days=days)
+    if rows is None:  # snapshot velho ou janela maior que a dele
+        rows = bq_client.get_dtc_summary(vehicle_key=vehicle_key, days=days) or []
+    faults = rank_faults(rows)
+    return encode_rows(faults[:50], SUMMARY_COLS, SUMMARY_HEADER, SUMMARY_DICTS)
+
+
+def customer_summary_payload(customer_name: str, days: int = 30, limit: int | None = None) -> Dict[str, Any]:
+    rows = bq_client.get_customer_summary(customer_name=customer_name, days=days) or []
+    if limit is not None:
+        rows = rows[:limit]
+    slim = [
         {
-            "time": _ts(p.get("time")),
-            "spn": p.get("spn"),
-            "fmi": p.get("fmi"),
-            "dtc": p.get("dtc"),
-            "status": p.get("status"),
+            **{k: r.get(k) for k in CUSTOMER_SUMMARY_COLS},
+            "customer_name": r.get("customer_name"),
+            "dtc_description": r.get("dtc_description"),
+            "fmi_pt": r.get("fmi_pt"),
+            "recommended_action": r.get("recommended_action"),
+            "last_seen": short_ts(r.get("last_seen_utc")),
         }
-        for p in points[:200]
+        for r in rows
     ]
-    return {"time_series": slim_points}
+    return encode_rows(slim, CUSTOMER_SUMMARY_COLS, ("customer_name",), SUMMARY_DICTS)
+
+
+# ----------------------- tools -------------------------
+# Limites dentro de cada execução: tempo de cada chamada ao modelo, rodadas de tools e o
+# prazo do pedido (definido pelo pool em src/agent/pool.py). Depois do prazo as tools não
+# consultam mais nada, e a chamada ao modelo em andamento cai no timeout dela.
+MODEL_TIMEOUT_SECONDS = float(os.getenv("ASSISTANT_MODEL_TIMEOUT_SECONDS", 45))
+TOOL_CALL_LIMIT = int(os.getenv("ASSISTANT_TOOL_CALL_LIMIT", 6))
+
+run_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("assistant_run_deadline", default=None)
+
+
+class RunDeadlineExceeded(RuntimeError):
+    """Tool chamada depois do prazo da execução."""
+
+
+def check_deadline() -> None:
+    deadline = run_deadline.get()
+    if deadline is not None and time.monotonic() > deadline:
+        raise RunDeadlineExceeded("Tempo do atendimento esgotado; responda com os dados que já tem.")
+
+
+# Resultados memoizados por sessão de conversa (run_context.session_id, injetado pelo agno).
+def _sid(run_context: RunContext | None) -> str | None:
+    return getattr(run_context, "session_id", None)
+
+
+def _key(value: str | None) -> str:
+    return (value or "").strip().upper()
+
+
+def cached_vehicle_summary(session_id: str | None, vehicle_key: str, days: int = 30) -> Dict[str, Any]:
+    return sessions.memoize(
+        session_id, "vehicle_summary", (_key(vehicle_key), days),
+        lambda: vehicle_summary_payload(vehicle_key, days),
+    )
+
+
+def cached_dtcs(session_id: str | None, vehicle_key: str, hours: int = 24, mode: str = "episodes") -> Dict[str, Any]:
+    return sessions.memoize(
+        session_id, "dtcs", (_key(vehicle_key), hours, (mode or "").lower()),
+        lambda: dtcs_payload(vehicle_key, hours, mode),
+    )
+
+
+def cached_telemetry(session_id: str | None, vehicle_key: str, minutes: int = 60, resolution: str = "auto") -> Dict[str, Any]:
+    return sessions.memoize(
+        session_id, "telemetry", (_key(vehicle_key), minutes, (resolution or "").lower()),
+        lambda: telemetry_payload(vehicle_key, minutes, resolution),
+    )
+
+
+def cached_customer_summary(
+    session_id: str | None, customer_name: str, days: int = 30, limit: int | None = None
+) -> Dict[str, Any]:
+    return sessions.memoize(
+        session_id, "customer_summary", (_key(customer_name), days, limit),
+        lambda: customer_summary_payload(customer_name, days, limit=limit),
+    )
+
+
+@tool
+def fetch_vehicle_summary(
+    vehicle_key: str, days: int = 30, run_context: RunContext | None = None
+) -> Dict[str, Any]:
+    """
+    PONTO DE PARTIDA para um veículo (placa/IMEI/chassi 8). Resumo agregado por DTC/FMI
+    nos últimos `days` dias: contagens, primeira/última ocorrência, rótulo de persistência
+    (status_label) já calculado, ação recomendada e severidade da base de conhecimento.
+    """
+    check_deadline()
+    return cached_vehicle_summary(_sid(run_context), vehicle_key, days)
+
+
+@tool
+def fetch_dtcs(
+    vehicle_key: str, hours: int = 24, mode: str = "episodes", run_context: RunContext | None = None
+) -> Dict[str, Any]:
+    """
+    Detalhamento: DTCs recentes do veículo (placa/IMEI/chassi 8). Retorna até 50 linhas 'slim'.
+    mode="episodes" (padrão) agrupa repetições do mesmo DTC/FMI em episódios com início,
+    fim, contagem e último status; use mode="events" para ver os eventos brutos.
+    """
+    check_deadline()
+    return cached_dtcs(_sid(run_context), vehicle_key, hours, mode)
+
+
+@tool
+def fetch_telemetry(
+    vehicle_key: str, minutes: int = 60, resolution: str = "auto", run_context: RunContext | None = None
+) -> Dict[str, Any]:
+    """
+    Detalhamento: telemetria recente (placa/IMEI/chassi 8) já agregada por balde de tempo.
+    resolution="auto" escolhe 1m/5m/1h... para ~200 pontos; use "raw" só para detalhar
+    uma janela curta (até 200 linhas brutas).
+    """
+    check_deadline()
+    return cached_telemetry(_sid(run_context), vehicle_key, minutes, resolution)
 
 
 @tool
-def fetch_customer_summary(customer_name: str, days: int = 30) -> List[Dict[str, Any]]:
+def fetch_customer_summary(
+    customer_name: str, days: int = 30, run_context: RunContext | None = None
+) -> Dict[str, Any]:
     """
     Resumo por cliente (nome parcial ok). Classifica DTC/FMI como persistente/intermitente/resolvido,
     e inclui status de plano (status_gobrax/plan_type) via chassi last8.
     """
-    return bq_client.get_customer_summary(customer_name=customer_name, days=days) or []
+    check_deadline()
+    return cached_customer_summary(_sid(run_context), customer_name, days)
+
+
+# ------------------ contexto pré-carregado ------------------
+def prefetch_context(
+    vehicle_key: str | None = None,
+    customer_name: str | None = None,
+    minutes: int = 60,
+    days: int = 30,
+    session_id: str | None = None,
+) -> tuple[str, list[str]]:
+    """
+    Roda em paralelo as mesmas consultas das tools para o veículo/cliente informado e
+    devolve (bloco de contexto para o prompt, chamadas feitas). Poupa ao modelo as
+    rodadas extras só para decidir chamar cada ferramenta. Com `session_id`, usa (e
+    alimenta) o memo da sessão, compartilhado com as tools.
+    """
+    jobs: Dict[str, Callable[[], Any]] = {}
+    if vehicle_key:
+        jobs[f"fetch_vehicle_summary(vehicle_key='{vehicle_key}', days={days})"] = (
+            lambda: cached_vehicle_summary(session_id, vehicle_key, days)
+        )
+        jobs[f"fetch_telemetry(vehicle_key='{vehicle_key}', minutes={minutes})"] = (
+            lambda: cached_telemetry(session_id, vehicle_key, minutes)
+        )
+    if customer_name:
+        jobs[f"fetch_customer_summary(customer_name='{customer_name}', days={days})"] = (
+            lambda: cached_customer_summary(session_id, customer_name, days, limit=100)
+        )
+    if not jobs:
+        return "", []
+
+    results: Dict[str, Any] = {}
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        # cada job leva uma cópia do contexto do pedido (chamador do escalonador,
+        # degradation() e prazo do pool); um Context não roda em duas threads ao mesmo tempo
+        futures = {label: pool.submit(contextvars.copy_context().run, fn) for label, fn in jobs.items()}
+        for label, future in futures.items():
+            try:
+                results[label] = future.result()
+            except Exception:
+                logger.exception("Falha ao pré-carregar %s", label)
+                results[label] = None
+
+    blocks = []
+    for label, data in results.items():
+        if data is None:
+            body = "(consulta falhou; chame a ferramenta se precisar desses dados)"
+        else:
+            body = json.dumps(data, ensure_ascii=False, default=str)
+        blocks.append(f"### {label}\n{body}")
+
+    header = (
+        "Dados já consultados para este atendimento (use-os diretamente; "
+        "chame as ferramentas só para detalhar ou mudar a janela):"
+    )
+    return header + "\n" + "\n\n".join(blocks), list(jobs)
 
 
 # --------------------- model factory -------------------
@@ -85,38 +302,46 @@ def _make_model():
         api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise RuntimeError("Faltou GEMINI_API_KEY (ou GOOGLE_API_KEY) no .env")
-        return Gemini(id=model_id, api_key=api_key)
+        return Gemini(id=model_id, api_key=api_key, timeout=MODEL_TIMEOUT_SECONDS)
 
     raise ValueError(f"AGNO_PROVIDER inválido: {provider}")
 
 
-# ---------------------- singleton ----------------------
-_agent: Agent | None = None
-
-def get_agent() -> Agent:
-    global _agent
-    if _agent is not None:
-        return _agent
-
-    system = """
+# ----------------------- factory -----------------------
+SYSTEM_PROMPT = """
 Você é um analista de veículos DAF especializado em DTC (Diagnostic Trouble Codes).
 - Pense que o usuário é um cliente da DAF (suporte técnico nível 2) e precisa decidir a partir da severidade de cada falha.
 - Se perguntarem por um cliente específico, responda como analista da montadora.
 - Sempre que o usuário fornecer PLACA, CHASSI (últimos 8) ou pedir um resumo por cliente (customer_name), use as ferramentas.
+- Para um veículo, comece por fetch_vehicle_summary: ele já traz a classificação (status_label) e a severidade.
+  Use fetch_dtcs / fetch_telemetry apenas para detalhar um DTC ou uma janela específica.
 - Explique DTC + FMI, severidade e próximos passos, em PT-BR e de forma objetiva.
 - Se não houver dados, sugira ampliar a janela ou confirmar a identificação.
-- Classifique cada DTC/FMI como:
+- Use a classificação de cada DTC/FMI como vier das ferramentas (não recalcule):
   • persistente (atividade em 24h OU ≥3 dias com eventos na última semana)
   • intermitente (houve na semana, mas não em 24h)
   • provavelmente resolvido (sem eventos na semana)
 - Explique severidade e próximos passos. Responda em PT-BR, direto ao ponto.
 - Se faltar veículo (placa/IMEI/chassi 8) ou nome do cliente, peça educadamente.
-""".strip()
+""".strip() + "\n- " + FORMAT_HINT
+
 
-    _agent = Agent(
+def build_agent() -> Agent:
+    """Cria uma instância nova do agente (o pool mantém uma por worker)."""
+    return Agent(
         name="DAF DTC Analyst",
         model=_make_model(),
-        instructions=system,
-        tools=[fetch_dtcs, fetch_telemetry, fetch_customer_summary],
+        instructions=SYSTEM_PROMPT,
+        tools=[fetch_vehicle_summary, fetch_dtcs, fetch_telemetry, fetch_customer_summary],
+        tool_call_limit=TOOL_CALL_LIMIT,
     )
+
+
+# ---------------------- singleton ----------------------
+_agent: Agent | None = None
+
+def get_agent() -> Agent:
+    global _agent
+    if _agent is None:
+        _agent = build_agent()
     return _agent
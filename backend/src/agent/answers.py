@@ -0,0 +1,116 @@
+# src/agent/answers.py
+"""
+Cache de respostas do assistente.
+
+Perguntas quase idênticas ("qual a situação da placa X?") se repetem ao longo da hora.
+A chave combina a pergunta normalizada, o contexto (veículo/cliente e janelas) e um
+token de frescor: o último evento daquele veículo/cliente mais a contagem de eventos.
+Quando chega DTC novo o token muda e a resposta antiga deixa de ser usada. As respostas
+ficam no cache compartilhado (valem para todos os workers) por
+ASSISTANT_ANSWER_CACHE_TTL_SECONDS.
+
+O token em si fica no cache compartilhado por ASSISTANT_FRESHNESS_TTL_SECONDS, então
+perguntas repetidas não consultam o BigQuery a cada pedido; um DTC novo passa a valer
+para o cache de respostas em até esse tempo.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, Dict
+
+from src.services import bq_client
+from src.services.shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ASSISTANT_ANSWER_CACHE_TTL_SECONDS", 3600))
+# janela usada para o token de frescor (a mesma do resumo padrão das tools)
+FRESHNESS_DAYS = 30
+FRESHNESS_TTL_SECONDS = float(os.getenv("ASSISTANT_FRESHNESS_TTL_SECONDS", 60))
+_FRESHNESS = "answer_freshness"
+_ANSWERS = "answers"
+
+# placa Mercosul (ABC1D23) ou antiga (ABC-1234)
+_PLATE_RE = re.compile(r"\b([A-Z]{3}-?\d[A-Z0-9]\d{2})\b")
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "skipped": 0}
+
+
+def normalize_prompt(text: str) -> str:
+    """Minúsculas, sem acentos, espaços colapsados e sem pontuação nas pontas."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.strip(" ?!.,;:")
+
+
+def vehicle_from_prompt(text: str) -> str | None:
+    """Placa citada no texto da pergunta (sem hífen), se houver."""
+    match = _PLATE_RE.search((text or "").upper())
+    return match.group(1).replace("-", "") if match else None
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def freshness_token(vehicle: str, customer: str) -> Dict[str, Any]:
+    """Último evento + contagem do veículo/cliente, guardado por FRESHNESS_TTL_SECONDS."""
+    return shared_cache.get_or_set(
+        _FRESHNESS,
+        f"{vehicle}|{customer}",
+        lambda: bq_client.get_latest_event(vehicle, customer, days=FRESHNESS_DAYS),
+        FRESHNESS_TTL_SECONDS,
+    )
+
+
+def answer_key(prompt: str, vehicle_key: str | None = None, customer_name: str | None = None, **extra: Any) -> str | None:
+    """
+    Chave de cache da resposta, ou None se não der para garantir o frescor (falha na
+    consulta do último evento). Sem veículo/cliente (pergunta conceitual) vale só o TTL.
+    """
+    vehicle = (vehicle_key or vehicle_from_prompt(prompt) or "").strip().upper()
+    customer = (customer_name or "").strip().upper()
+
+    freshness: Dict[str, Any] = {}
+    if vehicle or customer:
+        try:
+            freshness = freshness_token(vehicle, customer)
+        except Exception:
+            logger.exception("Falha ao obter o token de frescor do cache de respostas")
+            _count("skipped")
+            return None
+
+    raw = json.dumps(
+        [normalize_prompt(prompt), vehicle, customer, sorted(extra.items()), freshness],
+        default=str,
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_answer(key: str | None) -> str | None:
+    if key is None:
+        return None
+    answer = shared_cache.get(_ANSWERS, key)
+    _count("hits" if answer is not None else "misses")
+    return answer
+
+
+def store_answer(key: str | None, answer: str) -> None:
+    if key is not None and answer:
+        shared_cache.set(_ANSWERS, key, answer, ANSWER_CACHE_TTL_SECONDS)
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        counters = dict(_stats)
+    return {"entries": shared_cache.count(_ANSWERS), **counters}
@@ -0,0 +1,179 @@
+# src/agent/compact.py
+"""
+Codificação compacta das respostas das tools para o LLM.
+
+Em vez de uma lista de dicts que repete as mesmas chaves e os mesmos valores em
+toda linha, devolvemos:
+
+    {
+      "header": {campos iguais em todas as linhas (placa, cliente, plano...)},
+      "dict":   {"dtc": {"P0100": "descrição"}, "fmi": {"3": "transcrição"}},
+      "cols":   ["start", "end", "events", "dtc", "fmi", ...],
+      "rows":   [["2024-05-01 10:00:00", "2024-05-01 10:40:00", 37, "P0100", 3, ...], ...]
+    }
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Mapping, Sequence
+
+# instrução única para o modelo entender o formato (vai no system prompt)
+FORMAT_HINT = (
+    "As ferramentas devolvem tabelas compactas: `cols` nomeia as posições de cada linha de `rows`; "
+    "`header` traz campos comuns a todas as linhas (veículo, cliente, plano); "
+    "`dict` traduz códigos (dtc, fmi) para a descrição."
+)
+
+
+def short_ts(v) -> str | None:
+    """Formata timestamp de forma curtinha para não inflar o payload do LLM."""
+    if v is None:
+        return None
+    try:
+        return str(v).replace("T", " ")[:19]
+    except Exception:
+        return str(v)
+
+
+# ----------------------- linhas slim -----------------------
+VEHICLE_HEADER = ("plate", "customer", "plan_active", "plan_type")
+CODE_DICTS = {"dtc": "dtc_description", "fmi": "fmi_pt"}
+
+DTC_EVENT_COLS = ("timestamp", "dtc", "fmi", "spn", "status")
+DTC_EPISODE_COLS = ("start", "end", "events", "dtc", "fmi", "spn", "last_status")
+TELEMETRY_RAW_COLS = ("time", "spn", "fmi", "dtc", "status")
+TELEMETRY_BUCKET_COLS = ("time", "events", "dtcs", "first_status", "last_status")
+
+
+def slim_dtc_event(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "timestamp": short_ts(r.get("ts") or r.get("timestamp") or r.get("time")),
+        "dtc": r.get("dtc"),
+        "fmi": r.get("fmi"),
+        "spn": r.get("spn"),
+        "status": r.get("status"),
+        "plate": r.get("plate"),
+        "customer": r.get("customer_name"),
+        "plan_active": r.get("plan_active"),
+        "plan_type": r.get("plan_type"),
+        "dtc_description": r.get("dtc_description"),
+        "fmi_pt": r.get("fmi_pt"),
+    }
+
+
+def slim_dtc_episode(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "start": short_ts(r.get("start_ts")),
+        "end": short_ts(r.get("end_ts")),
+        "events": r.get("events"),
+        "dtc": r.get("dtc"),
+        "fmi": r.get("fmi"),
+        "spn": r.get("spn"),
+        "last_status": r.get("last_status"),
+        "plate": r.get("plate"),
+        "customer": r.get("customer_name"),
+        "plan_active": r.get("plan_active"),
+        "plan_type": r.get("plan_type"),
+        "dtc_description": r.get("dtc_description"),
+        "fmi_pt": r.get("fmi_pt"),
+    }
+
+
+def slim_telemetry_point(p: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "time": short_ts(p.get("time")),
+        "spn": p.get("spn"),
+        "fmi": p.get("fmi"),
+        "dtc": p.get("dtc"),
+        "status": p.get("status"),
+    }
+
+
+def slim_telemetry_bucket(p: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "time": short_ts(p.get("time")),
+        "events": p.get("events"),
+        "dtcs": list(p.get("dtcs") or []),
+        "first_status": p.get("first_status"),
+        "last_status": p.get("last_status"),
+    }
+
+
+SUMMARY_HEADER = ("plate", "customer_name", "chassi_last8", "plan_active", "plan_type")
+SUMMARY_DICTS = {**CODE_DICTS, "status_label": "recommended_action"}
+SUMMARY_COLS = (
+    "dtc", "fmi", "spn", "status_label", "severity", "can_run", "events_total", "ev_24h",
+    "ev_7d", "days_with_events", "first_seen", "last_seen", "gap_hours_since_last",
+)
+CUSTOMER_SUMMARY_COLS = (
+    "plate", "dtc", "fmi", "status_label", "events_total", "ev_24h", "ev_7d",
+    "days_with_events", "last_seen", "plan_active",
+)
+
+
+def slim_summary(r: Dict[str, Any]) -> Dict[str, Any]:
+    gap = r.get("gap_hours_since_last")
+    return {
+        **{k: r.get(k) for k in SUMMARY_HEADER},
+        "dtc": r.get("dtc"),
+        "fmi": r.get("fmi"),
+        "spn": r.get("spn"),
+        "dtc_description": r.get("dtc_description"),
+        "fmi_pt": r.get("fmi_pt"),
+        "status_label": r.get("status_label"),
+        "events_total": r.get("events_total"),
+        "ev_24h": r.get("ev_24h"),
+        "ev_7d": r.get("ev_7d"),
+        "days_with_events": r.get("days_with_events"),
+        "first_seen": short_ts(r.get("first_seen_utc")),
+        "last_seen": short_ts(r.get("last_seen_utc")),
+        "gap_hours_since_last": round(gap, 1) if isinstance(gap, (int, float)) else None,
+        "recommended_action": r.get("recommended_action"),
+    }
+
+
+# ----------------------- codificação -----------------------
+def _same_value(rows: Sequence[Mapping[str, Any]], field: str) -> bool:
+    first = rows[0].get(field)
+    return all(r.get(field) == first for r in rows)
+
+
+def encode_rows(
+    rows: Sequence[Mapping[str, Any]],
+    columns: Iterable[str],
+    header_fields: Iterable[str] = (),
+    dictionaries: Mapping[str, str] | None = None,
+) -> Dict[str, Any]:
+    """
+    rows:          linhas (dicts) já no formato 'slim'.
+    columns:       colunas que vão em cada linha, na ordem.
+    header_fields: campos que costumam ser constantes; vão para `header` quando de fato
+                   forem iguais em todas as linhas, senão viram colunas normais.
+    dictionaries:  {campo_código: campo_descrição}; a descrição sai das linhas e vai
+                   para `dict[campo_código][código]`.
+    """
+    cols: List[str] = list(columns)
+    header: Dict[str, Any] = {}
+    for field in header_fields:
+        if rows and not _same_value(rows, field):
+            cols.append(field)
+        else:
+            header[field] = rows[0].get(field) if rows else None
+
+    dicts: Dict[str, Dict[str, Any]] = {}
+    for code_field, desc_field in (dictionaries or {}).items():
+        mapping: Dict[str, Any] = {}
+        for r in rows:
+            code, desc = r.get(code_field), r.get(desc_field)
+            if code is not None and desc is not None:
+                mapping.setdefault(str(code), desc)
+        if mapping:
+            dicts[code_field] = mapping
+
+    out: Dict[str, Any] = {}
+    if header:
+        out["header"] = header
+    if dicts:
+        out["dict"] = dicts
+    out["cols"] = cols
+    out["rows"] = [[r.get(c) for c in cols] for r in rows]
+    return out
@@ -0,0 +1,291 @@
+# src/agent/pool.py
+"""
+Pool de agentes para o assistente.
+
+Um executor dedicado com N workers, e cada worker tem a sua instância de Agent.
+Assim as conversas não disputam o mesmo objeto e as chamadas ao LLM não ocupam o
+threadpool do FastAPI que atende os dashboards.
+
+Controle de admissão: no máximo N em execução e ASSISTANT_QUEUE_MAX na fila.
+Acima disso, `AssistantBusy` (a API responde 429 com Retry-After). Um pedido que
+espera na fila mais que ASSISTANT_QUEUE_TIMEOUT_SECONDS é descartado do mesmo jeito.
+Quem precisa decidir algo caro antes de rodar (ex.: a chave do cache de respostas,
+que consulta o BigQuery) reserva o lugar com `admit()` e o passa a run/stream, ou o
+devolve com `release()`; assim um pedido recusado não chega a custar a consulta.
+
+A execução tem limite de ASSISTANT_RUN_TIMEOUT_SECONDS, cobrado dentro do worker: o
+prazo vai para src.agent.agent.run_deadline (as tools param de consultar), cada
+chamada ao modelo tem timeout próprio e o streaming fecha o gerador do agente ao
+passar do prazo. Assim o worker é liberado, e não só o pedido HTTP. O streaming
+repassa no máximo _STREAM_BUFFER itens adiantados; acima disso o worker espera o cliente.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Tuple, TypeVar
+
+from agno.agent import Agent
+
+from src.agent.agent import build_agent, run_deadline
+
+POOL_SIZE = int(os.getenv("ASSISTANT_POOL_SIZE", 4))
+QUEUE_MAX = int(os.getenv("ASSISTANT_QUEUE_MAX", 16))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("ASSISTANT_QUEUE_TIMEOUT_SECONDS", 30))
+RUN_TIMEOUT_SECONDS = float(os.getenv("ASSISTANT_RUN_TIMEOUT_SECONDS", 120))
+
+T = TypeVar("T")
+_DONE = object()
+# itens do streaming à frente do cliente; o worker espera quando enche
+_STREAM_BUFFER = 64
+# de quanto em quanto tempo o worker bloqueado no buffer confere se o cliente saiu
+_PUSH_POLL_SECONDS = 0.5
+
+
+class AssistantBusy(Exception):
+    """Pool saturado (ou pedido velho demais na fila)."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Assistente ocupado")
+        self.retry_after = retry_after
+
+
+class AssistantTimeout(Exception):
+    """Pedido passou do tempo limite de execução."""
+
+
+class Admission:
+    """Lugar reservado no pool por AgentPool.admit(): usado por run/stream ou devolvido com release()."""
+
+    def __init__(self, pool: "AgentPool", queued: bool):
+        self.queued = queued  # todos os workers estavam ocupados na reserva
+        self._pool = pool
+        self._held = True
+        self._lock = threading.Lock()
+
+    def _take(self) -> None:
+        with self._lock:
+            if not self._held:
+                raise RuntimeError("Reserva do pool já usada ou devolvida")
+            self._held = False
+
+    def release(self) -> None:
+        """Devolve o lugar se ele não foi usado (chamar de novo não faz nada)."""
+        with self._lock:
+            held, self._held = self._held, False
+        if held:
+            self._pool._release()
+
+
+class AgentPool:
+    def __init__(
+        self,
+        factory: Callable[[], Agent],
+        size: int = POOL_SIZE,
+        max_queue: int = QUEUE_MAX,
+        queue_timeout: float = QUEUE_TIMEOUT_SECONDS,
+        run_timeout: float = RUN_TIMEOUT_SECONDS,
+    ):
+        self.size = max(1, int(size))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self.run_timeout = float(run_timeout)
+        self._factory = factory
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="assistant")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = 0  # admitidos e ainda não terminados (fila + execução)
+        self._active = 0
+        self._avg_run = 10.0  # média móvel da duração (s), base do Retry-After
+        self._counters = {"completed": 0, "rejected": 0, "expired": 0, "timeouts": 0, "errors": 0}
+
+    # ------------------------- instância por worker -------------------------
+    def agent(self) -> Agent:
+        """Agent do worker atual (criado na primeira chamada)."""
+        agent = getattr(self._local, "agent", None)
+        if agent is None:
+            agent = self._local.agent = self._factory()
+        return agent
+
+    # ------------------------------ admissão --------------------------------
+    def retry_after(self) -> int:
+        with self._lock:
+            queued = max(0, self._pending - self._active)
+            avg = self._avg_run
+        return max(1, min(60, math.ceil(avg * (queued + 1) / self.size)))
+
+    def _admit(self) -> bool:
+        """Reserva um lugar ou levanta AssistantBusy. True se este pedido vai esperar na fila."""
+        with self._lock:
+            if self._pending >= self.size + self.max_queue:
+                self._counters["rejected"] += 1
+                rejected = queued = True
+            else:
+                # todos os workers já têm pedido: este entra na fila (o executor é FIFO)
+                queued = self._pending >= self.size
+                self._pending += 1
+                rejected = False
+        if rejected:
+            raise AssistantBusy(self.retry_after())
+        return queued
+
+    def admit(self) -> Admission:
+        """Reserva um lugar agora (AssistantBusy se não houver) para um run/stream logo depois."""
+        return Admission(self, self._admit())
+
+    def _release(self, _future: Future | None = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _call(self, fn: Callable[[], T], enqueued_at: float) -> T:
+        if time.monotonic() - enqueued_at > self.queue_timeout:
+            self._count("expired")
+            raise AssistantBusy(self.retry_after())
+        with self._lock:
+            self._active += 1
+        started = time.monotonic()
+        token = run_deadline.set(started + self.run_timeout)
+        ok = False
+        try:
+            result = fn()
+            ok = True
+            return result
+        finally:
+            run_deadline.reset(token)
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._active -= 1
+                self._avg_run = 0.8 * self._avg_run + 0.2 * elapsed
+                self._counters["completed" if ok else "errors"] += 1
+
+    def submit(self, fn: Callable[[], T], admission: Admission | None = None) -> Future:
+        """Enfileira `fn` num worker. Levanta AssistantBusy se o pool estiver cheio (sem `admission`)."""
+        return self._submit(fn, admission)[0]
+
+    def _submit(self, fn: Callable[[], T], admission: Admission | None = None) -> Tuple[Future, bool]:
+        if admission is None:
+            queued = self._admit()
+        else:
+            admission._take()
+            queued = admission.queued
+        try:
+            # leva o contexto do pedido (ex.: chamador do escalonador de consultas) para o worker
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, self._call, fn, time.monotonic())
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future, queued
+
+    # ------------------------------ execução --------------------------------
+    async def run(self, fn: Callable[[], T], admission: Admission | None = None) -> T:
+        """Executa `fn` num worker e aguarda sem bloquear o event loop."""
+        future = self.submit(fn, admission)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), self.queue_timeout + self.run_timeout
+            )
+        except asyncio.TimeoutError as exc:
+            # se ainda estava na fila, sai dela; se já rodava, o resultado é descartado
+            future.cancel()
+            self._count("timeouts")
+            raise AssistantTimeout() from exc
+
+    def stream(
+        self, gen_fn: Callable[[], Iterator[T]], admission: Admission | None = None
+    ) -> Tuple[AsyncIterator[T], bool]:
+        """
+        Consome o gerador `gen_fn()` num worker e repassa os itens ao event loop.
+        A admissão acontece já aqui, ou antes com admit() (antes de a resposta começar), para dar 429 a tempo.
+        Se o cliente desconecta ou o tempo estoura, o gerador é fechado no worker.
+        Devolve (itens, se este pedido ficou na fila esperando um worker).
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_STREAM_BUFFER)
+        stop = threading.Event()
+
+        def push(item: Any) -> None:
+            if stop.is_set():  # ninguém mais consome
+                return
+            try:
+                pending = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            except RuntimeError:  # loop já encerrado; ninguém mais consome
+                return
+            while True:
+                try:
+                    pending.result(_PUSH_POLL_SECONDS)
+                    return
+                except FutureTimeout:
+                    if stop.is_set():  # cliente saiu com o buffer cheio
+                        pending.cancel()
+                        return
+
+        def pump() -> None:
+            deadline = run_deadline.get()
+            gen = gen_fn()
+            try:
+                for item in gen:
+                    if stop.is_set():
+                        break
+                    push(item)
+                    if deadline is not None and time.monotonic() > deadline:
+                        # fecha o gerador (e a execução do agente dentro dele) no worker
+                        self._count("timeouts")
+                        push(AssistantTimeout())
+                        break
+            finally:
+                gen.close()
+
+        def finished(future: Future) -> None:
+            if future.cancelled():
+                push(AssistantTimeout())
+            elif future.exception() is not None:
+                push(future.exception())
+            push(_DONE)
+
+        future, queued = self._submit(pump, admission)
+        future.add_done_callback(finished)
+
+        async def drain() -> AsyncIterator[T]:
+            deadline = loop.time() + self.queue_timeout + self.run_timeout
+            try:
+                while True:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                    if item is _DONE:
+                        return
+                    if isinstance(item, BaseException):
+                        raise item
+                    yield item
+            except asyncio.TimeoutError as exc:
+                self._count("timeouts")
+                raise AssistantTimeout() from exc
+            finally:
+                stop.set()
+                future.cancel()
+
+        return drain(), queued
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queued": max(0, self._pending - self._active),
+                "avg_run_seconds": round(self._avg_run, 2),
+                **self._counters,
+            }
+
+
+agent_pool = AgentPool(build_agent)
@@ -0,0 +1,122 @@
+# src/agent/sessions.py
+"""
+Sessões de conversa do assistente.
+
+Cada sessão guarda um histórico curto (últimos N turnos) e um memo dos resultados
+das tools com TTL curto: follow-ups sobre o mesmo caminhão não voltam ao BigQuery.
+Histórico e memo ficam no cache compartilhado (src/services/shared_cache.py), então
+a conversa continua em qualquer worker do uvicorn. A sessão expira por inatividade
+(cada pedido renova); o memo expira sozinho. Com o cache compartilhado desligado, as
+sessões ficam num LRU em memória do processo (ASSISTANT_SESSION_MAX).
+
+A sessão pertence a quem a criou (o chamador, ver _caller_id na API): um session_id
+desconhecido ou de outro dono não é aceito, e o pedido recebe uma sessão nova com
+outro id. O id é sempre gerado aqui, nunca o que o cliente mandou.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Tuple
+
+from src.services.cache import TTLCache
+from src.services.shared_cache import MISSING, shared_cache
+
+SESSION_MAX = int(os.getenv("ASSISTANT_SESSION_MAX", 500))
+SESSION_IDLE_SECONDS = float(os.getenv("ASSISTANT_SESSION_IDLE_SECONDS", 2 * 3600))
+SESSION_HISTORY_TURNS = int(os.getenv("ASSISTANT_SESSION_HISTORY_TURNS", 6))
+SESSION_TOOL_TTL_SECONDS = float(os.getenv("ASSISTANT_SESSION_TOOL_TTL_SECONDS", 300))
+SESSION_TOOL_MAX = int(os.getenv("ASSISTANT_SESSION_TOOL_MAX", 32))
+
+# limite de caracteres por mensagem guardada no histórico (não inflar o prompt)
+_HISTORY_CHARS = 1500
+
+_SESSIONS = "sessions"
+_TOOLS = "session_tools"
+
+
+class Session:
+    def __init__(self, session_id: str, history: Iterable[Tuple[str, str]] = (), owner: str | None = None):
+        self.id = session_id
+        self.owner = owner
+        self.history: Deque[Tuple[str, str]] = deque(history, maxlen=SESSION_HISTORY_TURNS * 2)
+        self._lock = threading.Lock()
+
+    def remember(self, question: str, answer: str) -> None:
+        with self._lock:
+            self.history.append(("Usuário", question[:_HISTORY_CHARS]))
+            self.history.append(("Assistente", answer[:_HISTORY_CHARS]))
+        _save(self)
+
+    def history_block(self) -> str:
+        with self._lock:
+            turns = list(self.history)
+        if not turns:
+            return ""
+        lines = [f"{role}: {text}" for role, text in turns]
+        return "Histórico recente desta conversa:\n" + "\n".join(lines)
+
+
+# só quando o cache compartilhado está desligado
+_local_sessions = TTLCache(maxsize=SESSION_MAX, ttl=SESSION_IDLE_SECONDS)
+_local_tools = TTLCache(maxsize=SESSION_MAX * SESSION_TOOL_MAX, ttl=SESSION_TOOL_TTL_SECONDS)
+
+
+def _load(session_id: str) -> Dict[str, Any] | None:
+    if shared_cache.enabled:
+        return shared_cache.get(_SESSIONS, session_id)
+    return _local_sessions.get(session_id)
+
+
+def _save(session: Session) -> None:
+    with session._lock:
+        state = {"history": list(session.history), "owner": session.owner}
+    if shared_cache.enabled:
+        shared_cache.set(_SESSIONS, session.id, state, SESSION_IDLE_SECONDS)
+    else:
+        _local_sessions.set(session.id, state)
+
+
+def get_session(session_id: str | None = None, owner: str | None = None) -> Session:
+    """Recupera (renovando a inatividade) a sessão de `owner`, ou cria uma nova.
+
+    Sem id, com id desconhecido ou de outro dono, cria uma sessão nova com id novo.
+    """
+    sid = (session_id or "").strip()
+    state = _load(sid) if sid else None
+    if state is None or state.get("owner") != owner:
+        sid, state = uuid.uuid4().hex, {}
+    session = Session(sid, state.get("history") or (), owner)
+    _save(session)
+    return session
+
+
+def find_session(session_id: str | None) -> Session | None:
+    if not session_id:
+        return None
+    state = _load(session_id)
+    return None if state is None else Session(session_id, state.get("history") or (), state.get("owner"))
+
+
+def with_history(session: Session, prompt: str) -> str:
+    block = session.history_block()
+    if not block:
+        return prompt
+    return f"{block}\n\nMensagem atual:\n{prompt}"
+
+
+def memoize(session_id: str | None, name: str, args: Tuple[Any, ...], fn: Callable[[], Any]) -> Any:
+    """Resultado de tool memoizado na sessão (TTL curto). Sem sessão, só executa."""
+    if find_session(session_id) is None:
+        return fn()
+    key = f"{session_id}|{name}|{json.dumps(args, default=str, ensure_ascii=False)}"
+    if not shared_cache.enabled:
+        return _local_tools.get_or_set(key, fn)
+    value = shared_cache.get(_TOOLS, key, MISSING)
+    if value is MISSING:
+        value = fn()
+        shared_cache.set(_TOOLS, key, value, SESSION_TOOL_TTL_SECONDS)
+    return value
@@ -0,0 +1,481 @@
+# src/agent/triage.py
+"""
+Triagem em lote: um relatório consolidado para um cliente ou para uma lista de veículos.
+
+    python -m src.agent.triage --customer "Transportes X" --format md --out triagem.md
+    python -m src.agent.triage --vehicles ABC1D23,DEF4G56 --days 30
+
+1. Os resumos por DTC/FMI saem de UMA consulta (get_customer_summary ou
+   get_dtc_summary_batch). Os rótulos de persistência vêm dela e a severidade da kb.
+   Com lista de veículos, o snapshot de falhas (src/services/fault_snapshot.py)
+   responde primeiro, e só as chaves que faltam vão ao BigQuery.
+2. Só os veículos com falha ativa (persistente/intermitente) passam pelo agente.
+   A concorrência é limitada (TRIAGE_CONCURRENCY) e há um limite de chamadas por
+   minuto ao modelo (TRIAGE_REQUESTS_PER_MINUTE).
+   Os agentes da triagem são próprios e não ocupam o pool do chat (src/agent/pool.py).
+3. Cada análise concluída é gravada num checkpoint JSONL em CACHE_DIR/triage/.
+   Rodar de novo o mesmo job (mesmos parâmetros no mesmo dia, ou --job-id) retoma
+   do ponto em que parou.
+
+A API expõe o mesmo fluxo como job assíncrono (POST /triage/jobs). O job roda no
+worker que recebeu o pedido; o estado vai para o cache compartilhado, então qualquer
+worker responde GET /triage/jobs/{id}.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from src.agent.agent import STATUS_RANK, build_agent, rank_faults
+from src.agent.compact import SUMMARY_COLS, SUMMARY_DICTS, SUMMARY_HEADER, encode_rows
+from src.services import bq_client
+from src.services import config
+from src.services import disk_cache
+from src.services import kb as kb_service
+from src.services.fault_snapshot import fault_snapshot
+from src.services.shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+TRIAGE_CONCURRENCY = int(os.getenv("TRIAGE_CONCURRENCY", 4))
+TRIAGE_REQUESTS_PER_MINUTE = float(os.getenv("TRIAGE_REQUESTS_PER_MINUTE", 60))
+TRIAGE_RETRIES = int(os.getenv("TRIAGE_RETRIES", 2))
+TRIAGE_DIR = os.path.join(config.CACHE_DIR, "triage")
+
+# quantas falhas por veículo vão para o prompt e para o relatório
+_FAULTS_PER_VEHICLE = 20
+_ACTIVE = ("persistente", "intermitente")
+PRIORITIES = ("crítica", "alta", "média", "baixa")
+
+
+# ------------------------------ limite de taxa ------------------------------
+class RateLimiter:
+    """Espaça as chamadas para no máximo `per_minute` por minuto (entre todas as threads)."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if wait:
+            time.sleep(wait)
+
+
+# -------------------------------- checkpoint --------------------------------
+class Checkpoint:
+    """Análises concluídas, uma por linha (JSONL, append + fsync)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        done: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # linha truncada por queda no meio da escrita
+                        continue
+                    done[record["vehicle_key"]] = record
+        except FileNotFoundError:
+            pass
+        return done
+
+    def append(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(line)
+                fh.flush()
+                os.fsync(fh.fileno())
+
+
+# --------------------------------- resumos ----------------------------------
+def job_id_for(customer_name: Optional[str], vehicle_keys: Optional[List[str]], days: int) -> str:
+    """Mesmos parâmetros no mesmo dia (UTC, igual em todos os workers) -> mesmo job (é o que permite retomar)."""
+    return disk_cache.make_key(
+        customer=(customer_name or "").strip().upper(),
+        vehicles=sorted({(k or "").strip().upper() for k in vehicle_keys or [] if (k or "").strip()}),
+        days=days,
+        day=datetime.now(timezone.utc).date().isoformat(),
+    )[:16]
+
+
+def collect_summaries(
+    customer_name: Optional[str] = None,
+    vehicle_keys: Optional[List[str]] = None,
+    days: int = 30,
+) -> tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """{vehicle_key: {"vehicle", "faults"}} + erros por chave, com uma consulta só."""
+    vehicles: Dict[str, Dict[str, Any]] = {}
+    if vehicle_keys:
+        # o snapshot local responde pelos veículos com falha na janela; o resto vai ao BigQuery
+        snapshot = fault_snapshot.vehicle_summaries(vehicle_keys, days=days) or {}
+        for key, item in snapshot.items():
+            vehicles[key] = {"vehicle": item["vehicle"], "faults": rank_faults(item["summary"])}
+        missing = [k for k in vehicle_keys if (k or "").strip().upper() not in snapshot]
+        if not missing:
+            return vehicles, {}
+        batch = bq_client.get_dtc_summary_batch(missing, days=days)
+        for key, item in batch["items"].items():
+            vehicles[key] = {"vehicle": item["vehicle"], "faults": rank_faults(item["summary"])}
+        return vehicles, batch["errors"]
+
+    rows = bq_client.get_customer_summary(customer_name=customer_name or "", days=days) or []
+    by_plate: Dict[str, List[Dict[str, Any]]] = {}
+    for r in rows:
+        by_plate.setdefault(r.get("plate") or r.get("imei") or "?", []).append(r)
+    for plate, plate_rows in by_plate.items():
+        first = plate_rows[0]
+        vehicle = {k: first.get(k) for k in ("plate", "imei", "customer_name", "plan_active", "plan_type")}
+        vehicles[plate] = {"vehicle": vehicle, "faults": rank_faults(plate_rows)}
+    return vehicles, {}
+
+
+def priority_for(persistent: int, intermittent: int, max_weight: int) -> str:
+    """Prioridade do veículo (mesma regra na triagem em lote e no ranking da frota)."""
+    if persistent and max_weight >= kb_service.SEVERITY_WEIGHTS["alta"]:
+        return "crítica"
+    if persistent:
+        return "alta"
+    if intermittent:
+        return "média"
+    return "baixa"
+
+
+def score_vehicle(faults: List[Dict[str, Any]]) -> Dict[str, Any]:
+    counts = {label: 0 for label in STATUS_RANK}
+    for f in faults:
+        counts[f.get("status_label")] = counts.get(f.get("status_label"), 0) + 1
+    active = [f for f in faults if f.get("status_label") in _ACTIVE]
+    max_weight = max((kb_service.severity_weight(f.get("severity")) for f in active), default=0)
+    persistent = counts.get("persistente", 0)
+    priority = priority_for(persistent, counts.get("intermitente", 0), max_weight)
+
+    top = next((f.get("severity") for f in active if kb_service.severity_weight(f.get("severity")) == max_weight), None)
+    return {
+        "priority": priority,
+        "persistent": persistent,
+        "intermittent": counts.get("intermitente", 0),
+        "resolved": counts.get("provavelmente resolvido", 0),
+        "max_severity": top,
+    }
+
+
+# --------------------------------- análise ----------------------------------
+def _triage_prompt(vehicle_key: str, faults: List[Dict[str, Any]], days: int) -> str:
+    payload = encode_rows(faults[:_FAULTS_PER_VEHICLE], SUMMARY_COLS, SUMMARY_HEADER, SUMMARY_DICTS)
+    return (
+        f"Triagem matinal do veículo {vehicle_key} (últimos {days} dias). "
+        "Use o resumo abaixo (já classificado; não chame ferramentas a menos que falte algo essencial) "
+        "e responda em no máximo 5 linhas: prioridade, falhas que exigem ação e próximo passo.\n"
+        + json.dumps(payload, ensure_ascii=False, default=str)
+    )
+
+
+def _analyze(
+    agent_for_thread: Callable[[], Any],
+    limiter: RateLimiter,
+    vehicle_key: str,
+    faults: List[Dict[str, Any]],
+    days: int,
+) -> str:
+    prompt = _triage_prompt(vehicle_key, faults, days)
+    for attempt in range(TRIAGE_RETRIES + 1):
+        limiter.acquire()
+        try:
+            result = agent_for_thread().run(prompt)
+            content = getattr(result, "content", result)
+            return str(content or "").strip()
+        except Exception:
+            if attempt >= TRIAGE_RETRIES:
+                raise
+            logger.warning("Triagem de %s falhou (tentativa %s); repetindo", vehicle_key, attempt + 1)
+            time.sleep(5 * 2 ** attempt)
+    return ""  # inalcançável
+
+
+def run_triage(
+    customer_name: Optional[str] = None,
+    vehicle_keys: Optional[List[str]] = None,
+    days: int = 30,
+    job_id: Optional[str] = None,
+    concurrency: int = TRIAGE_CONCURRENCY,
+    requests_per_minute: float = TRIAGE_REQUESTS_PER_MINUTE,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, Any]:
+    if not customer_name and not vehicle_keys:
+        raise ValueError("Informe um cliente ou uma lista de veículos.")
+
+    job_id = job_id or job_id_for(customer_name, vehicle_keys, days)
+    checkpoint = Checkpoint(os.path.join(TRIAGE_DIR, f"{job_id}.jsonl"))
+    done = checkpoint.load()
+
+    vehicles, errors = collect_summaries(customer_name, vehicle_keys, days)
+    scores = {key: score_vehicle(v["faults"]) for key, v in vehicles.items()}
+    pending = [k for k, sc in scores.items() if (sc["persistent"] or sc["intermittent"]) and k not in done]
+    total = sum(1 for sc in scores.values() if sc["persistent"] or sc["intermittent"])
+    finished = total - len(pending)
+    if progress:
+        progress(finished, total)
+
+    local = threading.local()
+
+    def agent_for_thread():
+        agent = getattr(local, "agent", None)
+        if agent is None:
+            agent = local.agent = build_agent()
+        return agent
+
+    limiter = RateLimiter(requests_per_minute)
+    failures: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="triage-agent") as pool:
+        futures = {
+            pool.submit(_analyze, agent_for_thread, limiter, key, vehicles[key]["faults"], days): key
+            for key in pending
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                record = {"vehicle_key": key, "analysis": future.result()}
+            except Exception as exc:
+                logger.exception("Triagem de %s falhou", key)
+                failures[key] = str(exc) or exc.__class__.__name__
+            else:
+                checkpoint.append(record)
+                done[key] = record
+            finished += 1
+            if progress:
+                progress(finished, total)
+
+    report = _build_report(job_id, customer_name, vehicle_keys, days, vehicles, scores, done, errors, failures)
+    _write_json(os.path.join(TRIAGE_DIR, f"{job_id}.report.json"), report)
+    return report
+
+
+# -------------------------------- relatório ---------------------------------
+def _build_report(job_id, customer_name, vehicle_keys, days, vehicles, scores, done, errors, failures) -> Dict[str, Any]:
+    items = []
+    for key, entry in vehicles.items():
+        score = scores[key]
+        items.append({
+            "vehicle_key": key,
+            **{k: entry["vehicle"].get(k) for k in ("plate", "customer_name", "plan_active", "plan_type")},
+            **score,
+            "faults": [f for f in entry["faults"] if f.get("status_label") in _ACTIVE][:_FAULTS_PER_VEHICLE],
+            "analysis": (done.get(key) or {}).get("analysis"),
+            "error": failures.get(key),
+        })
+    items.sort(
+        key=lambda i: (
+            PRIORITIES.index(i["priority"]),
+            -i["persistent"],
+            -kb_service.severity_weight(i["max_severity"]) if i["max_severity"] else 0,
+            -i["intermittent"],
+        )
+    )
+
+    totals = {p: sum(1 for i in items if i["priority"] == p) for p in PRIORITIES}
+    return {
+        "job_id": job_id,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "params": {"customer_name": customer_name, "vehicle_keys": vehicle_keys, "days": days},
+        "totals": {"vehicles": len(items), **totals, "not_found": len(errors), "failed": len(failures)},
+        "vehicles": items,
+        "errors": errors,
+    }
+
+
+def _write_json(path: str, data: Any) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def load_report(job_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(TRIAGE_DIR, f"{job_id}.report.json"), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def render_markdown(report: Dict[str, Any]) -> str:
+    t = report["totals"]
+    lines = [
+        f"# Triagem DTC — {report['generated_at'][:10]}",
+        "",
+        f"{t['vehicles']} veículos · crítica {t['crítica']} · alta {t['alta']} · média {t['média']} · baixa {t['baixa']}",
+        "",
+    ]
+    for v in report["vehicles"]:
+        if v["priority"] == "baixa":
+            continue
+        title = v.get("plate") or v["vehicle_key"]
+        lines.append(f"## [{v['priority'].upper()}] {title} — {v.get('customer_name') or ''}".rstrip(" —"))
+        lines.append(
+            f"Persistentes: {v['persistent']} · intermitentes: {v['intermittent']} · "
+            f"severidade máx.: {v.get('max_severity') or '-'}"
+        )
+        for f in v["faults"][:5]:
+            lines.append(
+                f"- {f.get('dtc')}/FMI {f.get('fmi')} ({f.get('status_label')}, {f.get('severity') or '-'}): "
+                f"{f.get('dtc_description') or ''}"
+            )
+        if v.get("analysis"):
+            lines += ["", v["analysis"]]
+        elif v.get("error"):
+            lines += ["", f"_Análise indisponível: {v['error']}_"]
+        lines.append("")
+    if report.get("errors"):
+        lines.append("Não encontrados: " + ", ".join(sorted(report["errors"])))
+    return "\n".join(lines).rstrip() + "\n"
+
+
+# -------------------------------- job (API) ---------------------------------
+_JOBS = "triage_jobs"
+_JOB_TTL_SECONDS = 24 * 3600
+
+# jobs deste processo; o estado de todos fica no cache compartilhado
+_jobs: Dict[str, Dict[str, Any]] = {}
+_jobs_lock = threading.Lock()
+_job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="triage-job")
+
+
+def _publish(state: Dict[str, Any]) -> None:
+    # chamado com _jobs_lock
+    shared_cache.set(_JOBS, state["job_id"], dict(state), _JOB_TTL_SECONDS)
+
+
+def _job_active(state: Optional[Dict[str, Any]]) -> bool:
+    """Enfileirado/rodando num processo que ainda existe (os workers estão no mesmo host)."""
+    if not state or state.get("status") not in ("queued", "running"):
+        return False
+    pid = int(state.get("pid") or 0)
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def submit_job(customer_name: Optional[str], vehicle_keys: Optional[List[str]], days: int = 30) -> Dict[str, Any]:
+    """Enfileira a triagem em segundo plano; o mesmo job em andamento não é duplicado."""
+    if not customer_name and not vehicle_keys:
+        raise ValueError("Informe um cliente ou uma lista de veículos.")
+    job_id = job_id_for(customer_name, vehicle_keys, days)
+    with _jobs_lock:
+        current = _jobs.get(job_id) or shared_cache.get(_JOBS, job_id)
+        if _job_active(current):
+            return dict(current)
+        _jobs[job_id] = state = {"job_id": job_id, "status": "queued", "done": 0, "total": None, "pid": os.getpid()}
+        _publish(state)
+
+    def progress(done: int, total: int) -> None:
+        with _jobs_lock:
+            state.update(status="running", done=done, total=total)
+            _publish(state)
+
+    def work() -> None:
+        try:
+            run_triage(customer_name, vehicle_keys, days, job_id=job_id, progress=progress)
+        except Exception as exc:
+            logger.exception("Job de triagem %s falhou", job_id)
+            with _jobs_lock:
+                state.update(status="failed", error=str(exc))
+                _publish(state)
+        else:
+            with _jobs_lock:
+                state.update(status="done")
+                _publish(state)
+
+    _job_executor.submit(work)
+    return dict(state)
+
+
+def job_status(job_id: str) -> Optional[Dict[str, Any]]:
+    with _jobs_lock:
+        state = dict(_jobs[job_id]) if job_id in _jobs else None
+    if state is None:
+        state = shared_cache.get(_JOBS, job_id)
+        if state is not None and state["status"] in ("queued", "running") and not _job_active(state):
+            # o worker que rodava o job saiu; submeter de novo retoma do checkpoint
+            state = {**state, "status": "failed", "error": "Job interrompido. Envie de novo para retomar."}
+    if state is None or state["status"] == "done":
+        report = load_report(job_id)
+        if report is not None:
+            return {"job_id": job_id, "status": "done", "report": report}
+    return state
+
+
+# ----------------------------------- CLI ------------------------------------
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Triagem de DTC em lote (cliente ou lista de veículos).")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--customer", help="nome (parcial) do cliente")
+    target.add_argument("--vehicles", help="placas/IMEIs/chassi-8 separados por vírgula")
+    target.add_argument("--vehicles-file", help="arquivo com uma chave de veículo por linha")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=TRIAGE_CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=TRIAGE_REQUESTS_PER_MINUTE, help="chamadas ao modelo por minuto")
+    parser.add_argument("--job-id", help="retoma/força um job específico")
+    parser.add_argument("--format", choices=("md", "json"), default="md")
+    parser.add_argument("--out", help="arquivo de saída (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    keys: Optional[List[str]] = None
+    if args.vehicles:
+        keys = [k for k in args.vehicles.split(",") if k.strip()]
+    elif args.vehicles_file:
+        with open(args.vehicles_file, encoding="utf-8") as fh:
+            keys = [line.strip() for line in fh if line.strip()]
+
+    def progress(done: int, total: int) -> None:
+        print(f"\rtriagem: {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    report = run_triage(
+        customer_name=args.customer,
+        vehicle_keys=keys,
+        days=args.days,
+        job_id=args.job_id,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        progress=progress,
+    )
+    print(file=sys.stderr)
+
+    text = render_markdown(report) if args.format == "md" else json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
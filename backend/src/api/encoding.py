@@ -0,0 +1,231 @@
+# backend/src/api/encoding.py
+"""
+Codificação das respostas grandes (listas da visão geral e do histórico).
+
+- `format=json` (padrão): mesmo formato de sempre, serializado com orjson quando instalado.
+- `format=columnar`: um array por coluna (`data`). Colunas de texto repetitivo
+  (cliente, chassi, placa, descrição...) viram índices em `dictionaries`.
+- `format=arrow`: Arrow IPC stream (requer pyarrow); strings repetitivas como dictionary.
+  Sem pyarrow no servidor, a resposta sai em JSON (Content-Type diz qual veio).
+
+A compressão é negociada pelo Accept-Encoding: br (se o pacote brotli estiver instalado)
+ou gzip. orjson, brotli e pyarrow estão no requirements.txt; sem eles o serviço continua
+funcionando (json padrão, só gzip, sem arrow).
+
+A ETag de cada representação inclui o formato (ver `variant`), e uma resposta
+comprimida leva a ETag fraca (W/...): o conteúdo é o mesmo, só os bytes mudam.
+"""
+from __future__ import annotations
+
+import decimal
+import gzip
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from fastapi import HTTPException, Request, Response
+
+try:  # opcional: encoder JSON mais rápido
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:  # opcional: Content-Encoding br
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:  # opcional: format=arrow
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # pragma: no cover
+    pa = None
+    pa_ipc = None
+
+FORMATS = ("json", "columnar", "arrow")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+# abaixo disso a compressão não compensa
+MIN_COMPRESS_BYTES = 1024
+
+
+def check_format(fmt: str | None) -> str:
+    value = (fmt or "json").strip().lower()
+    if value not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido: {fmt}. Use {', '.join(FORMATS)}.")
+    if value == "arrow" and pa is None:
+        return "json"
+    return value
+
+
+def variant(fmt: str) -> str:
+    """Sufixo da ETag para o formato (json fica sem sufixo, como antes)."""
+    return "" if fmt == "json" else fmt
+
+
+# ------------------------------- JSON -------------------------------------
+def _default(value: Any) -> Any:
+    if isinstance(value, decimal.Decimal):
+        # NUMERIC inteiro do BigQuery (ex.: Decimal("5")) sai como 5, não 5.0
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# ----------------------------- colunar ------------------------------------
+def _columns(rows: Sequence[Mapping[str, Any]]) -> List[str]:
+    seen: Dict[str, None] = {}
+    for row in rows:
+        for key in row:
+            seen.setdefault(key, None)
+    return list(seen)
+
+
+def columnar(rows: Sequence[Mapping[str, Any]], columns: Sequence[str] | None = None) -> Dict[str, Any]:
+    """
+    {"length": n, "columns": [...], "data": {col: [...]}, "dictionaries": {col: [...]}}.
+    Uma coluna de texto vira dictionary quando tem no máximo metade de valores distintos.
+    Nesse caso `data[col]` guarda índices em `dictionaries[col]`, e null continua null.
+    """
+    cols = list(columns) if columns is not None else _columns(rows)
+    data: Dict[str, List[Any]] = {}
+    dictionaries: Dict[str, List[str]] = {}
+    for col in cols:
+        values = [row.get(col) for row in rows]
+        strings = [v for v in values if v is not None]
+        if strings and all(isinstance(v, str) for v in strings):
+            codes: Dict[str, int] = {}
+            encoded = [None if v is None else codes.setdefault(v, len(codes)) for v in values]
+            if len(codes) * 2 <= len(values):
+                data[col] = encoded
+                dictionaries[col] = list(codes)
+                continue
+        data[col] = values
+    return {"length": len(rows), "columns": cols, "data": data, "dictionaries": dictionaries}
+
+
+# ------------------------------ Arrow -------------------------------------
+def arrow_ipc(rows: Sequence[Mapping[str, Any]], metadata: Mapping[str, Any] | None = None) -> bytes:
+    table = columnar(rows)
+    arrays = []
+    for col in table["columns"]:
+        if col in table["dictionaries"]:
+            indices = pa.array(table["data"][col], type=pa.int32())
+            arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(table["dictionaries"][col], type=pa.string())))
+        else:
+            arrays.append(pa.array(table["data"][col]))
+    batch = pa.RecordBatch.from_arrays(arrays, names=table["columns"])
+    schema = batch.schema.with_metadata({"meta": dumps(dict(metadata))}) if metadata else batch.schema
+    sink = pa.BufferOutputStream()
+    with pa_ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+# ---------------------------- compressão ----------------------------------
+def _accepted(header: str | None) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def negotiate_encoding(header: str | None) -> str | None:
+    accepted = _accepted(header)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best = max(candidates, key=lambda enc: accepted.get(enc, accepted.get("*", 0.0)))
+    return best if accepted.get(best, accepted.get("*", 0.0)) > 0 else None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=5)
+
+
+# ----------------------------- resposta -----------------------------------
+def encoded_response(
+    request: Request,
+    response: Response,
+    payload: Any,
+    fmt: str,
+    to_columnar: Callable[[Any], Any] | None = None,
+    arrow_rows: Callable[[Any], Tuple[List[Dict], Mapping[str, Any] | None]] | None = None,
+) -> Response:
+    """
+    Monta a resposta final no formato pedido, já comprimida se o cliente aceitar.
+    `to_columnar(payload)` e `arrow_rows(payload) -> (rows, metadata)` adaptam o payload
+    de cada endpoint. Os headers já postos em `response` (ETag, X-Cache...) são mantidos.
+    Um Response pronto (ex.: 304) passa direto.
+    """
+    if isinstance(payload, Response):
+        return payload
+
+    if fmt == "arrow":
+        rows, metadata = arrow_rows(payload)
+        body, media_type = arrow_ipc(rows, metadata), ARROW_MEDIA_TYPE
+    else:
+        content = to_columnar(payload) if fmt == "columnar" else payload
+        body, media_type = dumps(content), "application/json"
+
+    headers = dict(response.headers)
+    headers.pop("content-length", None)
+    headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate_encoding(request.headers.get("accept-encoding")) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding:
+        body = _compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["etag"] = f"W/{etag}"
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+# ------------------------ payloads dos endpoints ---------------------------
+def flatten(items: Iterable[Mapping[str, Any]], child: str, parent_fields: Sequence[str]) -> List[Dict[str, Any]]:
+    """Uma linha por item de `item[child]`, repetindo os campos do pai (para tabelas Arrow)."""
+    return [
+        {**{field: item.get(field) for field in parent_fields}, **row}
+        for item in items
+        for row in item.get(child) or []
+    ]
+
+
+def overview_columnar(payload: Dict) -> Dict:
+    """/overview/dtc-events: tabela de veículos + tabela de eventos (coluna `vehicle` = índice do veículo)."""
+    items = payload["items"]
+    vehicles = [{k: v for k, v in item.items() if k != "events"} for item in items]
+    events = [{"vehicle": i, **event} for i, item in enumerate(items) for event in item.get("events") or []]
+    return {"format": "columnar", "vehicles": columnar(vehicles), "events": columnar(events)}
+
+
+def overview_arrow(payload: Dict) -> Tuple[List[Dict], None]:
+    return flatten(payload["items"], "events", ("customer_name", "chassi_last8", "plate")), None
+
+
+def history_columnar(payload: Dict) -> Dict:
+    """/history/events: `items` vira tabela; paginação e intervalo ficam como estão."""
+    meta = {k: v for k, v in payload.items() if k != "items"}
+    return {**meta, "format": "columnar", "items": columnar(payload["items"])}
+
+
+def history_arrow(payload: Dict) -> Tuple[List[Dict], Dict]:
+    return payload["items"], {k: v for k, v in payload.items() if k != "items"}
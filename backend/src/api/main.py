@@ -1,25 +1,72 @@
 # backend/src/api/main.py
-from datetime import date
+from contextlib import asynccontextmanager
+import csv
+from datetime import date, datetime, timedelta, timezone
+import hashlib
+import io
+import json
 import logging
 import os
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator
+from zoneinfo import ZoneInfo
 
 from fastapi import FastAPI
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from src.api import encoding
 from src.services import bq_client
+from src.services import breaker
+from src.services import config
+from src.services import disk_cache
+from src.services import geo
 from src.services import kb as kb_service
-from src.agent.agent import get_agent
+from src.services.analytics import dtc_analytics
+from src.services.fault_snapshot import fault_snapshot
+from src.services.leader import background_leader
+from src.services.live_feed import live_feed
+from src.services.result_sets import result_sets
+from src.services.rollups import rollup_refresher
+from src.services.scheduler import QueryQueueTimeout, caller_context, scheduler
+from src.services.shared_cache import shared_cache
+from src.services.warm_cache import warm_cache
+from src.agent import answers, triage
+from src.agent.agent import prefetch_context
+from src.agent.pool import Admission, AssistantBusy, AssistantTimeout, agent_pool
+from src.agent.sessions import Session, get_session, with_history
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="dtc-insights API")
+# jobs em segundo plano; cada um tem start()/stop() e só roda com o servidor no ar,
+# em um único worker do host (o que segura o lock de src/services/leader.py)
+_BACKGROUND_JOBS = (warm_cache, fault_snapshot, dtc_analytics, rollup_refresher)
+
+
+def _start_background_jobs() -> None:
+    for job in _BACKGROUND_JOBS:
+        job.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Inicia os jobs em segundo plano com o servidor (não no import: testes, CLIs e reloads não consultam o BigQuery)."""
+    warm_cache.pin(_default_views)
+    background_leader.start(_start_background_jobs)
+    try:
+        yield
+    finally:
+        background_leader.stop()
+        for job in reversed(_BACKGROUND_JOBS):
+            job.stop()
+
+
+app = FastAPI(title="dtc-insights API", lifespan=lifespan)
 
 origins_env = os.getenv("FRONTEND_ORIGINS", "http://localhost:5173")
 origins = [origin.strip() for origin in origins_env.split(",") if origin.strip()]
@@ -28,6 +75,7 @@ cors_kwargs: Dict[str, Any] = {
     "allow_credentials": True,
     "allow_methods": ["*"],
     "allow_headers": ["*"],
+    "expose_headers": ["X-Data-Stale", "X-Stale-Age", "X-Queue-Wait-Ms", "Retry-After"],
 }
 
 if not cors_kwargs["allow_origins"] or "*" in origins:
@@ -36,64 +84,563 @@ if not cors_kwargs["allow_origins"] or "*" in origins:
 
 app.add_middleware(CORSMiddleware, **cors_kwargs)
 
+
+def _caller_id(request: Request) -> str:
+    """Chave do chamador para o escalonador.
+
+    Headers do cliente não identificam ninguém (basta trocá-los para ganhar outra cota).
+    Só atrás de um proxy de TRUSTED_PROXIES vale o X-User (usuário autenticado no proxy)
+    e o IP original do X-Forwarded-For; fora isso, o IP da conexão.
+    """
+    host = request.client.host if request.client else None
+    if host in config.TRUSTED_PROXIES:
+        user = (request.headers.get("x-user") or "").strip().lower()
+        if user:
+            return f"user:{user}"
+        forwarded = [ip.strip() for ip in (request.headers.get("x-forwarded-for") or "").split(",") if ip.strip()]
+        # o último IP que não é de um proxy confiável é o cliente
+        for ip in reversed(forwarded):
+            if ip not in config.TRUSTED_PROXIES:
+                return f"ip:{ip}"
+    return f"ip:{host}" if host else "anonymous"
+
+
+@app.middleware("http")
+async def bq_request_context(request: Request, call_next):
+    """
+    Identifica o chamador para o escalonador de consultas e devolve o tempo na fila
+    (X-Queue-Wait-Ms). Se o BigQuery falhou e o pedido foi servido com o último
+    resultado bom, avisa nos headers.
+    """
+    with caller_context(_caller_id(request)) as queued, breaker.degradation() as degraded:
+        response = await call_next(request)
+    if queued["wait_seconds"]:
+        response.headers["X-Queue-Wait-Ms"] = str(int(queued["wait_seconds"] * 1000))
+    if degraded["stale"]:
+        response.headers["X-Data-Stale"] = "true"
+        response.headers["X-Stale-Age"] = str(int(degraded["age"]))
+    return response
+
+
+@app.exception_handler(bq_client.BigQueryUnavailable)
+async def bigquery_unavailable(request: Request, exc: bq_client.BigQueryUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "BigQuery indisponível no momento. Tente novamente em instantes."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(QueryQueueTimeout)
+async def query_queue_timeout(request: Request, exc: QueryQueueTimeout):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Muitas consultas na fila. Tente novamente em instantes."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+
+@app.get("/bq/stats")
+def bq_stats():
+    """Circuit breaker de cada endpoint do BigQuery e fila do escalonador (por classe e por chamador)."""
+    return {**bq_client.breaker_stats(), "scheduler": scheduler.stats()}
+
+def _make_etag(*parts: Any) -> str:
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _latest_ts(rows: Iterable[Dict], field: str) -> datetime | None:
+    values = [row.get(field) for row in rows if isinstance(row.get(field), datetime)]
+    return max(values) if values else None
+
+
+def _polling_headers(request: Request, cursor: datetime | None) -> tuple[str, Dict[str, str]]:
+    params = sorted((k, v) for k, v in request.query_params.multi_items() if k != "since")
+    etag = _make_etag(request.url.path, params, cursor.isoformat() if cursor else "")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if cursor:
+        headers["X-Latest-Event"] = cursor.isoformat()
+    return etag, headers
+
+
+def _polling_response(
+    request: Request,
+    response: Response,
+    payload: Any,
+    latest: datetime | None,
+    since: datetime | None,
+):
+    """ETag derivada do último evento (ou do cursor, se nada chegou) + 304 condicional."""
+    etag, headers = _polling_headers(request, latest or since)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return payload
+
+
+def _not_modified(
+    request: Request, vehicle_key: str, window: timedelta, since: datetime | None, known_dtcs: bool = False
+) -> Response | None:
+    """304 pela marca d'água do veículo (consulta barata), antes da consulta completa.
+
+    Só com If-None-Match; se a marca d'água não bater ou o BigQuery falhar, segue o fluxo normal.
+    `known_dtcs` para o /dtc, cuja ETag só vê eventos com DTC cadastrado.
+    """
+    if not request.headers.get("if-none-match"):
+        return None
+    try:
+        latest = bq_client.get_event_watermark(vehicle_key, window, since, known_dtcs=known_dtcs)
+    except bq_client.BigQueryUnavailable:
+        return None
+    etag, headers = _polling_headers(request, latest or since)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return None
+
+
 # use a mesma palavra em todo lugar: vehicle_key (placa/imei/chassi-8)
 @app.get("/vehicles/{vehicle_key}/dtc")
-def get_dtcs(vehicle_key: str, hours: int = 24):
-    return bq_client.get_dtcs(vehicle_key, hours)
+def get_dtcs(
+    vehicle_key: str,
+    request: Request,
+    response: Response,
+    hours: int = 24,
+    mode: str = "events",
+    gap_minutes: int | None = None,
+    since: datetime | None = None,
+):
+    try:
+        mode = bq_client.check_dtc_mode(mode)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    unchanged = _not_modified(request, vehicle_key, timedelta(hours=hours), since, known_dtcs=True)
+    if unchanged is not None:
+        return unchanged
+    rows = bq_client.get_dtcs(vehicle_key, hours, mode=mode, gap_minutes=gap_minutes, since_ts=since)
+    latest = _latest_ts(rows, "end_ts" if mode == "episodes" else "ts")
+    return _polling_response(request, response, rows, latest, since)
+
+class DtcBatchRequest(BaseModel):
+    vehicle_keys: list[str]
+    hours: int = 24
+
+
+@app.post("/vehicles/dtc:batch")
+def get_dtcs_batch(req: DtcBatchRequest):
+    keys = [key for key in req.vehicle_keys if (key or "").strip()]
+    if not keys:
+        raise HTTPException(status_code=400, detail="Informe ao menos uma placa/IMEI/chassi.")
+    if len(keys) > bq_client.MAX_BATCH_KEYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo de {bq_client.MAX_BATCH_KEYS} veículos por lote.",
+        )
+    return bq_client.get_dtcs_batch(keys, req.hours)
 
 @app.get("/vehicles/{vehicle_key}/telemetry")
-def get_telemetry(vehicle_key: str, minutes: int = 30):
-    return bq_client.get_telemetry(vehicle_key, minutes)
+def get_telemetry(
+    vehicle_key: str,
+    request: Request,
+    response: Response,
+    minutes: int = 30,
+    resolution: str | None = None,
+    points: int = bq_client.TELEMETRY_TARGET_POINTS,
+    since: datetime | None = None,
+):
+    unchanged = _not_modified(request, vehicle_key, timedelta(minutes=minutes), since)
+    if unchanged is not None:
+        return unchanged
+    try:
+        data = bq_client.get_telemetry(
+            vehicle_key,
+            minutes,
+            resolution=resolution,
+            target_points=max(1, min(points, 2000)),
+            since_ts=since,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return _polling_response(request, response, data, data.get("latest_event"), since)
+
+@app.get("/vehicles/{vehicle_key}/fault-status")
+def get_fault_status(vehicle_key: str, response: Response, days: int = 30):
+    """Status por DTC/FMI (persistente/intermitente/provavelmente resolvido), do snapshot local quando fresco."""
+    days = max(1, days)
+    rows = fault_snapshot.vehicle_summary(vehicle_key, days=days)
+    response.headers["X-Source"] = "snapshot" if rows is not None else "bigquery"
+    if rows is None:
+        rows = bq_client.get_dtc_summary(vehicle_key=vehicle_key, days=days) or []
+    return {"vehicle_key": vehicle_key, "days": days, "items": rows}
+
+@app.get("/fault-snapshot/stats")
+def fault_snapshot_stats():
+    return fault_snapshot.stats()
 
 @app.get("/kb/lookup")
 def kb_lookup(spn: int, fmi: int):
     return kb_service.lookup(spn, fmi)
 
 
+def _filter_set(chassi: str | None, customer: str | None, dtc: str | None) -> Dict[str, str]:
+    # mesma normalização de bq_client._overview_filters/_history_filters
+    return {
+        "chassi": (chassi or "").strip().upper(),
+        "customer": (customer or "").strip().lower(),
+        "dtc": (dtc or "").strip().upper(),
+    }
+
+
+def _warm(response: Response, fn: Callable[..., Any], **kwargs: Any) -> Any:
+    """Consulta via cache stale-while-revalidate; o estado vai no header X-Cache."""
+    value, state, age = warm_cache.get(fn, **kwargs)
+    response.headers["X-Cache"] = state
+    response.headers["Age"] = str(int(age))
+    return value
+
+
+def _overview_query(filters: Dict[str, str], event_date: date | None = None, days: int = 30, limit: int = 500) -> Dict[str, Any]:
+    return {
+        "chassi_last8": filters["chassi"],
+        "customer": filters["customer"],
+        "dtc": filters["dtc"],
+        "event_date": event_date,
+        "days": days,
+        "limit": limit,
+    }
+
+
 @app.get("/overview/dtc-events")
 def overview_events(
+    request: Request,
+    response: Response,
     chassi: str | None = None,
     customer: str | None = None,
     dtc: str | None = None,
     event_date: date | None = None,
     days: int = 30,
     limit: int = 500,
+    format: str = "json",
+):
+    """`format=columnar` devolve veículos e eventos como tabelas por coluna; `format=arrow`, os eventos em Arrow IPC."""
+    fmt = encoding.check_format(format)
+    query = _overview_query(_filter_set(chassi, customer, dtc), event_date, days, limit)
+    items = _warm(response, bq_client.get_overview_events, **query)
+    return encoding.encoded_response(
+        request, response, {"items": items}, fmt, encoding.overview_columnar, encoding.overview_arrow
+    )
+
+# intervalo de comentários SSE para manter a conexão viva em proxies
+LIVE_KEEPALIVE_SECONDS = 20
+
+
+@app.get("/stream/dtc")
+async def stream_dtc(
+    request: Request,
+    chassi: str | None = None,
+    customer: str | None = None,
+    dtc: str | None = None,
+    since: datetime | None = None,
 ):
-    items = bq_client.get_overview_events(
-        chassi_last8=chassi,
-        customer=customer,
-        dtc=dtc,
-        event_date=event_date,
-        days=days,
-        limit=limit,
+    """Feed ao vivo (SSE) com os filtros da visão geral.
+
+    Assinantes com os mesmos filtros compartilham um único poller no servidor
+    (src/services/live_feed.py). Eventos: `ready`, `dtc` (lote de eventos novos; o `id`
+    é a marca d'água, reenviada como Last-Event-ID na reconexão) e `lagged` (cliente
+    lento perdeu lotes; recarregue /overview/dtc-events). Cada evento tem um `id`
+    estável: a reconexão recomeça um pouco antes da marca d'água e pode repetir eventos.
+    """
+    resume = since
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            resume = datetime.fromisoformat(last_event_id)
+        except ValueError:
+            pass
+
+    sub = live_feed.subscribe(chassi, customer, dtc)
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            yield _sse("ready", {"chassi": sub.key[0], "customer": sub.key[1], "dtc": sub.key[2]})
+            sent_ids: set[str] = set()
+            if resume is not None:
+                backlog = await run_in_threadpool(live_feed.catch_up, sub, resume)
+                if backlog:
+                    sent_ids = {e["id"] for e in backlog}
+                    watermark = max(e["timestamp"] or "" for e in backlog)
+                    yield _sse("dtc", {"events": backlog, "watermark": watermark}, watermark)
+
+            while not await request.is_disconnected():
+                batch = await sub.get(LIVE_KEEPALIVE_SECONDS)
+                if sub.lagged:
+                    sub.lagged = False
+                    yield _sse("lagged", {"message": "Eventos perdidos; recarregue a visão geral."})
+                if batch is None:
+                    yield ": keepalive\n\n"
+                    continue
+                items = batch["events"]
+                if sent_ids:
+                    # o poller pode repetir o que a recuperação inicial já entregou
+                    items = [e for e in items if e["id"] not in sent_ids]
+                if items:
+                    yield _sse("dtc", {**batch, "events": items}, batch["watermark"])
+        finally:
+            live_feed.unsubscribe(sub)
+
+    return _sse_response(events())
+
+
+@app.get("/stream/stats")
+def stream_stats():
+    """Pollers ativos (um por conjunto de filtros) e assinantes de cada um."""
+    return live_feed.stats()
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _history_cached(
+    request: Request,
+    response: Response,
+    kind: str,
+    filters: Dict[str, Any],
+    start_date: date | None,
+    end_date: date | None,
+    days: int,
+    fn: Callable[..., Dict],
+    *,
+    variant: str = "",
+    **kwargs: Any,
+):
+    """Intervalos que terminam antes de hoje nunca mudam: cache em disco + HTTP immutable.
+
+    Intervalos abertos (que incluem hoje) passam pelo cache stale-while-revalidate.
+    `variant` distingue a ETag de cada representação (ex.: format=columnar) do mesmo payload.
+    """
+    resolved_start, resolved_end = bq_client.resolve_history_range(start_date, end_date, days)
+    kwargs.update(start_date=resolved_start, end_date=resolved_end, default_days=days)
+    if not bq_client.is_closed_range(resolved_end):
+        return _warm(response, fn, **kwargs)
+
+    key = disk_cache.make_key(
+        kind=kind,
+        start_date=resolved_start.isoformat(),
+        end_date=resolved_end.isoformat(),
+        **filters,
+    )
+    etag = f'"{key[:32]}-{variant}"' if variant else f'"{key[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    payload = disk_cache.get("history", key)
+    if payload is None:
+        with breaker.degradation() as degraded:
+            payload = fn(**kwargs)
+        if degraded["stale"]:
+            # último resultado bom de antes do BigQuery cair: pode ser de quando o intervalo estava aberto
+            breaker.report_stale(degraded["age"])
+            return payload
+        disk_cache.put("history", key, payload)
+    response.headers.update(headers)
+    return payload
+
+
+def _history_query(filters: Dict[str, Any]) -> Dict[str, Any]:
+    return {"chassi_last8": filters["chassi"], "customer": filters["customer"], "dtc": filters["dtc"]}
+
+
+def _events_filters(
+    filters: Dict[str, str],
+    page: int = 1,
+    page_size: int = 25,
+    order: str = "desc",
+    mode: str = "events",
+    gap_minutes: int | None = None,
+) -> Dict[str, Any]:
+    return {
+        **filters,
+        "page": max(1, page),
+        "page_size": max(1, min(page_size, 200)),
+        "order": "asc" if str(order).lower() == "asc" else "desc",
+        "mode": (mode or "events").strip().lower(),
+        "gap_minutes": config.DTC_EPISODE_GAP_MINUTES if gap_minutes is None else gap_minutes,
+    }
+
+
+# ----------------------- conjuntos de resultado (?result=<handle>) -----------------------
+# Com `result`, o intervalo é o do handle (start_date/end_date/days são ignorados) e
+# chassi/customer/dtc só restringem dentro do conjunto materializado.
+def _result_set(handle: str) -> Dict[str, Any]:
+    meta = result_sets.get(handle)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Conjunto de resultado não encontrado ou expirado.")
+    return meta
+
+
+def _from_result(response: Response, meta: Dict[str, Any], fn: Callable[..., Any], **kwargs: Any) -> Any:
+    response.headers["X-Result-Handle"] = meta["handle"]
+    return fn(
+        start_date=date.fromisoformat(meta["start_date"]),
+        end_date=date.fromisoformat(meta["end_date"]),
+        result_table=meta["table"],
+        **kwargs,
+    )
+
+
+def _public_result(meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "handle": meta["handle"],
+        "filters": meta["filters"],
+        "start_date": meta["start_date"],
+        "end_date": meta["end_date"],
+        "rows": meta["rows"],
+        "bytes": meta["bytes"],
+        "expires_at": datetime.fromtimestamp(meta["expires_at"], tz=timezone.utc).isoformat(),
+        "reused": meta.get("reused", False),
+    }
+
+
+class ResultSetRequest(BaseModel):
+    chassi: str | None = None
+    customer: str | None = None
+    dtc: str | None = None
+    start_date: date | None = None
+    end_date: date | None = None
+    days: int = 7
+
+
+def _create_result(req: ResultSetRequest) -> Dict[str, Any]:
+    if not bq_client.RESULT_SETS_ENABLED:
+        raise HTTPException(status_code=503, detail="Conjuntos de resultado não configurados (BQ_DATASET).")
+    filters = _filter_set(req.chassi, req.customer, req.dtc)
+    try:
+        return result_sets.create(filters, req.start_date, req.end_date, max(1, req.days))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+@app.post("/history/results")
+def create_result(req: ResultSetRequest):
+    """Materializa o histórico filtrado uma vez; as telas seguintes usam `?result=<handle>`."""
+    return _public_result(_create_result(req))
+
+
+@app.get("/history/results/{handle}")
+def get_result(handle: str):
+    return _public_result(_result_set(handle))
+
+
+@app.delete("/history/results/{handle}", status_code=204)
+def delete_result(handle: str):
+    if not result_sets.delete(handle):
+        raise HTTPException(status_code=404, detail="Conjunto de resultado não encontrado ou expirado.")
+    return Response(status_code=204)
+
+
+@app.get("/history/export")
+def history_export(
+    result: str | None = None,
+    chassi: str | None = None,
+    customer: str | None = None,
+    dtc: str | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    days: int = 7,
+):
+    """CSV com todos os eventos do conjunto (sem ordem garantida). Sem `result`, materializa o filtro antes."""
+    if result:
+        meta = _result_set(result)
+    else:
+        meta = _create_result(
+            ResultSetRequest(chassi=chassi, customer=customer, dtc=dtc, start_date=start_date, end_date=end_date, days=days)
+        )
+    columns = bq_client.RESULT_EXPORT_COLUMNS
+    page_rows = max(1, config.RESULT_EXPORT_PAGE_ROWS)
+    handle = meta["handle"]
+
+    def lines() -> Iterator[str]:
+        # a cada página renova a reserva do handle (não é apagado nem expira no meio).
+        # Qualquer falha, ou menos linhas que o conjunto tem, interrompe a conexão sem o
+        # fim da resposta: o cliente vê o download falhar em vez de um CSV truncado.
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        start = 0
+        try:
+            while True:
+                leased = result_sets.lease(handle)
+                if leased is None:
+                    raise RuntimeError("conjunto de resultado expirou ou foi apagado durante a exportação")
+                page = bq_client.read_result_rows(leased["table"], start, page_rows)
+                for row in page:
+                    writer.writerow([v.isoformat() if isinstance(v, datetime) else v for v in (row.get(c) for c in columns)])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                start += len(page)
+                if len(page) < page_rows:
+                    break
+            if start < leased["rows"]:
+                raise RuntimeError(f"exportação incompleta: {start} de {leased['rows']} linhas")
+        except Exception:
+            logger.exception("Exportação do conjunto %s interrompida após %s linhas", handle, start)
+            raise
+
+    filename = f"historico_{meta['start_date']}_{meta['end_date']}_{meta['handle']}.csv"
+    return StreamingResponse(
+        lines(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Result-Handle": meta["handle"]},
     )
-    return {"items": items}
+
 
 @app.get("/history/daily")
 def history_daily(
+    request: Request,
+    response: Response,
     chassi: str | None = None,
     customer: str | None = None,
     dtc: str | None = None,
     start_date: date | None = None,
     end_date: date | None = None,
     days: int = 7,
+    result: str | None = None,
 ):
-    return bq_client.get_history_daily_counts(
-        chassi_last8=chassi,
-        customer=customer,
-        dtc=dtc,
-        start_date=start_date,
-        end_date=end_date,
-        default_days=max(1, days),
+    filters = _filter_set(chassi, customer, dtc)
+    if result:
+        return _from_result(response, _result_set(result), bq_client.get_history_daily_counts, **_history_query(filters))
+    return _history_cached(
+        request,
+        response,
+        "daily",
+        filters,
+        start_date,
+        end_date,
+        max(1, days),
+        bq_client.get_history_daily_counts,
+        **_history_query(filters),
     )
 
 
 @app.get("/history/events")
 def history_events(
+    request: Request,
+    response: Response,
     chassi: str | None = None,
     customer: str | None = None,
     dtc: str | None = None,
@@ -103,21 +650,234 @@ def history_events(
     page_size: int = 25,
     order: str = "desc",
     days: int = 7,
+    mode: str = "events",
+    gap_minutes: int | None = None,
+    format: str = "json",
+    result: str | None = None,
+):
+    """`format=columnar` devolve `items` como tabela por coluna; `format=arrow`, em Arrow IPC."""
+    fmt = encoding.check_format(format)
+    filters = _events_filters(_filter_set(chassi, customer, dtc), page, page_size, order, mode, gap_minutes)
+    page_args = {k: filters[k] for k in ("page", "page_size", "order", "mode", "gap_minutes")}
+    try:
+        if result:
+            payload = _from_result(response, _result_set(result), bq_client.get_history_events, **_history_query(filters), **page_args)
+        else:
+            payload = _history_cached(
+                request,
+                response,
+                "events",
+                filters,
+                start_date,
+                end_date,
+                max(1, days),
+                bq_client.get_history_events,
+                variant=encoding.variant(fmt),
+                **_history_query(filters),
+                **page_args,
+            )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return encoding.encoded_response(
+        request, response, payload, fmt, encoding.history_columnar, encoding.history_arrow
+    )
+
+
+@app.get("/geo/dtc-hotspots")
+def dtc_hotspots(
+    response: Response,
+    bbox: str | None = None,
+    zoom: int = 5,
+    chassi: str | None = None,
+    customer: str | None = None,
+    dtc: str | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    days: int = 7,
+    result: str | None = None,
+):
+    """Eventos agregados em células geohash (precisão pelo zoom), com os DTCs mais comuns por célula.
+
+    `bbox` = min_lon,min_lat,max_lon,max_lat. Intervalos fechados são servidos por tile
+    do cache em disco; o resto passa pelo cache stale-while-revalidate. Com `result`,
+    lê do conjunto materializado.
+    """
+    try:
+        area = geo.parse_bbox(bbox)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    precision, tiles = geo.plan(area, zoom)
+    filters = _filter_set(chassi, customer, dtc)
+    if result:
+        meta = _result_set(result)
+        by_tile = _from_result(
+            response, meta, bq_client.get_hotspot_tiles, tiles=tiles, precision=precision, **_history_query(filters)
+        )
+        return geo.hotspots_payload(by_tile, tiles, area, precision, meta["start_date"], meta["end_date"])
+    resolved_start, resolved_end = bq_client.resolve_history_range(start_date, end_date, max(1, days))
+    query = {
+        **_history_query(filters),
+        "precision": precision,
+        "start_date": resolved_start,
+        "end_date": resolved_end,
+    }
+
+    if bq_client.is_closed_range(resolved_end):
+        with breaker.degradation() as degraded:
+            by_tile = geo.cached_tiles(
+                tiles,
+                lambda missing: bq_client.get_hotspot_tiles(tiles=missing, **query),
+                **{**query, "start_date": resolved_start.isoformat(), "end_date": resolved_end.isoformat()},
+            )
+        if degraded["stale"]:
+            breaker.report_stale(degraded["age"])
+        else:
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    else:
+        by_tile = _warm(response, bq_client.get_hotspot_tiles, tiles=tiles, **query)
+    return geo.hotspots_payload(by_tile, tiles, area, precision, resolved_start.isoformat(), resolved_end.isoformat())
+
+
+def _frontend_today() -> date:
+    """Hoje no fuso dos navegadores (FRONTEND_TIMEZONE): o Histórico manda as datas locais."""
+    return datetime.now(ZoneInfo(config.FRONTEND_TIMEZONE)).date()
+
+
+def _default_views() -> list[tuple[Callable[..., Any], Dict[str, Any]]]:
+    """Telas abertas primeiro no frontend (Visão Geral de 30 dias; Histórico dos últimos 7 dias).
+
+    As chaves são as mesmas dos pedidos do frontend: o Histórico envia start_date/end_date
+    explícitos (hoje - 6 .. hoje, na data local), page_size 25 e order desc.
+    """
+    filters = _filter_set(None, None, None)
+    today = _frontend_today()
+    start, end = bq_client.resolve_history_range(today - timedelta(days=6), today, 7)
+    history = {**_history_query(filters), "start_date": start, "end_date": end, "default_days": 7}
+    events = _events_filters(filters)
+    return [
+        (bq_client.get_overview_events, _overview_query(filters)),
+        (bq_client.get_history_daily_counts, history),
+        (
+            bq_client.get_history_events,
+            {
+                **history,
+                "page": events["page"],
+                "page_size": events["page_size"],
+                "order": events["order"],
+                "mode": events["mode"],
+                "gap_minutes": events["gap_minutes"],
+            },
+        ),
+    ]
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Cache stale-while-revalidate dos dashboards (acertos, atualizações, consultas mais pedidas) e cache compartilhado."""
+    return {
+        **warm_cache.stats(),
+        "shared": shared_cache.stats(),
+        "result_sets": result_sets.stats(),
+        "background": background_leader.stats(),
+    }
+
+# dias ainda sendo consultados em segundo plano: 202 com o parcial, e o cliente pede de novo
+_ANALYTICS_RETRY_SECONDS = 5
+
+
+def _analytics_response(response: Response, payload: Dict[str, Any]) -> Dict[str, Any]:
+    if not payload.get("complete", True):
+        response.status_code = 202
+        response.headers["Retry-After"] = str(_ANALYTICS_RETRY_SECONDS)
+    return payload
+
+
+@app.get("/analytics/dtc-prevalence")
+def dtc_prevalence(response: Response, dtc: str | None = None, days: int = 30, limit: int = 100):
+    """Veículos, clientes e dias distintos por DTC na frota (índices diários pré-calculados)."""
+    return _analytics_response(response, dtc_analytics.prevalence(days=days, dtc=dtc, limit=limit))
+
+
+@app.get("/analytics/dtc-cooccurrence")
+def dtc_cooccurrence(
+    response: Response,
+    dtc: str,
+    days: int = 30,
+    window_minutes: int | None = None,
+    sort: str = "lift",
+    min_count: int = 2,
+    limit: int = 20,
+):
+    """DTCs que mais aparecem junto com `dtc` no mesmo veículo e na mesma janela de tempo."""
+    try:
+        payload = dtc_analytics.cooccurrence(
+            dtc, days=days, window_minutes=window_minutes, sort=sort, min_count=max(1, min_count), limit=limit
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return _analytics_response(response, payload)
+
+
+def _distinct_counts(response: Response, fn: Callable[..., Dict], **kwargs: Any) -> Dict:
+    if not bq_client.HLL_ROLLUPS_ENABLED:
+        raise HTTPException(status_code=503, detail="Rollups HLL desligados (HLL_ROLLUPS_ENABLED e BQ_DATASET).")
+    try:
+        return _warm(response, fn, **kwargs)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+@app.get("/analytics/dtc-distinct")
+def dtc_distinct(
+    response: Response,
+    dtc: str | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    days: int = 30,
+    granularity: str = "day",
+    limit: int = 50,
+):
+    """Veículos/clientes distintos por DTC e período (day, week, month ou total), via sketches HLL."""
+    start, end = bq_client.resolve_history_range(start_date, end_date, max(1, days))
+    return _distinct_counts(
+        response,
+        bq_client.get_dtc_distinct_counts,
+        dtc=(dtc or "").strip().upper(),
+        start_date=start,
+        end_date=end,
+        granularity=(granularity or "day").strip().lower(),
+        limit=max(1, min(limit, 500)),
+    )
+
+
+@app.get("/analytics/customer-distinct")
+def customer_distinct(
+    response: Response,
+    customer: str | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    days: int = 30,
+    granularity: str = "day",
+    limit: int = 50,
 ):
-    safe_page = max(1, page)
-    safe_page_size = max(1, min(page_size, 200))
-    return bq_client.get_history_events(
-        chassi_last8=chassi,
-        customer=customer,
-        dtc=dtc,
-        start_date=start_date,
-        end_date=end_date,
-        page=safe_page,
-        page_size=safe_page_size,
-        order=order,
-        default_days=max(1, days),
+    """Veículos/DTCs distintos por cliente e período (day, week, month ou total), via sketches HLL."""
+    start, end = bq_client.resolve_history_range(start_date, end_date, max(1, days))
+    return _distinct_counts(
+        response,
+        bq_client.get_customer_distinct_counts,
+        customer=(customer or "").strip().lower(),
+        start_date=start,
+        end_date=end,
+        granularity=(granularity or "day").strip().lower(),
+        limit=max(1, min(limit, 500)),
     )
 
+
+@app.get("/analytics/stats")
+def analytics_stats():
+    return {**dtc_analytics.stats(), "hll_rollups": rollup_refresher.stats()}
+
+
 @app.get("/", include_in_schema=False)
 def root():
     return RedirectResponse(url="/docs")
@@ -127,13 +887,14 @@ class ChatRequest(BaseModel):
     message: str
     vehicle_key: str | None = None
     customer_name: str | None = None
-    hours: int = 24
     minutes: int = 60
     days: int = 30
+    session_id: str | None = None
     
 class AssistantAskRequest(BaseModel):
     prompt: str
     plate: str | None = None
+    session_id: str | None = None
 
 
 def _stringify_agent_output(value: Any) -> str:
@@ -155,25 +916,179 @@ def _stringify_agent_output(value: Any) -> str:
     return str(value).strip()
 
 
-def _run_agent(prompt: str) -> str | None:
+def _run_agent(
+    prompt: str, session: Session | None = None, question: str | None = None, cache_key: str | None = None
+) -> str | None:
+    """Roda o agente; com sessão, inclui o histórico recente e guarda o novo turno."""
     try:
-        agent = get_agent()
+        agent = agent_pool.agent()
     except Exception:  # pragma: no cover - log unexpected boot errors
         logger.exception("Erro ao inicializar o agente de IA")
         return None
 
     try:
-        result = agent.run(prompt)
+        if session is None:
+            result = agent.run(prompt)
+        else:
+            result = agent.run(with_history(session, prompt), session_id=session.id)
     except Exception:  # pragma: no cover - log execution errors
         logger.exception("Erro ao consultar o agente de IA")
         return None
 
     answer = _stringify_agent_output(result)
+    if answer and session is not None:
+        session.remember(question or prompt, answer)
+    answers.store_answer(cache_key, answer)
     return answer or None
 
 
-@app.post("/assistant/ask")
-def assistant_ask(req: AssistantAskRequest):
+def _sse(event: str, data: Any, event_id: str | None = None) -> str:
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    prefix = f"id: {event_id}\n" if event_id else ""
+    return f"{prefix}event: {event}\ndata: {payload}\n\n"
+
+
+def _stream_agent(
+    prompt: str,
+    fallback: str,
+    session: Session | None = None,
+    question: str | None = None,
+    cache_key: str | None = None,
+) -> Iterator[str]:
+    """Executa o agente em modo streaming e traduz os eventos do agno para SSE.
+
+    Eventos: status (início imediato), tool_start / tool_end (progresso das ferramentas),
+    token (texto parcial), answer (resposta final, sempre enviada) e error.
+    """
+    extra = {"session_id": session.id} if session is not None else {}
+    yield _sse("status", {"message": "Consultando o assistente…"})
+
+    try:
+        agent = agent_pool.agent()
+    except Exception:  # pragma: no cover - log unexpected boot errors
+        logger.exception("Erro ao inicializar o agente de IA")
+        yield _sse("answer", {"answer": fallback, **extra})
+        return
+
+    parts: list[str] = []
+    final: str | None = None
+    try:
+        if session is None:
+            run = agent.run(prompt, stream=True, stream_events=True)
+        else:
+            run = agent.run(with_history(session, prompt), session_id=session.id, stream=True, stream_events=True)
+        for ev in run:
+            kind = getattr(ev, "event", "")
+            if kind == "ToolCallStarted":
+                tool = getattr(ev, "tool", None)
+                yield _sse("tool_start", {"tool": getattr(tool, "tool_name", None), "args": getattr(tool, "tool_args", None)})
+            elif kind in ("ToolCallCompleted", "ToolCallError"):
+                tool = getattr(ev, "tool", None)
+                yield _sse(
+                    "tool_end",
+                    {"tool": getattr(tool, "tool_name", None), "error": bool(getattr(tool, "tool_call_error", False))},
+                )
+            elif kind == "RunContent":
+                text = getattr(ev, "content", None)
+                if isinstance(text, str) and text:
+                    parts.append(text)
+                    yield _sse("token", {"text": text})
+            elif kind == "RunCompleted":
+                final = _stringify_agent_output(getattr(ev, "content", None)) or None
+            elif kind == "RunError":
+                logger.error("Erro no streaming do agente: %s", getattr(ev, "content", ""))
+                yield _sse("error", {"message": "O assistente encontrou um erro durante a resposta."})
+    except Exception:  # pragma: no cover - log execution errors
+        logger.exception("Erro ao consultar o agente de IA (streaming)")
+        yield _sse("error", {"message": "O assistente encontrou um erro durante a resposta."})
+
+    answer = final or "".join(parts).strip()
+    if answer and session is not None:
+        session.remember(question or prompt, answer)
+    answers.store_answer(cache_key, answer)
+    yield _sse("answer", {"answer": answer or fallback, **extra})
+
+
+def _sse_response(events: Iterator[str] | AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# O agente roda no pool dedicado (src/agent/pool.py): os endpoints do assistente são
+# async e não ocupam o threadpool dos dashboards. Pool cheio -> 429 com Retry-After.
+def _assistant_busy(exc: AssistantBusy) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="O assistente está ocupado. Tente novamente em instantes.",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def _admit() -> Admission:
+    """Reserva o lugar no pool antes de qualquer trabalho caro do pedido (429 se cheio)."""
+    try:
+        return agent_pool.admit()
+    except AssistantBusy as exc:
+        raise _assistant_busy(exc) from exc
+
+
+async def _pooled(fn: Callable[[], Any], admission: Admission | None = None) -> Any:
+    try:
+        return await agent_pool.run(fn, admission)
+    except AssistantBusy as exc:
+        raise _assistant_busy(exc) from exc
+    except AssistantTimeout as exc:
+        raise HTTPException(status_code=504, detail="O assistente demorou demais para responder.") from exc
+
+
+def _pooled_stream(
+    events: Callable[[], Iterator[str]], fallback: str, session: Session, admission: Admission | None = None
+) -> StreamingResponse:
+    try:
+        stream, queued = agent_pool.stream(events, admission)
+    except AssistantBusy as exc:
+        raise _assistant_busy(exc) from exc
+
+    async def guarded() -> AsyncIterator[str]:
+        if queued:
+            yield _sse("status", {"message": "Aguardando na fila do assistente…"})
+        try:
+            async for chunk in stream:
+                yield chunk
+        except (AssistantBusy, AssistantTimeout):
+            yield _sse("error", {"message": "O assistente demorou demais para responder."})
+            yield _sse("answer", {"answer": fallback, "session_id": session.id})
+
+    return _sse_response(guarded())
+
+
+# Cache de respostas (src/agent/answers.py): só para o 1º turno da conversa, já que
+# follow-ups dependem do histórico. A chave inclui o token de frescor do veículo/cliente
+# (uma consulta ao BigQuery), então só é calculada depois de o pool aceitar o pedido
+# (_admit); num acerto do cache o lugar reservado é devolvido sem rodar o agente.
+async def _answer_key(session: Session, prompt: str, **context: Any) -> str | None:
+    if session.history:
+        return None
+    return await run_in_threadpool(answers.answer_key, prompt, **context)
+
+
+def _cached_answer(session: Session, key: str | None, question: str) -> str | None:
+    answer = answers.get_answer(key)
+    if answer is not None:
+        session.remember(question, answer)
+    return answer
+
+
+def _cached_stream(answer: str, session: Session) -> StreamingResponse:
+    response = _sse_response(iter([_sse("answer", {"answer": answer, "session_id": session.id})]))
+    response.headers["X-Answer-Cache"] = "hit"
+    return response
+
+
+def _assistant_prompt(req: AssistantAskRequest) -> tuple[str, str]:
     prompt = (req.prompt or "").strip()
     if not prompt:
         raise HTTPException(status_code=400, detail="Informe uma pergunta para o assistente.")
@@ -182,37 +1097,192 @@ def assistant_ask(req: AssistantAskRequest):
     if req.plate:
         context_prompt += f"\n\nContexto adicional: placa/chassi {req.plate}"
 
-    answer = _run_agent(context_prompt)
+    extras = f" Contexto informado: {req.plate}." if req.plate else ""
+    fallback = (
+        f"Recebi sua mensagem: \"{prompt}\".{extras} "
+        "Estou pronto para ajudar assim que o assistente inteligente estiver disponível."
+    )
+    return context_prompt, fallback
+
+
+@app.post("/assistant/ask")
+async def assistant_ask(req: AssistantAskRequest, request: Request, response: Response):
+    context_prompt, fallback = _assistant_prompt(req)
+    question = req.prompt.strip()
+    session = get_session(req.session_id, owner=_caller_id(request))
+    admission = _admit()
+    try:
+        key = await _answer_key(session, question, vehicle_key=req.plate)
+        cached = _cached_answer(session, key, question)
+        if cached is not None:
+            response.headers["X-Answer-Cache"] = "hit"
+            return {"answer": cached, "session_id": session.id}
+
+        answer = await _pooled(lambda: _run_agent(context_prompt, session, question, key), admission)
+    finally:
+        admission.release()
+    return {"answer": answer or fallback, "session_id": session.id}
+
+
+@app.post("/assistant/ask/stream")
+async def assistant_ask_stream(req: AssistantAskRequest, request: Request):
+    context_prompt, fallback = _assistant_prompt(req)
+    question = req.prompt.strip()
+    session = get_session(req.session_id, owner=_caller_id(request))
+    admission = _admit()
+    try:
+        key = await _answer_key(session, question, vehicle_key=req.plate)
+        cached = _cached_answer(session, key, question)
+        if cached is not None:
+            return _cached_stream(cached, session)
 
-    if not answer:
-        extras = f" Contexto informado: {req.plate}." if req.plate else ""
-        answer = (
-            f"Recebi sua mensagem: \"{prompt}\".{extras} "
-            "Estou pronto para ajudar assim que o assistente inteligente estiver disponível."
+        return _pooled_stream(
+            lambda: _stream_agent(context_prompt, fallback, session, question, key), fallback, session, admission
         )
+    finally:
+        admission.release()
 
-    return {"answer": answer}
 
-@app.post("/chat")
-def chat(req: ChatRequest):
+@app.get("/assistant/stats")
+def assistant_stats():
+    """Métricas do pool do assistente (em execução, fila, rejeições, timeouts) e do cache de respostas."""
+    return {**agent_pool.stats(), "answer_cache": answers.stats()}
+
+
+CHAT_FALLBACK = "Não foi possível gerar uma resposta no momento. Tente novamente em instantes."
+
+
+def _chat_message(req: ChatRequest) -> str:
     prompt = (req.message or "").strip()
     if not prompt:
         raise HTTPException(status_code=400, detail="Informe uma mensagem.")
+    return prompt
+
 
-    tips: list[str] = []
-    if req.vehicle_key:
-        tips.append(f"- fetch_dtcs(vehicle_key='{req.vehicle_key}', hours={req.hours})")
-        tips.append(f"- fetch_telemetry(vehicle_key='{req.vehicle_key}', minutes={req.minutes})")
-    if req.customer_name:
-        tips.append(f"- fetch_customer_summary(customer_name='{req.customer_name}', days={req.days})")
+def _chat_prompt(req: ChatRequest, prompt: str, session: Session) -> tuple[str, list[str]]:
+    # consultas do veículo/cliente rodam em paralelo antes do agente (sem rodadas extras do LLM);
+    # reaproveitam o memo da sessão em follow-ups
+    context, tips = prefetch_context(
+        vehicle_key=req.vehicle_key,
+        customer_name=req.customer_name,
+        minutes=req.minutes,
+        days=req.days,
+        session_id=session.id,
+    )
 
     context_prompt = prompt
-    if tips:
-        joined = "\n".join(tips)
-        context_prompt += f"\n\nSugestões de ferramentas:\n{joined}"
+    if context:
+        context_prompt += f"\n\n{context}"
+    return context_prompt, tips
+
+
+def _chat_answer_key(req: ChatRequest, session: Session, prompt: str):
+    return _answer_key(
+        session,
+        prompt,
+        vehicle_key=req.vehicle_key,
+        customer_name=req.customer_name,
+        minutes=req.minutes,
+        days=req.days,
+    )
+
+
+@app.post("/chat")
+async def chat(req: ChatRequest, request: Request, response: Response):
+    prompt = _chat_message(req)
+    session = get_session(req.session_id, owner=_caller_id(request))
+    admission = _admit()
+    try:
+        key = await _chat_answer_key(req, session, prompt)
+        cached = _cached_answer(session, key, prompt)
+        if cached is not None:
+            response.headers["X-Answer-Cache"] = "hit"
+            return {"answer": cached, "tips": [], "session_id": session.id}
+
+        def job() -> tuple[str | None, list[str]]:
+            context_prompt, tips = _chat_prompt(req, prompt, session)
+            return _run_agent(context_prompt, session, prompt, key), tips
+
+        answer, tips = await _pooled(job, admission)
+    finally:
+        admission.release()
+    return {"answer": answer or CHAT_FALLBACK, "tips": tips, "session_id": session.id}
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, request: Request):
+    prompt = _chat_message(req)
+    session = get_session(req.session_id, owner=_caller_id(request))
+    admission = _admit()
+    try:
+        key = await _chat_answer_key(req, session, prompt)
+        cached = _cached_answer(session, key, prompt)
+        if cached is not None:
+            return _cached_stream(cached, session)
+
+        def events() -> Iterator[str]:
+            if req.vehicle_key or req.customer_name:
+                yield _sse("status", {"message": "Carregando dados do veículo/cliente…"})
+            context_prompt, _ = _chat_prompt(req, prompt, session)
+            yield from _stream_agent(context_prompt, CHAT_FALLBACK, session, prompt, key)
+
+        return _pooled_stream(events, CHAT_FALLBACK, session, admission)
+    finally:
+        admission.release()
+
+
+@app.get("/fleet/triage")
+def fleet_triage(
+    response: Response,
+    customer: str | None = None,
+    days: int = 30,
+    top: int = 100,
+    page: int = 1,
+    page_size: int = 50,
+):
+    """Veículos mais arriscados da frota, de uma consulta só (rótulos no SQL + severidade da kb)."""
+    data = _warm(
+        response,
+        bq_client.get_fleet_triage,
+        customer=_filter_set(None, customer, None)["customer"],
+        days=max(1, days),
+        top=max(1, min(top, bq_client.FLEET_TRIAGE_MAX_TOP)),
+        page=max(1, page),
+        page_size=max(1, min(page_size, 200)),
+    )
+    items = [
+        {**item, "priority": triage.priority_for(item["persistent"], item["intermittent"], item["max_weight"])}
+        for item in data["items"]
+    ]
+    return {**data, "items": items}
+
+
+class TriageJobRequest(BaseModel):
+    customer_name: str | None = None
+    vehicle_keys: list[str] | None = None
+    days: int = 30
+
+
+@app.post("/triage/jobs", status_code=202)
+def create_triage_job(req: TriageJobRequest):
+    """Triagem em lote em segundo plano (mesmo fluxo do CLI `python -m src.agent.triage`)."""
+    keys = [key for key in req.vehicle_keys or [] if (key or "").strip()]
+    if len(keys) > bq_client.MAX_BATCH_KEYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo de {bq_client.MAX_BATCH_KEYS} veículos por lote.",
+        )
+    try:
+        return triage.submit_job(req.customer_name, keys or None, req.days)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    answer = _run_agent(context_prompt)
-    if not answer:
-        answer = "Não foi possível gerar uma resposta no momento. Tente novamente em instantes."
 
-    return {"answer": answer, "tips": tips}
\ No newline at end of file
+@app.get("/triage/jobs/{job_id}")
+def get_triage_job(job_id: str, format: str = "json"):
+    status = triage.job_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job de triagem não encontrado.")
+    if format == "md" and status.get("report"):
+        return Response(triage.render_markdown(status["report"]), media_type="text/markdown; charset=utf-8")
+    return status
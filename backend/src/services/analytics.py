@@ -0,0 +1,399 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import bq_client
+from . import config
+from . import disk_cache
+from .breaker import degradation, report_stale
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Analytics de DTC da frota: prevalência (veículos, clientes e dias distintos
+# por DTC) e coocorrência (DTCs no mesmo veículo na mesma janela de tempo).
+# A unidade é o índice de um dia (bq_client.get_dtc_day_index), uma consulta por
+# (dia, janela). Dias fechados vão para o cache em disco e nunca são refeitos.
+# Hoje é reconsultado a cada ANALYTICS_OPEN_DAY_TTL_SECONDS, em segundo plano.
+# Pedidos de API nunca esperam o BigQuery: dias que faltam são consultados em
+# segundo plano e a resposta sai parcial (complete=false) até completarem.
+# Cada intervalo pedido (janela, N dias) mantém somas esparsas em memória, e a
+# virada do dia só soma o dia novo e subtrai o que saiu. As leituras dos
+# endpoints são contas sobre essas somas, sem BigQuery.
+# --------------------------------------------------------------------------
+SORTS = ("lift", "count", "confidence", "jaccard")
+DEFAULT_DAYS = 30
+
+# intervalos (janela, dias) mantidos em memória ao mesmo tempo
+_MAX_AGGREGATES = 8
+
+DayIndex = Dict[str, Any]
+
+
+def _bump(counter: Counter, key: str, delta: int) -> None:
+    value = counter[key] + delta
+    if value > 0:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+def _bump_nested(table: Dict[str, Counter], key: str, inner: str, delta: int) -> None:
+    counter = table.setdefault(key, Counter())
+    _bump(counter, inner, delta)
+    if not counter:
+        del table[key]
+
+
+class _Aggregate:
+    """Somas de um intervalo de dias. Cada dia sai pelo mesmo índice com que entrou."""
+
+    def __init__(self, window_minutes: int, days: int):
+        self.window_minutes = window_minutes
+        self.span = days
+        self.days: Dict[date, DayIndex] = {}
+        self.total_windows = 0
+        self.events: Counter = Counter()
+        self.windows: Counter = Counter()
+        self.day_counts: Counter = Counter()
+        self.vehicles: Dict[str, Counter] = {}  # dtc -> veículo -> dias com o DTC
+        self.customers: Dict[str, Counter] = {}
+        self.pairs: Dict[str, Counter] = {}  # simétrica: dtc -> outro -> janelas juntas
+        self.pair_vehicle_days: Dict[str, Counter] = {}
+        self.descriptions: Dict[str, Optional[str]] = {}
+        self.lock = threading.Lock()
+
+    def _apply(self, index: DayIndex, sign: int) -> None:
+        self.total_windows += sign * int(index.get("total_windows") or 0)
+        for dtc, item in (index.get("dtcs") or {}).items():
+            _bump(self.events, dtc, sign * item["events"])
+            _bump(self.windows, dtc, sign * item["windows"])
+            _bump(self.day_counts, dtc, sign)
+            for vehicle in item["vehicles"]:
+                _bump_nested(self.vehicles, dtc, vehicle, sign)
+            for customer in item["customers"]:
+                _bump_nested(self.customers, dtc, customer, sign)
+            for other, (windows, vehicles) in item["pairs"].items():
+                _bump_nested(self.pairs, dtc, other, sign * windows)
+                _bump_nested(self.pairs, other, dtc, sign * windows)
+                _bump_nested(self.pair_vehicle_days, dtc, other, sign * vehicles)
+                _bump_nested(self.pair_vehicle_days, other, dtc, sign * vehicles)
+            if sign > 0 and item.get("description"):
+                self.descriptions[dtc] = item["description"]
+            elif dtc not in self.events:
+                self.descriptions.pop(dtc, None)
+
+    def add(self, day: date, index: DayIndex) -> None:
+        self.remove(day)
+        self.days[day] = index
+        self._apply(index, +1)
+
+    def remove(self, day: date) -> None:
+        index = self.days.pop(day, None)
+        if index is not None:
+            self._apply(index, -1)
+
+
+class DtcAnalytics:
+    def __init__(
+        self,
+        open_day_ttl: float = config.ANALYTICS_OPEN_DAY_TTL_SECONDS,
+        windows_minutes: Tuple[int, ...] = config.ANALYTICS_WINDOWS_MINUTES,
+        default_window: int = config.ANALYTICS_DEFAULT_WINDOW_MINUTES,
+        max_days: int = config.ANALYTICS_MAX_DAYS,
+        workers: int = 4,
+    ):
+        self.open_day_ttl = float(open_day_ttl)
+        self.windows_minutes = tuple(windows_minutes)
+        self.default_window = default_window
+        self.max_days = max(1, int(max_days))
+        self._day_indexes: Dict[Tuple[date, int], Tuple[DayIndex, float]] = {}
+        self._inflight: set = set()
+        self._degraded_days: set = set()
+        self._aggregates: "OrderedDict[Tuple[int, int], _Aggregate]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="analytics")
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._counters = {"day_queries": 0, "day_disk_hits": 0, "days_added": 0, "days_removed": 0}
+
+    # ---------------------------- validação ---------------------------------
+    def check_window(self, window_minutes: Optional[int]) -> int:
+        window = self.default_window if window_minutes is None else int(window_minutes)
+        if window not in self.windows_minutes:
+            allowed = ", ".join(str(w) for w in self.windows_minutes)
+            raise ValueError(f"Janela inválida: {window_minutes}. Use {allowed} (minutos).")
+        return window
+
+    def _span(self, days: int) -> int:
+        return max(1, min(int(days), self.max_days))
+
+    # --------------------------- índices diários ----------------------------
+    @staticmethod
+    def _disk_key(day: date, window: int) -> str:
+        return disk_cache.make_key(day=day.isoformat(), window_minutes=window)
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    def _disk_day(self, day: date, window: int) -> Optional[DayIndex]:
+        if not bq_client.is_closed_range(day):
+            return None
+        index = disk_cache.get("analytics", self._disk_key(day, window))
+        if index is not None:
+            self._count("day_disk_hits")
+        return index
+
+    def _fetch_day(self, day: date, window: int) -> DayIndex:
+        index = self._disk_day(day, window)
+        if index is not None:
+            return index
+        closed = bq_client.is_closed_range(day)
+        with degradation() as degraded:
+            index = bq_client.get_dtc_day_index(day, window)
+        self._count("day_queries")
+        if degraded["stale"]:
+            # último índice bom: não vai para o disco e é reconsultado como um dia aberto
+            report_stale(degraded["age"])
+            with self._lock:
+                self._degraded_days.add((day, window))
+            return index
+        with self._lock:
+            self._degraded_days.discard((day, window))
+        if closed:
+            disk_cache.put("analytics", self._disk_key(day, window), index)
+        return index
+
+    def _store_day(self, day: date, window: int, index: DayIndex) -> None:
+        with self._lock:
+            self._day_indexes[(day, window)] = (index, time.monotonic())
+
+    def _refresh_day_async(self, day: date, window: int) -> None:
+        with self._lock:
+            if (day, window) in self._inflight:
+                return
+            self._inflight.add((day, window))
+
+        def job() -> None:
+            try:
+                self._store_day(day, window, self._fetch_day(day, window))
+            except Exception:
+                # mantém o índice anterior; a próxima leitura tenta de novo
+                logger.warning("Falha ao atualizar o índice de DTCs de %s", day, exc_info=True)
+            finally:
+                with self._lock:
+                    self._inflight.discard((day, window))
+
+        self._executor.submit(job)
+
+    def _day_indexes_for(self, days: List[date], window: int, block: bool) -> Dict[date, DayIndex]:
+        """Índices dos dias pedidos que já estão à mão (memória ou disco).
+
+        Sem `block` (pedido de API) nada espera o BigQuery: faltantes e dias abertos vencidos
+        são consultados em segundo plano e o resultado pode vir sem alguns dias. Com `block`
+        (aquecedor) os faltantes e vencidos são consultados agora, em paralelo."""
+        found: Dict[date, DayIndex] = {}
+        missing: List[date] = []
+        now = time.monotonic()
+        with self._lock:
+            cached = {d: self._day_indexes.get((d, window)) for d in days}
+            degraded = {d for d in days if (d, window) in self._degraded_days}
+        for d in days:
+            entry = cached[d]
+            if entry is None:
+                missing.append(d)
+                continue
+            index, fetched_at = entry
+            expired = (not bq_client.is_closed_range(d) or d in degraded) and now - fetched_at > self.open_day_ttl
+            if expired and block:
+                missing.append(d)
+                continue
+            if expired:
+                self._refresh_day_async(d, window)
+            found[d] = index
+
+        if missing and not block:
+            for d in missing:
+                index = self._disk_day(d, window)
+                if index is None:
+                    self._refresh_day_async(d, window)
+                    continue
+                found[d] = index
+                self._store_day(d, window, index)
+            return found
+
+        if missing:
+            futures = {
+                d: self._executor.submit(contextvars.copy_context().run, self._fetch_day, d, window)
+                for d in missing
+            }
+            for d, future in futures.items():
+                found[d] = future.result()
+                self._store_day(d, window, found[d])
+        return found
+
+    def _evict_days(self, today: date) -> None:
+        oldest = today - timedelta(days=self.max_days)
+        with self._lock:
+            for key in [k for k in self._day_indexes if k[0] < oldest]:
+                del self._day_indexes[key]
+                self._degraded_days.discard(key)
+
+    # ------------------------------ intervalos ------------------------------
+    def _aggregate(self, window: int, days: int, block: bool = False) -> _Aggregate:
+        """Soma de (janela, últimos N dias) em dia com o relógio: entra o dia novo, sai o que venceu."""
+        span = self._span(days)
+        with self._lock:
+            agg = self._aggregates.get((window, span))
+            if agg is None:
+                agg = self._aggregates[(window, span)] = _Aggregate(window, span)
+                while len(self._aggregates) > _MAX_AGGREGATES:
+                    self._aggregates.popitem(last=False)
+            self._aggregates.move_to_end((window, span))
+
+        today = datetime.now(timezone.utc).date()
+        wanted = [today - timedelta(days=i) for i in range(span)]
+        indexes = self._day_indexes_for(wanted, window, block)
+        with agg.lock:
+            for d in [d for d in agg.days if d not in indexes]:
+                agg.remove(d)
+                self._count("days_removed")
+            for d, index in indexes.items():
+                if agg.days.get(d) is not index:
+                    agg.add(d, index)
+                    self._count("days_added")
+        self._evict_days(today)
+        return agg
+
+    @staticmethod
+    def _range(agg: _Aggregate) -> Dict[str, Any]:
+        """Intervalo somado; `complete` é falso enquanto há dias sendo consultados em segundo plano."""
+        days = sorted(agg.days)
+        return {
+            "start_date": days[0].isoformat() if days else None,
+            "end_date": days[-1].isoformat() if days else None,
+            "days": agg.span,
+            "loaded_days": len(days),
+            "complete": len(days) >= agg.span,
+        }
+
+    # ------------------------------- leituras -------------------------------
+    def prevalence(self, days: int = DEFAULT_DAYS, dtc: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+        """Por DTC: veículos, clientes e dias distintos no intervalo (mais prevalentes primeiro)."""
+        agg = self._aggregate(self.default_window, days)
+        dtc_key = (dtc or "").strip().upper()
+        with agg.lock:
+            codes = [dtc_key] if dtc_key else list(agg.events)
+            items = [
+                {
+                    "dtc": code,
+                    "dtc_description": agg.descriptions.get(code),
+                    "vehicles": len(agg.vehicles.get(code) or ()),
+                    "customers": len(agg.customers.get(code) or ()),
+                    "days": agg.day_counts.get(code, 0),
+                    "events": agg.events.get(code, 0),
+                }
+                for code in codes
+            ]
+            fleet_vehicles = len({v for counter in agg.vehicles.values() for v in counter})
+            meta = self._range(agg)
+        items.sort(key=lambda i: (i["vehicles"], i["events"]), reverse=True)
+        return {**meta, "fleet_vehicles": fleet_vehicles, "items": items[: max(1, limit)]}
+
+    def cooccurrence(
+        self,
+        dtc: str,
+        days: int = DEFAULT_DAYS,
+        window_minutes: Optional[int] = None,
+        sort: str = "lift",
+        min_count: int = 2,
+        limit: int = 20,
+    ) -> Dict[str, Any]:
+        """
+        DTCs que mais aparecem junto com `dtc` (mesmo veículo, mesma janela).
+        count: janelas com os dois; confidence: count / janelas com `dtc`;
+        lift: quantas vezes mais que o esperado se fossem independentes; jaccard: count / janelas com um ou outro.
+        """
+        window = self.check_window(window_minutes)
+        if sort not in SORTS:
+            raise ValueError(f"Ordenação inválida: {sort}. Use {', '.join(SORTS)}.")
+        code = (dtc or "").strip().upper()
+        if not code:
+            raise ValueError("Informe o DTC.")
+
+        agg = self._aggregate(window, days)
+        with agg.lock:
+            base = agg.windows.get(code, 0)
+            total = agg.total_windows
+            items = []
+            for other, count in (agg.pairs.get(code) or {}).items():
+                if count < min_count:
+                    continue
+                other_windows = agg.windows.get(other, 0)
+                items.append({
+                    "dtc": other,
+                    "dtc_description": agg.descriptions.get(other),
+                    "count": count,
+                    "vehicle_days": (agg.pair_vehicle_days.get(code) or {}).get(other, 0),
+                    "confidence": round(count / base, 4) if base else None,
+                    "lift": round(count * total / (base * other_windows), 3) if base and other_windows else None,
+                    "jaccard": round(count / (base + other_windows - count), 4) if base + other_windows - count else None,
+                })
+            description = agg.descriptions.get(code)
+            meta = self._range(agg)
+        items.sort(key=lambda i: (i[sort] or 0, i["count"]), reverse=True)
+        return {
+            **meta,
+            "dtc": code,
+            "dtc_description": description,
+            "window_minutes": window,
+            "windows": base,
+            "total_windows": total,
+            "items": items[: max(1, limit)],
+        }
+
+    # ------------------------------ aquecedor -------------------------------
+    def start(self) -> None:
+        """Mantém o intervalo padrão (janela padrão, últimos DEFAULT_DAYS dias) sempre montado."""
+        with self._lock:
+            if self._thread is not None or self.open_day_ttl <= 0:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="dtc-analytics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop.set()
+            self._thread = None
+
+    def _run(self, stop: threading.Event) -> None:
+        while True:
+            try:
+                self._aggregate(self.default_window, DEFAULT_DAYS, block=True)
+            except Exception:
+                logger.exception("Falha ao atualizar os analytics de DTC")
+            if stop.wait(self.open_day_ttl):
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            aggregates = [
+                {"window_minutes": w, "days": d, "loaded_days": len(a.days), "dtcs": len(a.events)}
+                for (w, d), a in self._aggregates.items()
+            ]
+            return {
+                "day_indexes": len(self._day_indexes),
+                "refreshing": len(self._inflight),
+                **self._counters,
+                "aggregates": aggregates,
+            }
+
+
+dtc_analytics = DtcAnalytics()
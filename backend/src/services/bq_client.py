@@ -1,13 +1,134 @@
+import concurrent.futures
+import functools
 import math
 import re
+import threading
+import time as _time
 from datetime import date, datetime, time, timedelta, timezone
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
+from google.api_core import exceptions as gexc
 from google.cloud import bigquery
 from . import config  # <-- troquei: import relativo em vez de backend.src.services
+from . import disk_cache
+from . import geo
+from . import kb
+from .breaker import CircuitBreaker, CircuitOpen, report_stale
+from .scheduler import BATCH, DASHBOARD, INTERACTIVE, QueryQueueTimeout, scheduler
+from .shared_cache import shared_cache
 
 _client = bigquery.Client(project=config.GCP_PROJECT_ID)
 
+
+# --------------------------------------------------------------------------
+# Execução das consultas: tempo máximo de espera (a thread não fica presa num
+# BigQuery degradado) + circuit breaker por endpoint. Quando o circuito está
+# aberto ou a consulta falha, devolve o último resultado bom da mesma chamada
+# (marcado como antigo via breaker.report_stale). Sem ele, BigQueryUnavailable.
+# --------------------------------------------------------------------------
+class BigQueryUnavailable(Exception):
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"BigQuery indisponível para {endpoint}")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+# erros do pedido (SQL/parâmetros/tabela) não indicam BigQuery degradado
+_CALLER_ERRORS = (gexc.BadRequest, gexc.NotFound)
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+# último resultado bom por chamada: no cache compartilhado, vale para todos os workers do host
+_LAST_GOOD = "last_good"
+
+
+def _breaker(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def _is_outage(exc: BaseException) -> bool:
+    if isinstance(exc, _CALLER_ERRORS):
+        return False
+    return isinstance(exc, (gexc.GoogleAPIError, concurrent.futures.TimeoutError, ConnectionError))
+
+
+def _query(sql: str, params: List[Any], timeout: Optional[float] = None) -> List[Dict]:
+    job = _client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
+    try:
+        rows = job.result(timeout=timeout or config.BQ_QUERY_TIMEOUT_SECONDS)
+    except concurrent.futures.TimeoutError:
+        try:
+            job.cancel()
+        except Exception:
+            pass
+        raise
+    scheduler.record_bytes(job.total_bytes_processed)
+    return [dict(r) for r in rows]
+
+
+def _guarded(endpoint: str, fallback: bool = True, priority: str = INTERACTIVE) -> Callable:
+    """
+    Protege uma função pública com o breaker `endpoint`. Com `fallback`, guarda o
+    último resultado bom por argumentos e o serve quando o BigQuery falha.
+    Consultas incrementais (marca d'água, token de frescor) usam fallback=False.
+    A execução ocupa uma vaga do escalonador na classe `priority`.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            breaker = _breaker(endpoint)
+            key = disk_cache.make_key(endpoint=endpoint, args=args, kwargs=kwargs) if fallback else None
+            try:
+                breaker.allow()
+            except CircuitOpen as exc:
+                return _fallback(endpoint, key, exc.retry_after, exc)
+
+            try:
+                with scheduler.slot(priority):
+                    started = _time.monotonic()
+                    result = fn(*args, **kwargs)
+            except (BigQueryUnavailable, QueryQueueTimeout):
+                # não chegou a consultar (circuito de dentro aberto ou fila cheia)
+                breaker.release()
+                raise
+            except Exception as exc:
+                if not _is_outage(exc):
+                    breaker.release()
+                    raise
+                breaker.record(False, _time.monotonic() - started)
+                return _fallback(endpoint, key, max(1, int(breaker.open_seconds)), exc)
+            breaker.record(True, _time.monotonic() - started)
+            if key is not None:
+                shared_cache.set(_LAST_GOOD, key, (_time.time(), result), config.BQ_LAST_GOOD_TTL_SECONDS)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _fallback(endpoint: str, key: Optional[str], retry_after: int, cause: BaseException) -> Any:
+    cached = shared_cache.get(_LAST_GOOD, key) if key is not None else None
+    if cached is None:
+        raise BigQueryUnavailable(endpoint, retry_after) from cause
+    stored_at, result = cached
+    report_stale(max(0.0, _time.time() - stored_at))
+    return result
+
+
+def breaker_stats() -> Dict[str, Any]:
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {
+        "last_good_entries": shared_cache.count(_LAST_GOOD),
+        "endpoints": {name: breaker.stats() for name, breaker in sorted(breakers.items())},
+    }
+
 # --------------------------------------------------------------------------
 # Tabelas (ajuste aqui se o nome/namespace mudar)
 # --------------------------------------------------------------------------
@@ -19,13 +140,34 @@ TBL_DEVICES   = "equipe-dados.datawarehouse_gobrax.dw_core_mgmt_devices"
 TBL_INSTALLS  = "equipe-dados.datawarehouse_gobrax.dw_core_mgmt_installed_vehicles"
 TBL_DMS       = "equipe-dados.datawarehouse_gobrax.vw_dms_cs_team"
 
+# tabelas próprias no dataset BQ_DATASET: rollups (src/services/rollups.py, só com
+# HLL_ROLLUPS_ENABLED) e conjuntos de resultado materializados (src/services/result_sets.py)
+HLL_ROLLUPS_ENABLED = config.HLL_ROLLUPS_ENABLED and bool(config.BQ_DATASET)
+RESULT_SETS_ENABLED = bool(config.BQ_DATASET)
+_DATASET_PREFIX = f"{config.GCP_PROJECT_ID or _client.project}.{config.BQ_DATASET}"
+TBL_HLL_DTC      = f"{_DATASET_PREFIX}.dtc_hll_daily"
+TBL_HLL_CUSTOMER = f"{_DATASET_PREFIX}.customer_hll_daily"
+TBL_HLL_DAYS     = f"{_DATASET_PREFIX}.hll_rollup_days"
+
 # --------------------------------------------------------------------------
 # Resolve vehicle: aceita PLACA (case-insensitive), IMEI ou CHASSI (últimos 8)
 # Retorna: {vehicle_id, plate, chassi, chassi_last8, imei?, customer_id, customer_name,
 #           plan_active, plan_type}
+# O resultado fica no cache compartilhado (namespace "vehicle", por chave normalizada)
+# por VEHICLE_CACHE_TTL_SECONDS; chave sem veículo não é guardada.
 # --------------------------------------------------------------------------
+_VEHICLE_CACHE = "vehicle"
+
+
 def resolve_vehicle(vehicle_key: str) -> Optional[Dict]:
     key = (vehicle_key or "").strip().upper()
+    return shared_cache.get_or_set(
+        _VEHICLE_CACHE, key, lambda: _resolve_vehicle(key), config.VEHICLE_CACHE_TTL_SECONDS
+    )
+
+
+@_guarded("vehicle")
+def _resolve_vehicle(key: str) -> Optional[Dict]:
     key_last8 = key[-8:] if key else ""
 
     sql = f"""
@@ -92,24 +234,169 @@ def resolve_vehicle(vehicle_key: str) -> Optional[Dict]:
     LIMIT 1
     """
 
-    job = _client.query(
+    rows = _query(
         sql,
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("key", "STRING", key),
-                bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
-            ]
-        ),
+        [
+            bigquery.ScalarQueryParameter("key", "STRING", key),
+            bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
+        ],
     )
-    rows = [dict(r) for r in job.result()]
     return rows[0] if rows else None
 
+def _window_start(window: timedelta, since_ts: Optional[datetime] = None) -> datetime:
+    """Início da janela. Com cursor (último ts já visto) traz a partir dele, inclusive: eventos
+    com o mesmo ts que chegaram depois da última leitura não se perdem, e quem consome
+    descarta os repetidos."""
+    start = datetime.now(timezone.utc) - window
+    if since_ts is not None:
+        if since_ts.tzinfo is None:
+            since_ts = since_ts.replace(tzinfo=timezone.utc)
+        start = max(start, since_ts)
+    return start
+
+# --------------------------------------------------------------------------
+# Episódios: colapsa eventos consecutivos do mesmo (veículo, DTC, FMI)
+# separados por até `gap` em uma linha (início, fim, contagem, último status)
+# --------------------------------------------------------------------------
+DTC_MODES = ("events", "episodes")
+
+# colunas carregadas para cada episódio (get_dtcs / histórico)
+_DTC_EPISODE_CARRY = [
+    "spn", "plate", "customer_id", "customer_name", "chassi", "chassi_last8",
+    "plan_active", "plan_type", "dtc_description", "fmi_sae", "fmi_pt",
+]
+_HISTORY_EPISODE_CARRY = ["dtc_description", "customer_name", "chassi_last8", "plate"]
+
+
+def check_dtc_mode(mode: str) -> str:
+    """Modo normalizado ("events" ou "episodes"); ValueError se for outro."""
+    mode = (mode or "events").strip().lower()
+    if mode not in DTC_MODES:
+        raise ValueError(f"Modo inválido: {mode}. Use 'events' ou 'episodes'.")
+    return mode
+
+
+def _gap_param(gap_minutes: Optional[int]) -> bigquery.ScalarQueryParameter:
+    minutes = config.DTC_EPISODE_GAP_MINUTES if gap_minutes is None else max(0, gap_minutes)
+    return bigquery.ScalarQueryParameter("gap_seconds", "INT64", minutes * 60)
+
+
+def _episodes_cte(source: str, vehicle_col: str, carry: List[str]) -> str:
+    """CTE `episodes` sobre `source` (precisa de ts, dtc, fmi, status e vehicle_col).
+
+    Um novo episódio começa quando o intervalo para o evento anterior da mesma
+    chave passa de @gap_seconds. `carry` são colunas copiadas com ANY_VALUE.
+    """
+    carried = "".join(f"        ANY_VALUE({col}) AS {col},\n" for col in carry)
+    return f"""
+    , ep_gaps AS (
+      SELECT
+        s.*,
+        IF(
+          LAG(s.ts) OVER w IS NULL
+            OR TIMESTAMP_DIFF(s.ts, LAG(s.ts) OVER w, SECOND) > @gap_seconds,
+          1, 0
+        ) AS new_episode
+      FROM {source} s
+      WINDOW w AS (PARTITION BY s.{vehicle_col}, s.dtc, s.fmi ORDER BY s.ts)
+    ),
+    ep_numbered AS (
+      SELECT
+        g.*,
+        SUM(g.new_episode) OVER (
+          PARTITION BY g.{vehicle_col}, g.dtc, g.fmi
+          ORDER BY g.ts
+          ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+        ) AS episode_no
+      FROM ep_gaps g
+    ),
+    episodes AS (
+      SELECT
+        {vehicle_col},
+        dtc,
+        fmi,
+{carried}        MIN(ts)                                              AS start_ts,
+        MAX(ts)                                              AS end_ts,
+        COUNT(*)                                             AS events,
+        ARRAY_AGG(status IGNORE NULLS ORDER BY ts DESC LIMIT 1)[SAFE_OFFSET(0)] AS last_status
+      FROM ep_numbered
+      GROUP BY {vehicle_col}, dtc, fmi, episode_no
+    )
+    """
+
+# --------------------------------------------------------------------------
+# Marca d'água do veículo: último ts bruto na janela de get_dtcs/get_telemetry.
+# Lê só event_datetime_utc e imeis da telemetria (as instalações do veículo vêm
+# das tabelas pequenas), então um polling condicional que não mudou responde 304
+# sem a consulta completa. Mesmo vínculo IMEI -> instalação -> veículo delas.
+# Com `known_dtcs`, só conta eventos com DTC em dw_dtc_codes, como o `known` de
+# get_dtcs: senão um DTC desconhecido deixa a marca d'água sempre à frente da ETag.
+# --------------------------------------------------------------------------
+@_guarded("event_watermark", fallback=False)
+def get_event_watermark(
+    vehicle_key: str,
+    window: timedelta,
+    since_ts: Optional[datetime] = None,
+    known_dtcs: bool = False,
+) -> Optional[datetime]:
+    since = _window_start(window, since_ts)
+    key = (vehicle_key or "").strip().upper()
+    key_last8 = key[-8:] if key else ""
+
+    sql = f"""
+    WITH veh AS (
+      SELECT v.vehicle_id
+      FROM `{TBL_VEHICLES}` v
+      WHERE UPPER(v.plate) = @key
+         OR RIGHT(UPPER(CAST(v.chassi AS STRING)), 8) = @key_last8
+    ),
+    dev AS (
+      SELECT UPPER(CAST(d.identification AS STRING)) AS imei, CAST(i.start_date AS TIMESTAMP) AS start_ts
+      FROM `{TBL_DEVICES}` d
+      JOIN `{TBL_INSTALLS}` i ON i.device_id = d.device_id
+      WHERE i.vehicle_id IN (SELECT vehicle_id FROM veh)
+         OR UPPER(CAST(d.identification AS STRING)) = @key
+    )
+    SELECT MAX(t.event_datetime_utc) AS latest
+    FROM `{TBL_TELEMETRY}` t,
+    UNNEST(SPLIT(REGEXP_REPLACE(UPPER(CAST(t.imeis AS STRING)), r'[;,\s]+', ','), ',')) AS imei
+    JOIN dev ON dev.imei = TRIM(imei) AND t.event_datetime_utc >= dev.start_ts
+    WHERE t.event_datetime_utc >= @since
+    """
+    if known_dtcs:
+        sql += f"""
+      AND UPPER(CAST(t.DTC AS STRING)) IN (SELECT UPPER(dc.DTC) FROM `{TBL_DTC_CODES}` dc)
+    """
+
+    rows = _query(
+        sql,
+        [
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+            bigquery.ScalarQueryParameter("key", "STRING", key),
+            bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
+        ],
+    )
+    return rows[0].get("latest") if rows else None
+
 # --------------------------------------------------------------------------
 # DTCs recentes (enriquecidos) para PLACA / IMEI / CHASSI(8)
 # Usa: Telemetry -> Devices -> Installed -> Vehicles + DMS (planos)
 # --------------------------------------------------------------------------
-def get_dtcs(vehicle_key: str, hours: int = 24) -> List[Dict]:
-    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+@_guarded("dtcs")
+def get_dtcs(
+    vehicle_key: str,
+    hours: int = 24,
+    mode: str = "events",
+    gap_minutes: Optional[int] = None,
+    since_ts: Optional[datetime] = None,
+) -> List[Dict]:
+    """DTCs do veículo na janela. mode="episodes" devolve episódios em vez de eventos.
+
+    `since_ts` (cursor de polling) restringe a varredura ao que está a partir dele (inclusive;
+    os eventos do próprio cursor voltam e o cliente descarta os repetidos).
+    """
+    mode = check_dtc_mode(mode)
+    since = _window_start(timedelta(hours=hours), since_ts)
     key = (vehicle_key or "").strip().upper()
     key_last8 = key[-8:] if key else ""
 
@@ -197,10 +484,6 @@ def get_dtcs(vehicle_key: str, hours: int = 24) -> List[Dict]:
       JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = f.dtc
       LEFT JOIN `{TBL_FMI_CODES}` fc ON fc.FMI = f.fmi
     )
-    SELECT *
-    FROM known
-    ORDER BY ts DESC
-    LIMIT 500
     """
 
     params = [
@@ -208,53 +491,163 @@ def get_dtcs(vehicle_key: str, hours: int = 24) -> List[Dict]:
         bigquery.ScalarQueryParameter("key", "STRING", key),
         bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
     ]
-    job = _client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-    return [dict(r) for r in job.result()]
 
-def get_overview_events(
-    chassi_last8: Optional[str] = None,
-    customer: Optional[str] = None,
-    dtc: Optional[str] = None,
-    event_date: Optional[date] = None,
-    days: int = 30,
-    limit: int = 500,
-) -> List[Dict]:
-    since = datetime.now(timezone.utc) - timedelta(days=days)
-    chassi_key = (chassi_last8 or "").strip().upper()
-    customer_key = (customer or "").strip().lower()
-    dtc_key = (dtc or "").strip().upper()
+    if mode == "episodes":
+        sql += f"""
+        {_episodes_cte("known", "vehicle_id", _DTC_EPISODE_CARRY)}
+        SELECT *
+        FROM episodes
+        ORDER BY end_ts DESC
+        LIMIT 500
+        """
+        params.append(_gap_param(gap_minutes))
+    else:
+        sql += """
+        SELECT *
+        FROM known
+        ORDER BY ts DESC
+        LIMIT 500
+        """
+
+    return _query(sql, params)
 
-    date_start: Optional[datetime] = None
-    date_end: Optional[datetime] = None
-    if event_date:
-        date_start = datetime.combine(event_date, time.min, tzinfo=timezone.utc)
-        date_end = date_start + timedelta(days=1)
+# --------------------------------------------------------------------------
+# Lote de veículos: resolve várias PLACAS / IMEIs / CHASSIS(8) de uma vez e
+# busca os DTCs de todos numa única varredura (parâmetros ARRAY em vez de N jobs)
+# --------------------------------------------------------------------------
+MAX_BATCH_KEYS = 500
 
-    filters: list[str] = []
-    params: list[bigquery.ScalarQueryParameter] = [
-        bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
-        bigquery.ScalarQueryParameter("limit", "INT64", limit),
-    ]
 
-    if chassi_key:
-        filters.append("tf.chassi_last8 = @chassi")
-        params.append(bigquery.ScalarQueryParameter("chassi", "STRING", chassi_key))
+def _normalize_keys(vehicle_keys: List[str]) -> List[str]:
+    keys: List[str] = []
+    seen = set()
+    for raw in vehicle_keys or []:
+        key = (raw or "").strip().upper()
+        if key and key not in seen:
+            seen.add(key)
+            keys.append(key)
+    return keys
 
-    if customer_key:
-        filters.append("LOWER(tf.customer_name) LIKE @customer")
-        params.append(bigquery.ScalarQueryParameter("customer", "STRING", f"%{customer_key}%"))
 
-    if dtc_key:
-        filters.append("tf.dtc = @dtc")
-        params.append(bigquery.ScalarQueryParameter("dtc", "STRING", dtc_key))
+def resolve_vehicles(vehicle_keys: List[str]) -> Dict[str, Dict]:
+    """Versão em lote de resolve_vehicle: retorna {chave normalizada: veículo}.
 
-    if date_start and date_end:
-        filters.append("tf.ts >= @date_start")
-        filters.append("tf.ts < @date_end")
-        params.append(bigquery.ScalarQueryParameter("date_start", "TIMESTAMP", date_start))
-        params.append(bigquery.ScalarQueryParameter("date_end", "TIMESTAMP", date_end))
+    Chaves sem veículo correspondente simplesmente não aparecem no resultado.
+    Chaves já resolvidas (por aqui ou por resolve_vehicle) vêm do cache compartilhado.
+    """
+    keys = _normalize_keys(vehicle_keys)
+    if not keys:
+        return {}
+    resolved: Dict[str, Dict] = shared_cache.get_many(_VEHICLE_CACHE, keys)
+    keys = [k for k in keys if k not in resolved]
+    if not keys:
+        return resolved
 
-    where_clause = " AND ".join(["TRUE"] + filters)
+    sql = f"""
+    WITH keys AS (
+      SELECT k AS vehicle_key, RIGHT(k, 8) AS key_last8
+      FROM UNNEST(@keys) AS k
+    ),
+    veh AS (
+      SELECT
+        v.vehicle_id,
+        UPPER(v.plate)                                 AS plate,
+        UPPER(CAST(v.chassi AS STRING))               AS chassi,
+        RIGHT(UPPER(CAST(v.chassi AS STRING)), 8)     AS chassi_last8,
+        v.customer_id,
+        v.customer_name
+      FROM `{TBL_VEHICLES}` v
+    ),
+    dev AS (
+      SELECT
+        d.device_id,
+        UPPER(CAST(d.identification AS STRING)) AS imei
+      FROM `{TBL_DEVICES}` d
+    ),
+    last_inst AS (
+      SELECT device_id, vehicle_id
+      FROM (
+        SELECT
+          i.*,
+          ROW_NUMBER() OVER (PARTITION BY i.device_id ORDER BY CAST(i.start_date AS TIMESTAMP) DESC) rn
+        FROM `{TBL_INSTALLS}` i
+      )
+      WHERE rn = 1
+    ),
+    imei_to_vehicle AS (
+      SELECT d.imei, li.vehicle_id
+      FROM dev d
+      JOIN last_inst li USING (device_id)
+    ),
+    dms AS (
+      SELECT
+        RIGHT(UPPER(CAST(chassis AS STRING)), 8) AS chassi_last8,
+        CAST(status_gobrax AS BOOL)             AS plan_active,
+        CAST(plan_type     AS STRING)           AS plan_type
+      FROM `{TBL_DMS}`
+    ),
+    result_base AS (
+      -- por PLACA
+      SELECT k.vehicle_key, v.vehicle_id, v.plate, NULL AS imei, v.chassi, v.chassi_last8,
+             v.customer_id, v.customer_name
+      FROM keys k
+      JOIN veh v ON v.plate = k.vehicle_key
+
+      UNION ALL
+
+      -- por CHASSI (8)
+      SELECT k.vehicle_key, v.vehicle_id, v.plate, NULL AS imei, v.chassi, v.chassi_last8,
+             v.customer_id, v.customer_name
+      FROM keys k
+      JOIN veh v ON v.chassi_last8 = k.key_last8
+
+      UNION ALL
+
+      -- por IMEI (device -> instalação -> veículo)
+      SELECT k.vehicle_key, v.vehicle_id, v.plate, itv.imei AS imei, v.chassi, v.chassi_last8,
+             v.customer_id, v.customer_name
+      FROM keys k
+      JOIN imei_to_vehicle itv ON itv.imei = k.vehicle_key
+      JOIN veh v ON v.vehicle_id = itv.vehicle_id
+    )
+    SELECT
+      rb.*,
+      dm.plan_active,
+      dm.plan_type
+    FROM result_base rb
+    LEFT JOIN dms dm USING (chassi_last8)
+    WHERE TRUE
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY rb.vehicle_key) = 1
+    """
+
+    fetched: Dict[str, Dict] = {}
+    for row in _query(sql, [bigquery.ArrayQueryParameter("keys", "STRING", keys)]):
+        fetched[row.pop("vehicle_key")] = row
+    shared_cache.set_many(_VEHICLE_CACHE, fetched, config.VEHICLE_CACHE_TTL_SECONDS)
+    return {**resolved, **fetched}
+
+
+@_guarded("dtcs_batch", priority=BATCH)
+def get_dtcs_batch(vehicle_keys: List[str], hours: int = 24) -> Dict:
+    """DTCs recentes para vários veículos com uma única consulta na telemetria.
+
+    Retorna {"items": {chave: {"vehicle": {...}, "dtcs": [...]}}, "errors": {chave: msg}}.
+    As chaves são devolvidas normalizadas (trim + maiúsculas).
+    """
+    keys = _normalize_keys(vehicle_keys)
+    if not keys:
+        return {"items": {}, "errors": {}}
+
+    resolved = resolve_vehicles(keys)
+    errors = {k: "Veículo não encontrado." for k in keys if k not in resolved}
+    if not resolved:
+        return {"items": {}, "errors": errors}
+
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    found_keys = [k for k in keys if k in resolved]
+    plates = sorted({v["plate"] for v in resolved.values() if v.get("plate")})
+    imeis = sorted({v["imei"] for v in resolved.values() if v.get("imei")})
+    last8s = sorted({v["chassi_last8"] for v in resolved.values() if v.get("chassi_last8")})
 
     sql = f"""
     WITH dtc_raw AS (
@@ -273,7 +666,7 @@ def get_overview_events(
         r.ts, r.dtc, r.spn, r.fmi, r.status, r.lat, r.lon,
         TRIM(imei) AS imei_norm
       FROM dtc_raw r,
-      UNNEST(SPLIT(REGEXP_REPLACE(r.imeis, r'[;,\s]+', ','), ',')) AS imei
+      UNNEST(SPLIT(REGEXP_REPLACE(r.imeis, r'[;,\\s]+', ','), ',')) AS imei
     ),
     dev AS (
       SELECT d.device_id, UPPER(CAST(d.identification AS STRING)) AS imei
@@ -293,6 +686,13 @@ def get_overview_events(
         v.customer_name
       FROM `{TBL_VEHICLES}` v
     ),
+    dms AS (
+      SELECT
+        RIGHT(UPPER(CAST(chassis AS STRING)), 8) AS chassi_last8,
+        CAST(status_gobrax AS BOOL)             AS plan_active,
+        CAST(plan_type     AS STRING)           AS plan_type
+      FROM `{TBL_DMS}`
+    ),
     t_dev AS (
       SELECT n.*, d.device_id
       FROM dtc_norm n
@@ -305,56 +705,242 @@ def get_overview_events(
         ON iv.device_id = td.device_id
        AND td.ts >= iv.start_ts
     ),
+    -- mesmo filtro de get_dtcs, só que contra as listas de chaves resolvidas
     t_full AS (
       SELECT
-        tdi.ts,
-        tdi.dtc,
-        tdi.spn,
-        tdi.fmi,
-        tdi.status,
-        tdi.lat,
-        tdi.lon,
+        tdi.ts, tdi.dtc, tdi.spn, tdi.fmi, tdi.status, tdi.lat, tdi.lon,
         tdi.imei_norm,
-        v.plate,
-        v.customer_id,
-        v.customer_name,
-        v.chassi,
-        v.chassi_last8
+        v.vehicle_id, v.plate, v.customer_id, v.customer_name, v.chassi, v.chassi_last8,
+        dm.plan_active, dm.plan_type
       FROM t_dev_inst tdi
       JOIN veh v ON v.vehicle_id = tdi.vehicle_id
+      LEFT JOIN dms dm USING (chassi_last8)
+      WHERE v.plate IN UNNEST(@plates)
+         OR UPPER(tdi.imei_norm) IN UNNEST(@imeis)
+         OR v.chassi_last8 IN UNNEST(@last8s)
+    ),
+    known AS (
+      SELECT
+        f.*,
+        dc.Description   AS dtc_description,
+        fc.SAE_J1939     AS fmi_sae,
+        fc.transcription AS fmi_pt
+      FROM t_full f
+      JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = f.dtc
+      LEFT JOIN `{TBL_FMI_CODES}` fc ON fc.FMI = f.fmi
     )
-    SELECT
-      tf.ts,
-      tf.dtc,
-      tf.spn,
-      tf.fmi,
-      tf.status,
-      tf.lat,
-      tf.lon,
-      tf.customer_name,
-      tf.chassi_last8,
-      tf.plate,
-      tf.imei_norm AS imei,
-      dc.Description AS dtc_description
-    FROM t_full tf
-    JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = tf.dtc
-    WHERE {where_clause}
-    ORDER BY tf.ts DESC
-    LIMIT @limit
+    SELECT *
+    FROM known
+    WHERE TRUE
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY vehicle_id ORDER BY ts DESC) <= 500
+    ORDER BY vehicle_id, ts DESC
     """
 
-    job = _client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-    rows = [dict(r) for r in job.result()]
+    params = [
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+        bigquery.ArrayQueryParameter("plates", "STRING", plates),
+        bigquery.ArrayQueryParameter("imeis", "STRING", imeis),
+        bigquery.ArrayQueryParameter("last8s", "STRING", last8s),
+    ]
+    by_vehicle: Dict[object, List[Dict]] = {}
+    for row in _query(sql, params):
+        by_vehicle.setdefault(row.get("vehicle_id"), []).append(row)
+
+    items: Dict[str, Dict] = {}
+    for key in found_keys:
+        vehicle = resolved[key]
+        items[key] = {
+            "vehicle": vehicle,
+            "dtcs": by_vehicle.get(vehicle.get("vehicle_id"), []),
+        }
+    return {"items": items, "errors": errors}
+
+def _overview_filters(
+    chassi_last8: Optional[str] = None,
+    customer: Optional[str] = None,
+    dtc: Optional[str] = None,
+) -> Tuple[List[str], List[bigquery.ScalarQueryParameter]]:
+    """Filtros da visão geral (sobre o alias `tf`), compartilhados com o feed ao vivo."""
+    chassi_key = (chassi_last8 or "").strip().upper()
+    customer_key = (customer or "").strip().lower()
+    dtc_key = (dtc or "").strip().upper()
 
-    aggregated: Dict[str, Dict] = {}
+    filters: List[str] = []
+    params: List[bigquery.ScalarQueryParameter] = []
 
-    for row in rows:
-        cust = row.get("customer_name") or "Sem cliente"
-        chassi = row.get("chassi_last8") or ""
-        key = f"{cust}|{chassi}"
-        entry = aggregated.setdefault(
-            key,
-            {
+    if chassi_key:
+        filters.append("tf.chassi_last8 = @chassi")
+        params.append(bigquery.ScalarQueryParameter("chassi", "STRING", chassi_key))
+
+    if customer_key:
+        filters.append("LOWER(tf.customer_name) LIKE @customer")
+        params.append(bigquery.ScalarQueryParameter("customer", "STRING", f"%{customer_key}%"))
+
+    if dtc_key:
+        filters.append("tf.dtc = @dtc")
+        params.append(bigquery.ScalarQueryParameter("dtc", "STRING", dtc_key))
+
+    return filters, params
+
+
+def _overview_cte() -> str:
+    return f"""
+    WITH dtc_raw AS (
+      SELECT
+        t.event_datetime_utc                       AS ts,
+        UPPER(CAST(t.DTC AS STRING))               AS dtc,
+        SAFE_CAST(t.spn AS INT64)                  AS spn,
+        SAFE_CAST(t.fmi AS INT64)                  AS fmi,
+        t.status, t.lat, t.lon,
+        UPPER(CAST(t.imeis AS STRING))             AS imeis
+      FROM `{TBL_TELEMETRY}` t
+      WHERE t.event_datetime_utc >= @since
+    ),
+    dtc_norm AS (
+      SELECT
+        r.ts, r.dtc, r.spn, r.fmi, r.status, r.lat, r.lon,
+        TRIM(imei) AS imei_norm
+      FROM dtc_raw r,
+      UNNEST(SPLIT(REGEXP_REPLACE(r.imeis, r'[;,\s]+', ','), ',')) AS imei
+    ),
+    dev AS (
+      SELECT d.device_id, UPPER(CAST(d.identification AS STRING)) AS imei
+      FROM `{TBL_DEVICES}` d
+    ),
+    inst AS (
+      SELECT i.device_id, i.vehicle_id, CAST(i.start_date AS TIMESTAMP) AS start_ts
+      FROM `{TBL_INSTALLS}` i
+    ),
+    veh AS (
+      SELECT
+        v.vehicle_id,
+        UPPER(v.plate)                             AS plate,
+        UPPER(CAST(v.chassi AS STRING))           AS chassi,
+        RIGHT(UPPER(CAST(v.chassi AS STRING)), 8) AS chassi_last8,
+        v.customer_id,
+        v.customer_name
+      FROM `{TBL_VEHICLES}` v
+    ),
+    t_dev AS (
+      SELECT n.*, d.device_id
+      FROM dtc_norm n
+      JOIN dev d ON UPPER(n.imei_norm) = d.imei
+    ),
+    t_dev_inst AS (
+      SELECT td.*, iv.vehicle_id
+      FROM t_dev td
+      JOIN inst iv
+        ON iv.device_id = td.device_id
+       AND td.ts >= iv.start_ts
+    ),
+    t_full AS (
+      SELECT
+        tdi.ts,
+        tdi.dtc,
+        tdi.spn,
+        tdi.fmi,
+        tdi.status,
+        tdi.lat,
+        tdi.lon,
+        tdi.imei_norm,
+        v.vehicle_id,
+        v.plate,
+        v.customer_id,
+        v.customer_name,
+        v.chassi,
+        v.chassi_last8
+      FROM t_dev_inst tdi
+      JOIN veh v ON v.vehicle_id = tdi.vehicle_id
+    )
+    """
+
+
+_OVERVIEW_COLUMNS = """
+      tf.ts,
+      tf.dtc,
+      tf.spn,
+      tf.fmi,
+      tf.status,
+      tf.lat,
+      tf.lon,
+      tf.customer_name,
+      tf.chassi_last8,
+      tf.plate,
+      tf.imei_norm AS imei,
+      dc.Description AS dtc_description
+"""
+
+
+# id estável do evento (o mesmo a cada leitura), para descartar repetidos no feed ao vivo
+_EVENT_ID = "TO_HEX(MD5(FORMAT('%T', (tf.ts, tf.imei_norm, tf.chassi_last8, tf.dtc, tf.spn, tf.fmi, tf.status))))"
+
+
+def overview_event(row: Dict) -> Dict:
+    """Evento no formato da visão geral (o mesmo de `events` em get_overview_events)."""
+    ts: Optional[datetime] = row.get("ts")
+    return {
+        "dtc": row.get("dtc"),
+        "dtc_description": row.get("dtc_description"),
+        "timestamp": ts.isoformat() if ts else None,
+        "status": row.get("status"),
+        "lat": row.get("lat"),
+        "lon": row.get("lon"),
+        "imei": row.get("imei"),
+    }
+
+
+@_guarded("overview", priority=DASHBOARD)
+def get_overview_events(
+    chassi_last8: Optional[str] = None,
+    customer: Optional[str] = None,
+    dtc: Optional[str] = None,
+    event_date: Optional[date] = None,
+    days: int = 30,
+    limit: int = 500,
+) -> List[Dict]:
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+
+    date_start: Optional[datetime] = None
+    date_end: Optional[datetime] = None
+    if event_date:
+        date_start = datetime.combine(event_date, time.min, tzinfo=timezone.utc)
+        date_end = date_start + timedelta(days=1)
+
+    filters, params = _overview_filters(chassi_last8, customer, dtc)
+    params += [
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+        bigquery.ScalarQueryParameter("limit", "INT64", limit),
+    ]
+
+    if date_start and date_end:
+        filters.append("tf.ts >= @date_start")
+        filters.append("tf.ts < @date_end")
+        params.append(bigquery.ScalarQueryParameter("date_start", "TIMESTAMP", date_start))
+        params.append(bigquery.ScalarQueryParameter("date_end", "TIMESTAMP", date_end))
+
+    where_clause = " AND ".join(["TRUE"] + filters)
+
+    sql = f"""
+    {_overview_cte()}
+    SELECT{_OVERVIEW_COLUMNS}
+    FROM t_full tf
+    JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = tf.dtc
+    WHERE {where_clause}
+    ORDER BY tf.ts DESC
+    LIMIT @limit
+    """
+
+    rows = _query(sql, params)
+
+    aggregated: Dict[str, Dict] = {}
+
+    for row in rows:
+        cust = row.get("customer_name") or "Sem cliente"
+        chassi = row.get("chassi_last8") or ""
+        key = f"{cust}|{chassi}"
+        entry = aggregated.setdefault(
+            key,
+            {
                 "customer_name": cust,
                 "chassi_last8": chassi,
                 "plate": row.get("plate"),
@@ -370,17 +956,7 @@ def get_overview_events(
         if ts and (entry["most_recent"] is None or ts > entry["most_recent"]):
             entry["most_recent"] = ts
 
-        entry["events"].append(
-            {
-                "dtc": row.get("dtc"),
-                "dtc_description": row.get("dtc_description"),
-                "timestamp": ts.isoformat() if ts else None,
-                "status": row.get("status"),
-                "lat": row.get("lat"),
-                "lon": row.get("lon"),
-                "imei": row.get("imei"),
-            }
-        )
+        entry["events"].append(overview_event(row))
 
     items: List[Dict] = []
     for entry in aggregated.values():
@@ -392,6 +968,77 @@ def get_overview_events(
     return items
 
 
+# --------------------------------------------------------------------------
+# Feed ao vivo: mesmos filtros da visão geral, lidos de forma incremental
+# a partir de uma marca d'água (ts do último evento já entregue)
+# --------------------------------------------------------------------------
+@_guarded("live", fallback=False, priority=DASHBOARD)
+def get_overview_watermark(
+    chassi_last8: Optional[str] = None,
+    customer: Optional[str] = None,
+    dtc: Optional[str] = None,
+    hours: int = 24,
+) -> Optional[datetime]:
+    """Timestamp do evento mais recente que casa com os filtros (None se não houver)."""
+    filters, params = _overview_filters(chassi_last8, customer, dtc)
+    params.append(bigquery.ScalarQueryParameter("since", "TIMESTAMP", _window_start(timedelta(hours=hours))))
+    where_clause = " AND ".join(["TRUE"] + filters)
+
+    sql = f"""
+    {_overview_cte()}
+    SELECT MAX(tf.ts) AS latest_ts
+    FROM t_full tf
+    JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = tf.dtc
+    WHERE {where_clause}
+    """
+
+    rows = _query(sql, params)
+    return rows[0].get("latest_ts") if rows else None
+
+
+@_guarded("live", fallback=False, priority=DASHBOARD)
+def get_new_overview_events(
+    chassi_last8: Optional[str] = None,
+    customer: Optional[str] = None,
+    dtc: Optional[str] = None,
+    since_ts: Optional[datetime] = None,
+    exclude_ids: Sequence[str] = (),
+    hours: int = 24,
+    limit: int = 500,
+) -> List[Dict]:
+    """Eventos a partir de `since_ts` (inclusive), menos os de `exclude_ids`, em ordem (ts, event_id).
+
+    Quem lê guarda os ids já entregues e os passa em `exclude_ids`: como as linhas
+    devolvidas são sempre novas, uma rajada maior que `limit` (mesmo toda no mesmo ts)
+    sai em várias leituras sem buracos, e reler uma sobreposição antes do cursor pega
+    eventos que chegaram atrasados.
+    """
+    filters, params = _overview_filters(chassi_last8, customer, dtc)
+    params += [
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", _window_start(timedelta(hours=hours), since_ts)),
+        bigquery.ArrayQueryParameter("exclude_ids", "STRING", list(exclude_ids)),
+        bigquery.ScalarQueryParameter("limit", "INT64", limit),
+    ]
+    where_clause = " AND ".join(["TRUE"] + filters)
+
+    sql = f"""
+    {_overview_cte()}
+    SELECT *
+    FROM (
+      SELECT{_OVERVIEW_COLUMNS.rstrip()},
+        {_EVENT_ID} AS event_id
+      FROM t_full tf
+      JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = tf.dtc
+      WHERE {where_clause}
+    )
+    WHERE event_id NOT IN UNNEST(@exclude_ids)
+    ORDER BY ts ASC, event_id ASC
+    LIMIT @limit
+    """
+
+    return _query(sql, params)
+
+
 def _resolve_history_dates(
     start_date: Optional[date],
     end_date: Optional[date],
@@ -417,6 +1064,21 @@ def _resolve_history_dates(
     return start_date, end_date, start_dt, end_dt
 
 
+
+def resolve_history_range(
+    start_date: Optional[date],
+    end_date: Optional[date],
+    default_days: int = 7,
+) -> Tuple[date, date]:
+    resolved_start, resolved_end, _, _ = _resolve_history_dates(start_date, end_date, default_days)
+    return resolved_start, resolved_end
+
+
+def is_closed_range(end_date: date) -> bool:
+    """True quando o intervalo termina antes de hoje (UTC) menos HISTORY_SETTLE_DAYS: o resultado não muda mais."""
+    today = datetime.now(timezone.utc).date()
+    return end_date < today - timedelta(days=config.HISTORY_SETTLE_DAYS)
+
 def _history_filters(
     chassi_last8: Optional[str],
     customer: Optional[str],
@@ -513,6 +1175,7 @@ def _history_base_cte(where_clause: str) -> str:
         tdi.lat,
         tdi.lon,
         tdi.imei_norm,
+        v.vehicle_id,
         v.plate,
         v.customer_id,
         v.customer_name,
@@ -535,6 +1198,7 @@ def _history_base_cte(where_clause: str) -> str:
         tf.chassi_last8,
         tf.plate,
         tf.imei_norm AS imei,
+        tf.vehicle_id,
         dc.Description AS dtc_description
       FROM t_full tf
       JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = tf.dtc
@@ -543,6 +1207,23 @@ def _history_base_cte(where_clause: str) -> str:
     """
 
 
+def _history_source(where_clause: str, result_table: Optional[str] = None) -> str:
+    """
+    CTE `history_base`: a cadeia completa de joins ou, com `result_table`, a tabela já
+    materializada (create_result_set). Os filtros valem nos dois casos (colunas iguais).
+    """
+    if not result_table:
+        return _history_base_cte(where_clause)
+    return f"""
+    WITH history_base AS (
+      SELECT tf.*
+      FROM `{result_table}` tf
+      WHERE {where_clause}
+    )
+    """
+
+
+@_guarded("history_daily", priority=DASHBOARD)
 def get_history_daily_counts(
     chassi_last8: Optional[str] = None,
     customer: Optional[str] = None,
@@ -550,13 +1231,14 @@ def get_history_daily_counts(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     default_days: int = 7,
+    result_table: Optional[str] = None,
 ) -> Dict:
     where_clause, params, resolved_start, resolved_end = _history_filters(
         chassi_last8, customer, dtc, start_date, end_date, default_days
     )
 
     sql = f"""
-    {_history_base_cte(where_clause)}
+    {_history_source(where_clause, result_table)}
     , daily_dtc AS (
       SELECT
         DATE(ts) AS event_date,
@@ -574,8 +1256,7 @@ def get_history_daily_counts(
     ORDER BY event_date
     """
 
-    job = _client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-    rows = [dict(r) for r in job.result()]
+    rows = _query(sql, params)
 
     points: List[Dict] = []
     for row in rows:
@@ -599,6 +1280,7 @@ def get_history_daily_counts(
     }
 
 
+@_guarded("history_events", priority=DASHBOARD)
 def get_history_events(
     chassi_last8: Optional[str] = None,
     customer: Optional[str] = None,
@@ -609,7 +1291,11 @@ def get_history_events(
     page_size: int = 25,
     order: str = "desc",
     default_days: int = 7,
+    mode: str = "events",
+    gap_minutes: Optional[int] = None,
+    result_table: Optional[str] = None,
 ) -> Dict:
+    mode = check_dtc_mode(mode)
     page = max(1, page)
     page_size = max(1, min(page_size, 200))
     order_direction = "DESC" if str(order).lower() != "asc" else "ASC"
@@ -623,8 +1309,14 @@ def get_history_events(
     params.append(bigquery.ScalarQueryParameter("offset", "INT64", offset))
     params.append(bigquery.ScalarQueryParameter("limit", "INT64", page_size))
 
+    if mode == "episodes":
+        params.append(_gap_param(gap_minutes))
+        return _history_episodes_page(
+            where_clause, params, order_direction, page, page_size, resolved_start, resolved_end, result_table
+        )
+
     sql = f"""
-    {_history_base_cte(where_clause)}
+    {_history_source(where_clause, result_table)}
     , numbered AS (
       SELECT
         ts,
@@ -655,8 +1347,7 @@ def get_history_events(
     ORDER BY row_number
     """
 
-    job = _client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-    rows = [dict(r) for r in job.result()]
+    rows = _query(sql, params)
 
     items: List[Dict] = []
     total_count = 0
@@ -678,52 +1369,878 @@ def get_history_events(
 
     total_pages = math.ceil(total_count / page_size) if page_size else 1
 
-    return {
-        "items": items,
-        "pagination": {
-            "page": page,
-            "page_size": page_size,
-            "total_items": total_count,
-            "total_pages": max(1, total_pages),
-        },
-        "range": {
-            "start_date": resolved_start.isoformat(),
-            "end_date": resolved_end.isoformat(),
-        },
-    }
+    return {
+        "items": items,
+        "pagination": {
+            "page": page,
+            "page_size": page_size,
+            "total_items": total_count,
+            "total_pages": max(1, total_pages),
+        },
+        "range": {
+            "start_date": resolved_start.isoformat(),
+            "end_date": resolved_end.isoformat(),
+        },
+    }
+
+def _history_episodes_page(
+    where_clause: str,
+    params: List[bigquery.ScalarQueryParameter],
+    order_direction: str,
+    page: int,
+    page_size: int,
+    resolved_start: date,
+    resolved_end: date,
+    result_table: Optional[str] = None,
+) -> Dict:
+    sql = f"""
+    {_history_source(where_clause, result_table)}
+    {_episodes_cte("history_base", "chassi", _HISTORY_EPISODE_CARRY)}
+    , numbered AS (
+      SELECT
+        e.*,
+        COUNT(*) OVER() AS total_count,
+        ROW_NUMBER() OVER (ORDER BY end_ts {order_direction}) AS row_number
+      FROM episodes e
+    )
+    SELECT *
+    FROM numbered
+    WHERE row_number > @offset AND row_number <= @offset + @limit
+    ORDER BY row_number
+    """
+
+    rows = _query(sql, params)
+
+    items: List[Dict] = []
+    total_count = 0
+    for row in rows:
+        start_value: Optional[datetime] = row.get("start_ts")
+        end_value: Optional[datetime] = row.get("end_ts")
+        total_count = int(row.get("total_count") or total_count)
+        items.append(
+            {
+                # "timestamp"/"status" seguem o formato de eventos (fim do episódio / último status)
+                "timestamp": end_value.isoformat() if isinstance(end_value, datetime) else None,
+                "start_timestamp": start_value.isoformat() if isinstance(start_value, datetime) else None,
+                "events": int(row.get("events") or 0),
+                "customer_name": row.get("customer_name"),
+                "chassi": row.get("chassi"),
+                "chassi_last8": row.get("chassi_last8"),
+                "plate": row.get("plate"),
+                "dtc": row.get("dtc"),
+                "fmi": row.get("fmi"),
+                "dtc_description": row.get("dtc_description"),
+                "status": row.get("last_status"),
+            }
+        )
+
+    total_pages = math.ceil(total_count / page_size) if page_size else 1
+
+    return {
+        "items": items,
+        "mode": "episodes",
+        "pagination": {
+            "page": page,
+            "page_size": page_size,
+            "total_items": total_count,
+            "total_pages": max(1, total_pages),
+        },
+        "range": {
+            "start_date": resolved_start.isoformat(),
+            "end_date": resolved_end.isoformat(),
+        },
+    }
+
+# --------------------------------------------------------------------------
+# Conjuntos de resultado: history_base de um filtro materializado uma vez numa
+# tabela de BQ_DATASET com expiração. As telas de histórico, o mapa e a exportação
+# leem dela (result_table) em vez de refazer os joins. O registro dos handles, o
+# TTL e o limite de armazenamento ficam em src/services/result_sets.py.
+# --------------------------------------------------------------------------
+RESULT_EXPORT_COLUMNS = (
+    "ts", "customer_name", "chassi", "chassi_last8", "plate", "imei",
+    "dtc", "dtc_description", "spn", "fmi", "status", "lat", "lon",
+)
+
+
+def result_table_name(handle: str) -> str:
+    return f"{_DATASET_PREFIX}.result_{handle}"
+
+
+def _check_result_sets() -> None:
+    if not RESULT_SETS_ENABLED:
+        raise ValueError("Conjuntos de resultado não configurados: defina BQ_DATASET.")
+
+
+@_guarded("result_sets", fallback=False, priority=DASHBOARD)
+def create_result_set(
+    table: str,
+    ttl_seconds: int,
+    chassi_last8: Optional[str] = None,
+    customer: Optional[str] = None,
+    dtc: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    default_days: int = 7,
+) -> Dict:
+    """Grava o history_base filtrado em `table` (expira em ttl_seconds). Retorna linhas e bytes."""
+    _check_result_sets()
+    where_clause, params, resolved_start, resolved_end = _history_filters(
+        chassi_last8, customer, dtc, start_date, end_date, default_days
+    )
+    dataset, table_id = table.rsplit(".", 1)
+    params = list(params) + [
+        bigquery.ScalarQueryParameter("ttl_seconds", "INT64", max(60, int(ttl_seconds))),
+        bigquery.ScalarQueryParameter("table_id", "STRING", table_id),
+    ]
+
+    sql = f"""
+    CREATE OR REPLACE TABLE `{table}`
+    CLUSTER BY chassi_last8, dtc
+    OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @ttl_seconds SECOND))
+    AS
+    {_history_base_cte(where_clause)}
+    SELECT * FROM history_base;
+
+    SELECT row_count, size_bytes
+    FROM `{dataset}.__TABLES__`
+    WHERE table_id = @table_id;
+    """
+
+    rows = _query(sql, params)
+    stats = rows[0] if rows else {}
+    return {
+        "rows": int(stats.get("row_count") or 0),
+        "bytes": int(stats.get("size_bytes") or 0),
+        "start_date": resolved_start.isoformat(),
+        "end_date": resolved_end.isoformat(),
+    }
+
+
+@_guarded("result_sets", fallback=False, priority=BATCH)
+def drop_result_set(table: str) -> None:
+    _query(f"DROP TABLE IF EXISTS `{table}`", [])
+
+
+@_guarded("result_sets", fallback=False, priority=BATCH)
+def extend_result_set(table: str, ttl_seconds: int) -> None:
+    """Adia a expiração da tabela para daqui a ttl_seconds (só metadados, sem custo de consulta)."""
+    _query(
+        f"ALTER TABLE `{table}` SET OPTIONS "
+        "(expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @ttl_seconds SECOND))",
+        [bigquery.ScalarQueryParameter("ttl_seconds", "INT64", max(60, int(ttl_seconds)))],
+    )
+
+
+@_guarded("result_export", fallback=False, priority=BATCH)
+def read_result_rows(table: str, start_index: int, max_results: int) -> List[Dict]:
+    """Uma página da tabela materializada (leitura direta, sem custo de consulta; sem ordem garantida)."""
+    rows = _client.list_rows(table, start_index=start_index, max_results=max_results)
+    return [{name: r.get(name) for name in RESULT_EXPORT_COLUMNS} for r in rows]
+
+
+# --------------------------------------------------------------------------
+# Hotspots: eventos do histórico agregados em células geohash (ST_GEOHASH),
+# só dentro dos tiles pedidos (prefixos do geohash; ver src/services/geo.py).
+# Por célula: eventos, veículos distintos, centro dos eventos e DTCs mais comuns.
+# --------------------------------------------------------------------------
+@_guarded("hotspots", priority=DASHBOARD)
+def get_hotspot_tiles(
+    tiles: List[str],
+    precision: int,
+    chassi_last8: Optional[str] = None,
+    customer: Optional[str] = None,
+    dtc: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    default_days: int = 7,
+    top_dtcs: int = config.GEO_TOP_DTCS,
+    result_table: Optional[str] = None,
+) -> Dict[str, List[Dict]]:
+    """{tile: [células]} (tile sem eventos fica de fora)."""
+    if not tiles:
+        return {}
+    tile_precision = len(tiles[0])
+    min_lon, min_lat, max_lon, max_lat = geo.tiles_bbox(tiles)
+    where_clause, params, _, _ = _history_filters(chassi_last8, customer, dtc, start_date, end_date, default_days)
+    params = list(params) + [
+        bigquery.ScalarQueryParameter("precision", "INT64", precision),
+        bigquery.ScalarQueryParameter("tile_precision", "INT64", tile_precision),
+        bigquery.ArrayQueryParameter("tiles", "STRING", tiles),
+        bigquery.ScalarQueryParameter("min_lat", "FLOAT64", min_lat),
+        bigquery.ScalarQueryParameter("max_lat", "FLOAT64", max_lat),
+        bigquery.ScalarQueryParameter("min_lon", "FLOAT64", min_lon),
+        bigquery.ScalarQueryParameter("max_lon", "FLOAT64", max_lon),
+    ]
+
+    sql = f"""
+    {_history_source(where_clause, result_table)}
+    , located AS (
+      SELECT
+        ST_GEOHASH(ST_GEOGPOINT(lon, lat), @precision) AS cell,
+        lat, lon, dtc, vehicle_id
+      FROM history_base
+      WHERE lat BETWEEN @min_lat AND @max_lat
+        AND lon BETWEEN @min_lon AND @max_lon
+        AND NOT (lat = 0 AND lon = 0)
+    ),
+    in_tiles AS (
+      SELECT *, LEFT(cell, @tile_precision) AS tile
+      FROM located
+      WHERE LEFT(cell, @tile_precision) IN UNNEST(@tiles)
+    ),
+    per_cell AS (
+      SELECT
+        tile,
+        cell,
+        COUNT(*)                   AS count,
+        COUNT(DISTINCT vehicle_id) AS vehicles,
+        AVG(lat)                   AS lat,
+        AVG(lon)                   AS lon
+      FROM in_tiles
+      GROUP BY tile, cell
+    ),
+    per_dtc AS (
+      SELECT cell, dtc, COUNT(*) AS count
+      FROM in_tiles
+      GROUP BY cell, dtc
+    ),
+    top_dtcs AS (
+      SELECT cell, ARRAY_AGG(STRUCT(dtc, count) ORDER BY count DESC LIMIT {max(1, int(top_dtcs))}) AS top_dtcs
+      FROM per_dtc
+      GROUP BY cell
+    )
+    SELECT c.*, t.top_dtcs
+    FROM per_cell c
+    JOIN top_dtcs t USING (cell)
+    ORDER BY count DESC
+    """
+
+    rows = _query(sql, params)
+
+    by_tile: Dict[str, List[Dict]] = {}
+    for row in rows:
+        by_tile.setdefault(row["tile"], []).append(
+            {
+                "geohash": row["cell"],
+                "lat": float(row["lat"]),
+                "lon": float(row["lon"]),
+                "count": int(row.get("count") or 0),
+                "vehicles": int(row.get("vehicles") or 0),
+                "top_dtcs": [
+                    {"dtc": item.get("dtc"), "count": int(item.get("count") or 0)}
+                    for item in row.get("top_dtcs") or []
+                ],
+            }
+        )
+    return by_tile
+
+# --------------------------------------------------------------------------
+# Índice diário de DTCs (base de src/services/analytics.py), sobre history_base:
+# prevalência do dia (veículos e clientes distintos por DTC) e coocorrência em
+# janelas fixas de @window_seconds (mesmo veículo, mesma janela alinhada à época UTC).
+# Pares só com dtc < outro (a matriz é simétrica); dia fechado não muda mais.
+# --------------------------------------------------------------------------
+@_guarded("analytics", priority=BATCH)
+def get_dtc_day_index(day: date, window_minutes: int = 60) -> Dict:
+    where_clause, params, _, _ = _history_filters(None, None, None, day, day)
+    params = list(params) + [bigquery.ScalarQueryParameter("window_seconds", "INT64", window_minutes * 60)]
+
+    sql = f"""
+    {_history_base_cte(where_clause)}
+    , buckets AS (
+      SELECT DISTINCT
+        CAST(vehicle_id AS STRING)              AS vehicle_id,
+        DIV(UNIX_SECONDS(ts), @window_seconds)  AS bucket,
+        dtc
+      FROM history_base
+    ),
+    pairs AS (
+      SELECT
+        a.dtc                        AS dtc,
+        b.dtc                        AS other,
+        COUNT(*)                     AS windows,
+        COUNT(DISTINCT a.vehicle_id) AS vehicles
+      FROM buckets a
+      JOIN buckets b
+        ON b.vehicle_id = a.vehicle_id
+       AND b.bucket = a.bucket
+       AND b.dtc > a.dtc
+      GROUP BY dtc, other
+    ),
+    per_dtc AS (
+      SELECT
+        dtc,
+        ANY_VALUE(dtc_description)                                      AS dtc_description,
+        COUNT(*)                                                        AS events,
+        ARRAY_AGG(DISTINCT CAST(vehicle_id AS STRING) IGNORE NULLS)     AS vehicles,
+        ARRAY_AGG(DISTINCT customer_name IGNORE NULLS)                  AS customers
+      FROM history_base
+      GROUP BY dtc
+    ),
+    per_dtc_windows AS (
+      SELECT dtc, COUNT(*) AS windows
+      FROM buckets
+      GROUP BY dtc
+    ),
+    pair_lists AS (
+      SELECT dtc, ARRAY_AGG(STRUCT(other, windows, vehicles)) AS pairs
+      FROM pairs
+      GROUP BY dtc
+    ),
+    totals AS (
+      SELECT COUNT(*) AS total_windows
+      FROM (SELECT DISTINCT vehicle_id, bucket FROM buckets)
+    )
+    SELECT p.*, w.windows, pl.pairs, t.total_windows
+    FROM per_dtc p
+    JOIN per_dtc_windows w USING (dtc)
+    LEFT JOIN pair_lists pl USING (dtc)
+    CROSS JOIN totals t
+    """
+
+    rows = _query(sql, params)
+
+    dtcs: Dict[str, Dict] = {}
+    total_windows = 0
+    for row in rows:
+        total_windows = int(row.get("total_windows") or total_windows)
+        dtcs[row["dtc"]] = {
+            "description": row.get("dtc_description"),
+            "events": int(row.get("events") or 0),
+            "windows": int(row.get("windows") or 0),
+            "vehicles": list(row.get("vehicles") or []),
+            "customers": list(row.get("customers") or []),
+            "pairs": {
+                pair["other"]: [int(pair.get("windows") or 0), int(pair.get("vehicles") or 0)]
+                for pair in row.get("pairs") or []
+            },
+        }
+    return {
+        "day": day.isoformat(),
+        "window_minutes": window_minutes,
+        "total_windows": total_windows,
+        "dtcs": dtcs,
+    }
+
+# --------------------------------------------------------------------------
+# Rollups HLL: um sketch HLL_COUNT por (dia, DTC) e por (dia, cliente), com os
+# veículos (e clientes/DTCs) distintos. Contagens distintas de qualquer
+# intervalo saem de HLL_COUNT.MERGE sobre as linhas dos dias, sem reler eventos.
+# Os dias já calculados ficam em TBL_HLL_DAYS (gravados na mesma transação): um dia
+# sem linha ali nunca foi carregado, e a resposta diz quantos dias do intervalo faltam.
+# --------------------------------------------------------------------------
+HLL_GRANULARITIES = {
+    "day": "day",
+    "week": "DATE_TRUNC(day, ISOWEEK)",
+    "month": "DATE_TRUNC(day, MONTH)",
+    "total": "@start_day",
+}
+
+
+def _check_rollups() -> None:
+    if not HLL_ROLLUPS_ENABLED:
+        raise ValueError("Rollups HLL desligados: defina HLL_ROLLUPS_ENABLED=true e BQ_DATASET.")
+
+
+@_guarded("hll_rollup", fallback=False, priority=BATCH)
+def refresh_hll_rollups(start_date: date, end_date: date) -> None:
+    """Recalcula os sketches dos dias [start_date, end_date] (substitui as partições, numa transação)."""
+    _check_rollups()
+    where_clause, params, start_date, end_date = _history_filters(None, None, None, start_date, end_date)
+    params = list(params) + [
+        bigquery.ScalarQueryParameter("start_day", "DATE", start_date),
+        bigquery.ScalarQueryParameter("end_day", "DATE", end_date),
+    ]
+
+    sql = f"""
+    CREATE TABLE IF NOT EXISTS `{TBL_HLL_DTC}` (
+      day DATE,
+      dtc STRING,
+      dtc_description STRING,
+      events INT64,
+      vehicles_sketch BYTES,
+      customers_sketch BYTES
+    )
+    PARTITION BY day
+    CLUSTER BY dtc;
+
+    CREATE TABLE IF NOT EXISTS `{TBL_HLL_CUSTOMER}` (
+      day DATE,
+      customer_name STRING,
+      events INT64,
+      vehicles_sketch BYTES,
+      dtcs_sketch BYTES
+    )
+    PARTITION BY day
+    CLUSTER BY customer_name;
+
+    CREATE TABLE IF NOT EXISTS `{TBL_HLL_DAYS}` (
+      day DATE,
+      refreshed_at TIMESTAMP
+    );
+
+    CREATE TEMP TABLE day_events AS
+    {_history_base_cte(where_clause)}
+    SELECT DATE(ts) AS day, dtc, dtc_description, customer_name, CAST(vehicle_id AS STRING) AS vehicle_id
+    FROM history_base;
+
+    BEGIN TRANSACTION;
+
+    DELETE FROM `{TBL_HLL_DTC}` WHERE day BETWEEN @start_day AND @end_day;
+    INSERT INTO `{TBL_HLL_DTC}` (day, dtc, dtc_description, events, vehicles_sketch, customers_sketch)
+    SELECT
+      day,
+      dtc,
+      ANY_VALUE(dtc_description),
+      COUNT(*),
+      HLL_COUNT.INIT(vehicle_id),
+      HLL_COUNT.INIT(customer_name)
+    FROM day_events
+    GROUP BY day, dtc;
+
+    DELETE FROM `{TBL_HLL_CUSTOMER}` WHERE day BETWEEN @start_day AND @end_day;
+    INSERT INTO `{TBL_HLL_CUSTOMER}` (day, customer_name, events, vehicles_sketch, dtcs_sketch)
+    SELECT
+      day,
+      customer_name,
+      COUNT(*),
+      HLL_COUNT.INIT(vehicle_id),
+      HLL_COUNT.INIT(dtc)
+    FROM day_events
+    WHERE customer_name IS NOT NULL
+    GROUP BY day, customer_name;
+
+    DELETE FROM `{TBL_HLL_DAYS}` WHERE day BETWEEN @start_day AND @end_day;
+    INSERT INTO `{TBL_HLL_DAYS}` (day, refreshed_at)
+    SELECT day, CURRENT_TIMESTAMP()
+    FROM UNNEST(GENERATE_DATE_ARRAY(@start_day, @end_day)) AS day;
+
+    COMMIT TRANSACTION;
+    """
+
+    _query(sql, params, timeout=config.HLL_ROLLUP_TIMEOUT_SECONDS)
+
+
+def _hll_params(
+    start_date: Optional[date],
+    end_date: Optional[date],
+    default_days: int,
+    granularity: str,
+    limit: int,
+) -> Tuple[str, List[bigquery.ScalarQueryParameter], date, date]:
+    _check_rollups()
+    if granularity not in HLL_GRANULARITIES:
+        raise ValueError(f"Granularidade inválida: {granularity}. Use {', '.join(HLL_GRANULARITIES)}.")
+    resolved_start, resolved_end, _, _ = _resolve_history_dates(start_date, end_date, default_days)
+    params = [
+        bigquery.ScalarQueryParameter("start_day", "DATE", resolved_start),
+        bigquery.ScalarQueryParameter("end_day", "DATE", resolved_end),
+        bigquery.ScalarQueryParameter("limit", "INT64", max(1, limit)),
+    ]
+    return HLL_GRANULARITIES[granularity], params, resolved_start, resolved_end
+
+
+def _hll_coverage(start: date, end: date) -> Dict:
+    """Quantos dias de [start, end] já têm rollup; `complete` é falso se faltar algum."""
+    sql = f"""
+    SELECT COUNT(DISTINCT day) AS rolled_up_days, MIN(day) AS first_day, MAX(day) AS last_day
+    FROM `{TBL_HLL_DAYS}`
+    WHERE day BETWEEN @start_day AND @end_day
+    """
+    params = [
+        bigquery.ScalarQueryParameter("start_day", "DATE", start),
+        bigquery.ScalarQueryParameter("end_day", "DATE", end),
+    ]
+    try:
+        row = (_query(sql, params) or [{}])[0]
+    except gexc.NotFound:
+        row = {}  # nenhuma carga ainda
+    days = (end - start).days + 1
+    rolled_up = int(row.get("rolled_up_days") or 0)
+    first_day, last_day = row.get("first_day"), row.get("last_day")
+    return {
+        "days": days,
+        "rolled_up_days": rolled_up,
+        "complete": rolled_up >= days,
+        "first_day": first_day.isoformat() if isinstance(first_day, date) else None,
+        "last_day": last_day.isoformat() if isinstance(last_day, date) else None,
+    }
+
+
+def _hll_payload(rows: List[Dict], start: date, end: date, granularity: str) -> Dict:
+    items = []
+    for row in rows:
+        period = row.pop("period", None)
+        items.append({"period": period.isoformat() if isinstance(period, date) else None, **row})
+    return {
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "granularity": granularity,
+        "coverage": _hll_coverage(start, end),
+        "items": items,
+    }
+
+
+@_guarded("hll_dtc", priority=DASHBOARD)
+def get_dtc_distinct_counts(
+    dtc: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    default_days: int = 30,
+    granularity: str = "day",
+    limit: int = 50,
+) -> Dict:
+    """Por período e DTC: veículos e clientes distintos (HLL), dias com o DTC e eventos.
+
+    Dias ainda sem rollup não entram nas contagens: veja `coverage` na resposta.
+    """
+    period, params, resolved_start, resolved_end = _hll_params(start_date, end_date, default_days, granularity, limit)
+    dtc_key = (dtc or "").strip().upper()
+    dtc_filter = ""
+    if dtc_key:
+        dtc_filter = "AND dtc = @dtc"
+        params.append(bigquery.ScalarQueryParameter("dtc", "STRING", dtc_key))
+
+    sql = f"""
+    SELECT
+      {period}                           AS period,
+      dtc,
+      ANY_VALUE(dtc_description)         AS dtc_description,
+      HLL_COUNT.MERGE(vehicles_sketch)   AS vehicles,
+      HLL_COUNT.MERGE(customers_sketch)  AS customers,
+      COUNT(DISTINCT day)                AS days,
+      SUM(events)                        AS events
+    FROM `{TBL_HLL_DTC}`
+    WHERE day BETWEEN @start_day AND @end_day
+      {dtc_filter}
+    GROUP BY period, dtc
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY period ORDER BY HLL_COUNT.MERGE(vehicles_sketch) DESC, dtc) <= @limit
+    ORDER BY period, vehicles DESC, dtc
+    """
+
+    return _hll_payload(_query(sql, params), resolved_start, resolved_end, granularity)
+
+
+@_guarded("hll_customer", priority=DASHBOARD)
+def get_customer_distinct_counts(
+    customer: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    default_days: int = 30,
+    granularity: str = "day",
+    limit: int = 50,
+) -> Dict:
+    """Por período e cliente: veículos e DTCs distintos (HLL), dias com eventos e eventos.
+
+    Dias ainda sem rollup não entram nas contagens: veja `coverage` na resposta.
+    """
+    period, params, resolved_start, resolved_end = _hll_params(start_date, end_date, default_days, granularity, limit)
+    customer_key = (customer or "").strip().lower()
+    customer_filter = ""
+    if customer_key:
+        customer_filter = "AND LOWER(customer_name) LIKE @customer"
+        params.append(bigquery.ScalarQueryParameter("customer", "STRING", f"%{customer_key}%"))
+
+    sql = f"""
+    SELECT
+      {period}                           AS period,
+      customer_name,
+      HLL_COUNT.MERGE(vehicles_sketch)   AS vehicles,
+      HLL_COUNT.MERGE(dtcs_sketch)       AS dtcs,
+      COUNT(DISTINCT day)                AS days,
+      SUM(events)                        AS events
+    FROM `{TBL_HLL_CUSTOMER}`
+    WHERE day BETWEEN @start_day AND @end_day
+      {customer_filter}
+    GROUP BY period, customer_name
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY period ORDER BY HLL_COUNT.MERGE(vehicles_sketch) DESC, customer_name) <= @limit
+    ORDER BY period, vehicles DESC, customer_name
+    """
+
+    return _hll_payload(_query(sql, params), resolved_start, resolved_end, granularity)
+
+# --------------------------------------------------------------------------
+# Telemetria curta (últimos N minutos) para PLACA / IMEI / CHASSI(8)
+# Retorna série temporal simples já vinculada ao veículo + info de plano
+# --------------------------------------------------------------------------
+# Resoluções aceitas para a série agregada (rótulo -> segundos por balde)
+TELEMETRY_RESOLUTIONS = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+    "6h": 6 * 3600,
+    "1d": 24 * 3600,
+}
+TELEMETRY_TARGET_POINTS = 200
+# resolução explícita fina demais para a janela (ex.: 30 dias em 1m = 43.200 baldes)
+# sobe para a menor que caiba neste limite
+TELEMETRY_MAX_BUCKETS = 2000
+
+
+def pick_telemetry_resolution(minutes: int, target_points: int = TELEMETRY_TARGET_POINTS) -> str:
+    """Menor resolução que cabe em ~target_points baldes para a janela pedida."""
+    window_s = max(1, minutes) * 60
+    target = max(1, target_points)
+    by_size = sorted(TELEMETRY_RESOLUTIONS.items(), key=lambda item: item[1])
+    for label, seconds in by_size:
+        if window_s / seconds <= target:
+            return label
+    return by_size[-1][0]
+
+
+def _telemetry_cte() -> str:
+    return f"""
+    WITH dtc_raw AS (
+      SELECT
+        t.event_datetime_utc                       AS ts,
+        SAFE_CAST(t.spn AS INT64)                  AS spn,
+        SAFE_CAST(t.fmi AS INT64)                  AS fmi,
+        t.DTC                                       AS dtc,
+        t.status, t.lat, t.lon,
+        UPPER(CAST(t.imeis AS STRING))             AS imeis
+      FROM `{TBL_TELEMETRY}` t
+      WHERE t.event_datetime_utc >= @since
+    ),
+    dtc_norm AS (
+      SELECT r.ts, r.dtc, r.spn, r.fmi, r.status, r.lat, r.lon, TRIM(imei) AS imei_norm
+      FROM dtc_raw r,
+      UNNEST(SPLIT(REGEXP_REPLACE(r.imeis, r'[;,\\s]+', ','), ',')) AS imei
+    ),
+    dev AS (
+      SELECT d.device_id, UPPER(CAST(d.identification AS STRING)) AS imei
+      FROM `{TBL_DEVICES}` d
+    ),
+    inst AS (
+      SELECT i.device_id, i.vehicle_id, CAST(i.start_date AS TIMESTAMP) AS start_ts
+      FROM `{TBL_INSTALLS}` i
+    ),
+    veh AS (
+      SELECT
+        v.vehicle_id,
+        UPPER(v.plate)                             AS plate,
+        UPPER(CAST(v.chassi AS STRING))           AS chassi,
+        RIGHT(UPPER(CAST(v.chassi AS STRING)), 8) AS chassi_last8,
+        v.customer_name
+      FROM `{TBL_VEHICLES}` v
+    ),
+    dms AS (
+      SELECT
+        RIGHT(UPPER(CAST(chassis AS STRING)), 8) AS chassi_last8,
+        CAST(status_gobrax AS BOOL)             AS plan_active,
+        CAST(plan_type     AS STRING)           AS plan_type
+      FROM `{TBL_DMS}`
+    ),
+    t_dev AS (
+      SELECT n.*, d.device_id
+      FROM dtc_norm n
+      JOIN dev d ON UPPER(n.imei_norm) = d.imei
+    ),
+    t_dev_inst AS (
+      SELECT td.*, iv.vehicle_id
+      FROM t_dev td
+      JOIN inst iv
+        ON iv.device_id = td.device_id
+       AND td.ts >= iv.start_ts
+    ),
+    t_full AS (
+      SELECT
+        tdi.ts AS time,
+        tdi.spn, tdi.fmi, tdi.dtc, tdi.status, tdi.lat, tdi.lon,
+        v.plate, v.customer_name, v.chassi, v.chassi_last8,
+        dm.plan_active, dm.plan_type,
+        tdi.imei_norm
+      FROM t_dev_inst tdi
+      JOIN veh v ON v.vehicle_id = tdi.vehicle_id
+      LEFT JOIN dms dm USING (chassi_last8)
+      WHERE (@key = '')
+         OR (v.plate       = @key)
+         OR (UPPER(tdi.imei_norm) = @key)
+         OR (v.chassi_last8 = @key_last8)
+    )
+    """
+
+
+def _latest_event(rows: List[Dict], field: str) -> Optional[datetime]:
+    values = [row[field] for row in rows if isinstance(row.get(field), datetime)]
+    return max(values) if values else None
+
+
+@_guarded("telemetry")
+def get_telemetry(
+    vehicle_key: str,
+    minutes: int = 30,
+    resolution: Optional[str] = None,
+    target_points: int = TELEMETRY_TARGET_POINTS,
+    since_ts: Optional[datetime] = None,
+) -> Dict:
+    """Série de telemetria do veículo.
+
+    Sem `resolution` (ou "raw") devolve as linhas brutas (até 1000). Com "1m", "5m",
+    "1h"... agrega no warehouse por balde de tempo; "auto" escolhe a resolução para
+    caber em ~target_points pontos. Uma resolução explícita que passaria de
+    TELEMETRY_MAX_BUCKETS baldes sobe para a menor que caiba (veja `resolution` e
+    `requested_resolution` na resposta). `since_ts` funciona como em get_dtcs.
+    `latest_event` é o último ts bruto (não o início do balde), o mesmo de get_event_watermark.
+    """
+    since = _window_start(timedelta(minutes=minutes), since_ts)
+    key = (vehicle_key or "").strip().upper()
+    key_last8 = key[-8:] if key else ""
+
+    params = [
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+        bigquery.ScalarQueryParameter("key", "STRING", key),
+        bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
+    ]
+
+    res = (resolution or "raw").strip().lower()
+    if res == "raw":
+        sql = f"""
+        {_telemetry_cte()}
+        SELECT *
+        FROM t_full
+        ORDER BY time DESC
+        LIMIT 1000
+        """
+        rows = _query(sql, params)
+        return {"time_series": rows, "latest_event": _latest_event(rows, "time")}
+
+    if res == "auto":
+        res = pick_telemetry_resolution(minutes, target_points)
+    if res not in TELEMETRY_RESOLUTIONS:
+        valid = ", ".join(["raw", "auto", *TELEMETRY_RESOLUTIONS])
+        raise ValueError(f"Resolução inválida: {resolution}. Use uma de: {valid}")
+
+    requested = res
+    if max(1, minutes) * 60 / TELEMETRY_RESOLUTIONS[res] > TELEMETRY_MAX_BUCKETS:
+        res = pick_telemetry_resolution(minutes, TELEMETRY_MAX_BUCKETS)
+    bucket_seconds = TELEMETRY_RESOLUTIONS[res]
+    params.append(bigquery.ScalarQueryParameter("bucket_seconds", "INT64", bucket_seconds))
+
+    sql = f"""
+    {_telemetry_cte()}
+    , bucketed AS (
+      SELECT
+        TIMESTAMP_SECONDS(DIV(UNIX_SECONDS(time), @bucket_seconds) * @bucket_seconds) AS bucket,
+        time, dtc, status
+      FROM t_full
+    )
+    SELECT
+      bucket                                                  AS time,
+      COUNT(*)                                                AS events,
+      COUNT(DISTINCT dtc)                                     AS distinct_dtcs,
+      ARRAY_AGG(DISTINCT dtc IGNORE NULLS)                    AS dtcs,
+      ARRAY_AGG(status IGNORE NULLS ORDER BY time ASC LIMIT 1)[SAFE_OFFSET(0)]  AS first_status,
+      ARRAY_AGG(status IGNORE NULLS ORDER BY time DESC LIMIT 1)[SAFE_OFFSET(0)] AS last_status,
+      MAX(time)                                               AS last_time
+    FROM bucketed
+    GROUP BY bucket
+    ORDER BY bucket
+    """
+
+    rows = _query(sql, params)
+    return {
+        "resolution": res,
+        "requested_resolution": requested,
+        "bucket_seconds": bucket_seconds,
+        "time_series": rows,
+        "latest_event": _latest_event(rows, "last_time"),
+    }
+
+# --------------------------------------------------------------------------
+# Rótulos de persistência (regra única, avaliada no SQL)
+#   persistente: atividade em 24h OU ≥3 dias com eventos
+#   intermitente: houve na semana, mas não em 24h
+#   provavelmente resolvido: sem eventos na semana
+# As agregações abaixo entram no SELECT de cada resumo e _status_label_sql()
+# monta o CASE sobre elas; o pós-processo só acrescenta o intervalo e a ação.
+# --------------------------------------------------------------------------
+PERSISTENT_MIN_DAYS = 3
+
+_EV_24H = "COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 24 HOUR))"
+_EV_7D = "COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY))"
+_DAYS_WITH_EVENTS = "APPROX_COUNT_DISTINCT(DATE(ts))"
+
+RECOMMENDED_ACTIONS = {
+    "persistente": "Atuar imediatamente (falha ativa/persistente).",
+    "intermitente": "Monitorar; revisar condições que dispararam a falha.",
+    "provavelmente resolvido": "Sem recorrência recente; tratar como resolvida (confirmar com cliente).",
+}
+
+
+def _status_label_sql(ev_24h: str = _EV_24H, ev_7d: str = _EV_7D, days_with_events: str = _DAYS_WITH_EVENTS) -> str:
+    """CASE do rótulo; por padrão sobre as agregações do próprio GROUP BY, ou sobre colunas já agregadas."""
+    return (
+        f"CASE WHEN {ev_24h} > 0 OR {days_with_events} >= {PERSISTENT_MIN_DAYS} THEN 'persistente' "
+        f"WHEN {ev_7d} > 0 THEN 'intermitente' "
+        "ELSE 'provavelmente resolvido' END"
+    )
+
+
+def label_persistence(rows: List[Dict]) -> List[Dict]:
+    now = datetime.now(timezone.utc)
+    out: List[Dict] = []
+    for r in rows:
+        last_seen = r.get("last_seen_utc")
+        gap_h = None
+        if last_seen:
+            try:
+                if getattr(last_seen, "tzinfo", None) is None:
+                    last_seen = last_seen.replace(tzinfo=timezone.utc)
+                gap_h = (now - last_seen).total_seconds() / 3600.0
+            except Exception:
+                pass
+
+        status = r.get("status_label") or "provavelmente resolvido"
+        out.append({
+            **r,
+            "gap_hours_since_last": gap_h,
+            "status_label": status,
+            "recommended_action": RECOMMENDED_ACTIONS[status],
+        })
+    return out
 
 # --------------------------------------------------------------------------
-# Telemetria curta (últimos N minutos) para PLACA / IMEI / CHASSI(8)
-# Retorna série temporal simples já vinculada ao veículo + info de plano
+# Resumo por DTC/FMI + classificação (persistente/intermitente/resolvido)
+# Lookback padrão: 30 dias (sem o usuário escolher janela)
+# + enriquecimento de plano (DMS) por chassi(8)
 # --------------------------------------------------------------------------
-def get_telemetry(vehicle_key: str, minutes: int = 30) -> Dict:
-    since = datetime.now(timezone.utc) - timedelta(minutes=minutes)
+@_guarded("dtc_summary")
+def get_dtc_summary(vehicle_key: str, days: int = 30) -> List[Dict]:
     key = (vehicle_key or "").strip().upper()
     key_last8 = key[-8:] if key else ""
 
     sql = f"""
     WITH dtc_raw AS (
       SELECT
-        t.event_datetime_utc                       AS ts,
-        SAFE_CAST(t.spn AS INT64)                  AS spn,
-        SAFE_CAST(t.fmi AS INT64)                  AS fmi,
-        t.DTC                                       AS dtc,
-        t.status, t.lat, t.lon,
-        UPPER(CAST(t.imeis AS STRING))             AS imeis
+        t.event_datetime_utc AS ts,
+        UPPER(CAST(t.DTC AS STRING)) AS dtc,
+        SAFE_CAST(t.spn AS INT64)    AS spn,
+        SAFE_CAST(t.fmi AS INT64)    AS fmi,
+        t.status,
+        UPPER(CAST(t.imeis AS STRING)) AS imeis
       FROM `{TBL_TELEMETRY}` t
-      WHERE t.event_datetime_utc >= @since
+      WHERE t.event_datetime_utc >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
     ),
     dtc_norm AS (
-      SELECT r.ts, r.dtc, r.spn, r.fmi, r.status, r.lat, r.lon, TRIM(imei) AS imei_norm
+      SELECT
+        r.ts, r.dtc, r.spn, r.fmi, r.status,
+        TRIM(imei) AS imei_norm
       FROM dtc_raw r,
       UNNEST(SPLIT(REGEXP_REPLACE(r.imeis, r'[;,\s]+', ','), ',')) AS imei
     ),
     dev AS (
-      SELECT d.device_id, UPPER(CAST(d.identification AS STRING)) AS imei
+      SELECT
+        d.device_id,
+        UPPER(CAST(d.identification AS STRING)) AS imei
       FROM `{TBL_DEVICES}` d
     ),
     inst AS (
-      SELECT i.device_id, i.vehicle_id, CAST(i.start_date AS TIMESTAMP) AS start_ts
+      SELECT
+        i.device_id,
+        i.vehicle_id,
+        CAST(i.start_date AS TIMESTAMP) AS start_ts
       FROM `{TBL_INSTALLS}` i
     ),
     veh AS (
@@ -732,6 +2249,7 @@ def get_telemetry(vehicle_key: str, minutes: int = 30) -> Dict:
         UPPER(v.plate)                             AS plate,
         UPPER(CAST(v.chassi AS STRING))           AS chassi,
         RIGHT(UPPER(CAST(v.chassi AS STRING)), 8) AS chassi_last8,
+        v.customer_id,
         v.customer_name
       FROM `{TBL_VEHICLES}` v
     ),
@@ -743,7 +2261,7 @@ def get_telemetry(vehicle_key: str, minutes: int = 30) -> Dict:
       FROM `{TBL_DMS}`
     ),
     t_dev AS (
-      SELECT n.*, d.device_id
+      SELECT n.*, d.device_id, d.imei AS dev_imei
       FROM dtc_norm n
       JOIN dev d ON UPPER(n.imei_norm) = d.imei
     ),
@@ -756,42 +2274,87 @@ def get_telemetry(vehicle_key: str, minutes: int = 30) -> Dict:
     ),
     t_full AS (
       SELECT
-        tdi.ts AS time,
-        tdi.spn, tdi.fmi, tdi.dtc, tdi.status, tdi.lat, tdi.lon,
-        v.plate, v.customer_name, v.chassi, v.chassi_last8,
-        dm.plan_active, dm.plan_type,
-        tdi.imei_norm
+        tdi.ts, tdi.dtc, tdi.spn, tdi.fmi, tdi.status,
+        v.plate, v.customer_id, v.customer_name,
+        v.chassi, v.chassi_last8,
+        tdi.dev_imei AS imei,
+        dm.plan_active, dm.plan_type
       FROM t_dev_inst tdi
       JOIN veh v ON v.vehicle_id = tdi.vehicle_id
       LEFT JOIN dms dm USING (chassi_last8)
-      WHERE (@key = '')
-         OR (v.plate       = @key)
-         OR (UPPER(tdi.imei_norm) = @key)
-         OR (v.chassi_last8 = @key_last8)
+    ),
+    filt AS (
+      SELECT * FROM t_full
+      WHERE (@key = '' OR plate = @key OR imei = @key OR chassi_last8 = @key_last8)
+    ),
+    known AS (
+      SELECT
+        f.*,
+        dc.Description   AS dtc_description,
+        fc.SAE_J1939     AS fmi_sae,
+        fc.transcription AS fmi_pt
+      FROM filt f
+      JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = f.dtc
+      LEFT JOIN `{TBL_FMI_CODES}` fc ON fc.FMI = f.fmi
     )
-    SELECT *
-    FROM t_full
-    ORDER BY time DESC
-    LIMIT 1000
+    SELECT
+      customer_name,
+      plate,
+      chassi,
+      chassi_last8,
+      imei,
+      ANY_VALUE(plan_active)        AS plan_active,
+      ANY_VALUE(plan_type)          AS plan_type,
+      dtc,
+      fmi,
+      ANY_VALUE(spn)                AS spn,
+      ANY_VALUE(dtc_description)    AS dtc_description,
+      ANY_VALUE(fmi_pt)             AS fmi_pt,
+      COUNT(*)                      AS events_total,
+      MIN(ts)                       AS first_seen_utc,
+      MAX(ts)                       AS last_seen_utc,
+      COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 6 HOUR))  AS ev_6h,
+      {_EV_24H} AS ev_24h,
+      {_EV_7D}   AS ev_7d,
+      {_DAYS_WITH_EVENTS}                                     AS days_with_events,
+      {_status_label_sql()} AS status_label
+    FROM known
+    GROUP BY customer_name, plate, chassi, chassi_last8, imei, dtc, fmi
+    ORDER BY last_seen_utc DESC
+    LIMIT 500
     """
 
-    params = [
-        bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
-        bigquery.ScalarQueryParameter("key", "STRING", key),
-        bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
-    ]
-    job = _client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-    rows = [dict(r) for r in job.result()]
-    return {"time_series": rows}
+    rows = _query(
+        sql,
+        [
+            bigquery.ScalarQueryParameter("days", "INT64", days),
+            bigquery.ScalarQueryParameter("key", "STRING", key),
+            bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
+        ],
+    )
 
-# --------------------------------------------------------------------------
-# Resumo por DTC/FMI + classificação (persistente/intermitente/resolvido)
-# Lookback padrão: 30 dias (sem o usuário escolher janela)
-# + enriquecimento de plano (DMS) por chassi(8)
-# --------------------------------------------------------------------------
-def get_dtc_summary(vehicle_key: str, days: int = 30) -> List[Dict]:
-    key = (vehicle_key or "").strip().upper()
-    key_last8 = key[-8:] if key else ""
+    return label_persistence(rows)
+
+@_guarded("dtc_summary_batch", priority=BATCH)
+def get_dtc_summary_batch(vehicle_keys: List[str], days: int = 30) -> Dict:
+    """get_dtc_summary para vários veículos numa única consulta (mesmas colunas e rótulos).
+
+    Retorna {"items": {chave: {"vehicle": {...}, "summary": [...]}}, "errors": {chave: msg}},
+    no mesmo formato de get_dtcs_batch.
+    """
+    keys = _normalize_keys(vehicle_keys)
+    if not keys:
+        return {"items": {}, "errors": {}}
+
+    resolved = resolve_vehicles(keys)
+    errors = {k: "Veículo não encontrado." for k in keys if k not in resolved}
+    if not resolved:
+        return {"items": {}, "errors": errors}
+
+    found_keys = [k for k in keys if k in resolved]
+    plates = sorted({v["plate"] for v in resolved.values() if v.get("plate")})
+    imeis = sorted({v["imei"] for v in resolved.values() if v.get("imei")})
+    last8s = sorted({v["chassi_last8"] for v in resolved.values() if v.get("chassi_last8")})
 
     sql = f"""
     WITH dtc_raw AS (
@@ -813,16 +2376,11 @@ def get_dtc_summary(vehicle_key: str, days: int = 30) -> List[Dict]:
       UNNEST(SPLIT(REGEXP_REPLACE(r.imeis, r'[;,\s]+', ','), ',')) AS imei
     ),
     dev AS (
-      SELECT
-        d.device_id,
-        UPPER(CAST(d.identification AS STRING)) AS imei
+      SELECT d.device_id, UPPER(CAST(d.identification AS STRING)) AS imei
       FROM `{TBL_DEVICES}` d
     ),
     inst AS (
-      SELECT
-        i.device_id,
-        i.vehicle_id,
-        CAST(i.start_date AS TIMESTAMP) AS start_ts
+      SELECT i.device_id, i.vehicle_id, CAST(i.start_date AS TIMESTAMP) AS start_ts
       FROM `{TBL_INSTALLS}` i
     ),
     veh AS (
@@ -854,20 +2412,20 @@ def get_dtc_summary(vehicle_key: str, days: int = 30) -> List[Dict]:
         ON iv.device_id = td.device_id
        AND td.ts >= iv.start_ts
     ),
+    -- mesmo filtro de get_dtcs_batch
     t_full AS (
       SELECT
         tdi.ts, tdi.dtc, tdi.spn, tdi.fmi, tdi.status,
-        v.plate, v.customer_id, v.customer_name,
+        v.vehicle_id, v.plate, v.customer_id, v.customer_name,
         v.chassi, v.chassi_last8,
         tdi.dev_imei AS imei,
         dm.plan_active, dm.plan_type
       FROM t_dev_inst tdi
       JOIN veh v ON v.vehicle_id = tdi.vehicle_id
       LEFT JOIN dms dm USING (chassi_last8)
-    ),
-    filt AS (
-      SELECT * FROM t_full
-      WHERE (@key = '' OR plate = @key OR imei = @key OR chassi_last8 = @key_last8)
+      WHERE v.plate IN UNNEST(@plates)
+         OR tdi.dev_imei IN UNNEST(@imeis)
+         OR v.chassi_last8 IN UNNEST(@last8s)
     ),
     known AS (
       SELECT
@@ -875,94 +2433,139 @@ def get_dtc_summary(vehicle_key: str, days: int = 30) -> List[Dict]:
         dc.Description   AS dtc_description,
         fc.SAE_J1939     AS fmi_sae,
         fc.transcription AS fmi_pt
-      FROM filt f
+      FROM t_full f
       JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = f.dtc
       LEFT JOIN `{TBL_FMI_CODES}` fc ON fc.FMI = f.fmi
     )
     SELECT
+      vehicle_id,
       customer_name,
       plate,
       chassi,
       chassi_last8,
-      imei,
       ANY_VALUE(plan_active)        AS plan_active,
       ANY_VALUE(plan_type)          AS plan_type,
       dtc,
       fmi,
+      ANY_VALUE(spn)                AS spn,
       ANY_VALUE(dtc_description)    AS dtc_description,
       ANY_VALUE(fmi_pt)             AS fmi_pt,
       COUNT(*)                      AS events_total,
       MIN(ts)                       AS first_seen_utc,
       MAX(ts)                       AS last_seen_utc,
       COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 6 HOUR))  AS ev_6h,
-      COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 24 HOUR)) AS ev_24h,
-      COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY))   AS ev_7d,
-      APPROX_COUNT_DISTINCT(DATE(ts))                                     AS days_with_events
+      {_EV_24H} AS ev_24h,
+      {_EV_7D}   AS ev_7d,
+      {_DAYS_WITH_EVENTS}                                     AS days_with_events,
+      {_status_label_sql()} AS status_label
     FROM known
-    GROUP BY customer_name, plate, chassi, chassi_last8, imei, dtc, fmi
-    ORDER BY last_seen_utc DESC
-    LIMIT 500
+    GROUP BY vehicle_id, customer_name, plate, chassi, chassi_last8, dtc, fmi
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY vehicle_id ORDER BY MAX(ts) DESC) <= 500
+    ORDER BY vehicle_id, last_seen_utc DESC
     """
 
-    job = _client.query(
-        sql,
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("days", "INT64", days),
-                bigquery.ScalarQueryParameter("key", "STRING", key),
-                bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
-            ]
-        ),
-    )
-    rows = [dict(r) for r in job.result()]
+    params = [
+        bigquery.ScalarQueryParameter("days", "INT64", days),
+        bigquery.ArrayQueryParameter("plates", "STRING", plates),
+        bigquery.ArrayQueryParameter("imeis", "STRING", imeis),
+        bigquery.ArrayQueryParameter("last8s", "STRING", last8s),
+    ]
+    rows = label_persistence(_query(sql, params))
 
-    # Pós-processo: rótulos de persistência
-    now = datetime.now(timezone.utc)
-    out: List[Dict] = []
-    for r in rows:
-        last_seen = r.get("last_seen_utc")
-        gap_h = None
-        if last_seen:
-            try:
-                if getattr(last_seen, "tzinfo", None) is None:
-                    last_seen = last_seen.replace(tzinfo=timezone.utc)
-                gap_h = (now - last_seen).total_seconds() / 3600.0
-            except Exception:
-                pass
+    by_vehicle: Dict[object, List[Dict]] = {}
+    for row in rows:
+        by_vehicle.setdefault(row.get("vehicle_id"), []).append(row)
 
-        ev24 = int(r.get("ev_24h", 0) or 0)
-        ev7  = int(r.get("ev_7d", 0) or 0)
-        d_we = int(r.get("days_with_events", 0) or 0)
+    items: Dict[str, Dict] = {}
+    for key in found_keys:
+        vehicle = resolved[key]
+        items[key] = {
+            "vehicle": vehicle,
+            "summary": by_vehicle.get(vehicle.get("vehicle_id"), []),
+        }
+    return {"items": items, "errors": errors}
 
-        if ev24 > 0 or d_we >= 3:
-            status = "persistente"
-        elif ev7 > 0 and ev24 == 0:
-            status = "intermitente"
-        else:
-            status = "provavelmente resolvido"
+# --------------------------------------------------------------------------
+# Snapshot de status de falhas (src/services/fault_snapshot.py): as contagens
+# por hora de cada (veículo, IMEI, DTC, FMI) a partir de @since. Só as horas
+# pedidas são varridas; o snapshot junta com as que já tem guardadas. O rótulo
+# é calculado na leitura, com o mesmo _status_label_sql.
+# --------------------------------------------------------------------------
+@_guarded("fault_snapshot", fallback=False, priority=BATCH)
+def get_fault_status_rows(since: datetime) -> List[Dict]:
+    params = [bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)]
 
-        out.append({
-            **r,
-            "gap_hours_since_last": gap_h,
-            "status_label": status,
-            "recommended_action": (
-                "Atuar imediatamente (falha ativa/persistente)."
-                if status == "persistente" else
-                "Monitorar; revisar condições que dispararam a falha."
-                if status == "intermitente" else
-                "Sem recorrência recente; tratar como resolvida (confirmar com cliente)."
-            ),
-        })
-    return out
+    sql = f"""
+    {_overview_cte()},
+    dms AS (
+      SELECT
+        RIGHT(UPPER(CAST(chassis AS STRING)), 8) AS chassi_last8,
+        ANY_VALUE(CAST(status_gobrax AS BOOL))   AS plan_active,
+        ANY_VALUE(CAST(plan_type AS STRING))     AS plan_type
+      FROM `{TBL_DMS}`
+      GROUP BY chassi_last8
+    ),
+    hourly AS (
+      SELECT
+        tf.vehicle_id,
+        UPPER(tf.imei_norm)                 AS imei,
+        tf.dtc,
+        tf.fmi,
+        TIMESTAMP_TRUNC(tf.ts, HOUR)        AS hour,
+        COUNT(*)                            AS n,
+        MIN(tf.ts)                          AS first_ts,
+        MAX(tf.ts)                          AS last_ts,
+        ANY_VALUE(tf.spn)                   AS spn,
+        ANY_VALUE(tf.plate)                 AS plate,
+        ANY_VALUE(tf.chassi)                AS chassi,
+        ANY_VALUE(tf.chassi_last8)          AS chassi_last8,
+        ANY_VALUE(tf.customer_name)         AS customer_name,
+        ANY_VALUE(dc.Description)           AS dtc_description,
+        ANY_VALUE(fc.transcription)         AS fmi_pt
+      FROM t_full tf
+      JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = tf.dtc
+      LEFT JOIN `{TBL_FMI_CODES}` fc ON fc.FMI = tf.fmi
+      GROUP BY vehicle_id, imei, dtc, fmi, hour
+    )
+    SELECT
+      CAST(h.vehicle_id AS STRING)                          AS vehicle_id,
+      h.imei,
+      h.dtc,
+      h.fmi,
+      ANY_VALUE(h.spn)                                      AS spn,
+      ANY_VALUE(h.plate)                                    AS plate,
+      ANY_VALUE(h.chassi)                                   AS chassi,
+      ANY_VALUE(h.chassi_last8)                             AS chassi_last8,
+      ANY_VALUE(h.customer_name)                            AS customer_name,
+      ANY_VALUE(h.dtc_description)                          AS dtc_description,
+      ANY_VALUE(h.fmi_pt)                                   AS fmi_pt,
+      ANY_VALUE(dm.plan_active)                             AS plan_active,
+      ANY_VALUE(dm.plan_type)                               AS plan_type,
+      MIN(h.first_ts)                                       AS first_seen_utc,
+      MAX(h.last_ts)                                        AS last_seen_utc,
+      ARRAY_AGG(STRUCT(UNIX_SECONDS(h.hour) AS hour, h.n) ORDER BY h.hour) AS hours
+    FROM hourly h
+    LEFT JOIN dms dm ON dm.chassi_last8 = h.chassi_last8
+    GROUP BY h.vehicle_id, h.imei, h.dtc, h.fmi
+    """
+
+    return _query(sql, params, timeout=config.FAULT_SNAPSHOT_TIMEOUT_SECONDS)
 
 # --------------------------------------------------------------------------
 # Resumo por CLIENTE (fuzzy tokens com LIKE AND) + classificação
 # --------------------------------------------------------------------------
-def get_customer_summary(customer_name: str, days: int = 30) -> List[Dict]:
+def _customer_tokens(customer_name: Optional[str]) -> List[str]:
+    """Tokens (≥3 chars) do nome do cliente para casar com LIKE, em qualquer ordem."""
     name_norm = (customer_name or "").strip().upper()
     tokens = [t for t in re.split(r"[^A-Z0-9]+", name_norm) if len(t) >= 3]
     if not tokens:
         tokens = [name_norm] if name_norm else []
+    return tokens
+
+
+@_guarded("customer_summary")
+def get_customer_summary(customer_name: str, days: int = 30) -> List[Dict]:
+    tokens = _customer_tokens(customer_name)
 
     like_clauses = [f"UPPER(v.customer_name) LIKE @tok{i}" for i in range(len(tokens))]
     where_tokens = " AND ".join(like_clauses) if like_clauses else "TRUE"
@@ -1052,15 +2655,17 @@ def get_customer_summary(customer_name: str, days: int = 30) -> List[Dict]:
       ANY_VALUE(plan_type)   AS plan_type,
       dtc,
       fmi,
+      ANY_VALUE(spn)             AS spn,
       ANY_VALUE(dtc_description) AS dtc_description,
       ANY_VALUE(fmi_pt)          AS fmi_pt,
       COUNT(*)                   AS events_total,
       MIN(ts)                    AS first_seen_utc,
       MAX(ts)                    AS last_seen_utc,
       COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 6 HOUR))  AS ev_6h,
-      COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 24 HOUR)) AS ev_24h,
-      COUNTIF(ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY))   AS ev_7d,
-      APPROX_COUNT_DISTINCT(DATE(ts))                                     AS days_with_events
+      {_EV_24H} AS ev_24h,
+      {_EV_7D}   AS ev_7d,
+      {_DAYS_WITH_EVENTS}                                     AS days_with_events,
+      {_status_label_sql()} AS status_label
     FROM known
     GROUP BY customer_name, plate, imei, dtc, fmi
     ORDER BY last_seen_utc DESC
@@ -1071,44 +2676,172 @@ def get_customer_summary(customer_name: str, days: int = 30) -> List[Dict]:
     for i, tok in enumerate(tokens):
         params.append(bigquery.ScalarQueryParameter(f"tok{i}", "STRING", f"%{tok}%"))
 
-    job = _client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-    rows = [dict(r) for r in job.result()]
+    rows = _query(sql, params)
 
-    # Rótulos de persistência
-    now = datetime.now(timezone.utc)
-    out: List[Dict] = []
-    for r in rows:
-        last_seen = r.get("last_seen_utc")
-        gap_h = None
-        if last_seen:
-            try:
-                if getattr(last_seen, "tzinfo", None) is None:
-                    last_seen = last_seen.replace(tzinfo=timezone.utc)
-                gap_h = (now - last_seen).total_seconds() / 3600.0
-            except Exception:
-                pass
+    return label_persistence(rows)
+
+# --------------------------------------------------------------------------
+# Ranking de risco da frota (triagem) numa passada só pela janela:
+# falhas por veículo+DTC/FMI -> rótulo de persistência (mesmo CASE dos resumos)
+# -> peso de severidade da kb (parâmetro; falha fora da kb pesa 1) -> veículo.
+# risk_score = soma de peso x fator do rótulo; só o top-K é paginado.
+# --------------------------------------------------------------------------
+FLEET_TRIAGE_MAX_TOP = 1000
 
-        ev24 = int(r.get("ev_24h", 0) or 0)
-        ev7  = int(r.get("ev_7d", 0) or 0)
-        d_we = int(r.get("days_with_events", 0) or 0)
+_STATUS_FACTOR_SQL = "CASE status_label WHEN 'persistente' THEN 3 WHEN 'intermitente' THEN 1 ELSE 0 END"
 
-        if ev24 > 0 or d_we >= 3:
-            status = "persistente"
-        elif ev7 > 0 and ev24 == 0:
-            status = "intermitente"
-        else:
-            status = "provavelmente resolvido"
 
-        out.append({
-            **r,
-            "gap_hours_since_last": gap_h,
-            "status_label": status,
-            "recommended_action": (
-                "Atuar imediatamente (falha ativa/persistente)."
-                if status == "persistente" else
-                "Monitorar; revisar condições que dispararam a falha."
-                if status == "intermitente" else
-                "Sem recorrência recente; tratar como resolvida (confirmar com cliente)."
-            ),
-        })
-    return out
+@_guarded("fleet_triage", priority=DASHBOARD)
+def get_fleet_triage(
+    customer: Optional[str] = None,
+    days: int = 30,
+    top: int = 100,
+    page: int = 1,
+    page_size: int = 50,
+) -> Dict:
+    """Veículos mais arriscados da frota (top-K), com contagem por rótulo e as falhas principais."""
+    top = max(1, min(int(top), FLEET_TRIAGE_MAX_TOP))
+    page = max(1, int(page))
+    page_size = max(1, min(int(page_size), 200))
+    offset = (page - 1) * page_size
+    limit = max(0, min(page_size, top - offset))
+
+    items: List[Dict] = []
+    total = 0
+    if limit:
+        kb_table = kb.severity_table()
+        filters, params = _overview_filters(customer=customer)
+        params += [
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", datetime.now(timezone.utc) - timedelta(days=days)),
+            bigquery.ArrayQueryParameter("kb_spn", "INT64", [k["spn"] for k in kb_table]),
+            bigquery.ArrayQueryParameter("kb_fmi", "INT64", [k["fmi"] for k in kb_table]),
+            bigquery.ArrayQueryParameter("kb_weight", "INT64", [k["weight"] for k in kb_table]),
+            bigquery.ArrayQueryParameter("kb_severity", "STRING", [k["severity"] for k in kb_table]),
+            bigquery.ScalarQueryParameter("limit", "INT64", limit),
+            bigquery.ScalarQueryParameter("offset", "INT64", offset),
+        ]
+        where_clause = " AND ".join(["TRUE"] + filters)
+
+        sql = f"""
+        {_overview_cte()},
+        scoped AS (
+          SELECT tf.*, dc.Description AS dtc_description
+          FROM t_full tf
+          JOIN `{TBL_DTC_CODES}` dc ON UPPER(dc.DTC) = tf.dtc
+          WHERE {where_clause}
+        ),
+        faults AS (
+          SELECT
+            vehicle_id,
+            dtc,
+            fmi,
+            ANY_VALUE(customer_name)   AS customer_name,
+            ANY_VALUE(plate)           AS plate,
+            ANY_VALUE(chassi_last8)    AS chassi_last8,
+            ANY_VALUE(spn)             AS spn,
+            ANY_VALUE(dtc_description) AS dtc_description,
+            COUNT(*)                   AS events_total,
+            MAX(ts)                    AS last_seen_utc,
+            {_status_label_sql()} AS status_label
+          FROM scoped
+          GROUP BY vehicle_id, dtc, fmi
+        ),
+        kb AS (
+          SELECT
+            spn,
+            @kb_fmi[OFFSET(i)]      AS fmi,
+            @kb_weight[OFFSET(i)]   AS weight,
+            @kb_severity[OFFSET(i)] AS severity
+          FROM UNNEST(@kb_spn) AS spn WITH OFFSET i
+        ),
+        weighted AS (
+          SELECT
+            f.*,
+            COALESCE(kb.weight, 1)         AS weight,
+            COALESCE(kb.severity, 'Baixa') AS severity,
+            {_STATUS_FACTOR_SQL}           AS factor
+          FROM faults f
+          LEFT JOIN kb ON kb.spn = f.spn AND kb.fmi = f.fmi
+        ),
+        vehicles AS (
+          SELECT
+            vehicle_id,
+            ANY_VALUE(customer_name) AS customer_name,
+            ANY_VALUE(plate)         AS plate,
+            ANY_VALUE(chassi_last8)  AS chassi_last8,
+            COUNTIF(status_label = 'persistente')             AS persistent,
+            COUNTIF(status_label = 'intermitente')            AS intermittent,
+            COUNTIF(status_label = 'provavelmente resolvido') AS resolved,
+            MAX(IF(factor > 0, weight, 0))                    AS max_weight,
+            ARRAY_AGG(IF(factor > 0, severity, NULL) IGNORE NULLS ORDER BY weight DESC LIMIT 1)[SAFE_OFFSET(0)]
+                                                              AS max_severity,
+            SUM(factor * weight)                              AS risk_score,
+            SUM(events_total)                                 AS events_total,
+            MAX(last_seen_utc)                                AS last_seen_utc,
+            ARRAY_AGG(
+              STRUCT(dtc, fmi, spn, dtc_description, status_label, severity, events_total, last_seen_utc)
+              ORDER BY factor DESC, weight DESC, last_seen_utc DESC
+              LIMIT 5
+            ) AS top_faults
+          FROM weighted
+          GROUP BY vehicle_id
+        )
+        SELECT *, COUNT(*) OVER () AS total_vehicles
+        FROM vehicles
+        ORDER BY risk_score DESC, max_weight DESC, last_seen_utc DESC, vehicle_id
+        LIMIT @limit OFFSET @offset
+        """
+
+        rows = _query(sql, params)
+        total = int(rows[0]["total_vehicles"]) if rows else 0
+        for row in rows:
+            row.pop("total_vehicles", None)
+            items.append(row)
+
+    ranked = min(total, top)
+    return {
+        "items": items,
+        "pagination": {
+            "page": page,
+            "page_size": page_size,
+            "total_items": ranked,
+            "total_pages": max(1, math.ceil(ranked / page_size)),
+        },
+        "total_vehicles": total,
+    }
+
+# --------------------------------------------------------------------------
+# Frescor: último evento (e contagem) de um veículo/cliente na janela.
+# Barato; serve de token de invalidação para caches de respostas derivadas.
+# --------------------------------------------------------------------------
+@_guarded("latest_event", fallback=False)
+def get_latest_event(
+    vehicle_key: Optional[str] = None,
+    customer_name: Optional[str] = None,
+    days: int = 30,
+) -> Dict:
+    key = (vehicle_key or "").strip().upper()
+    key_last8 = key[-8:] if key else ""
+    tokens = _customer_tokens(customer_name)
+
+    like_clauses = [f"UPPER(customer_name) LIKE @tok{i}" for i in range(len(tokens))]
+    where_tokens = " AND ".join(like_clauses) if like_clauses else "TRUE"
+
+    sql = f"""
+    {_telemetry_cte()}
+    SELECT MAX(time) AS latest_ts, COUNT(*) AS events
+    FROM t_full
+    WHERE {where_tokens}
+    """
+
+    params = [
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", _window_start(timedelta(days=days))),
+        bigquery.ScalarQueryParameter("key", "STRING", key),
+        bigquery.ScalarQueryParameter("key_last8", "STRING", key_last8),
+    ]
+    for i, tok in enumerate(tokens):
+        params.append(bigquery.ScalarQueryParameter(f"tok{i}", "STRING", f"%{tok}%"))
+
+    rows = _query(sql, params)
+    row = rows[0] if rows else {}
+    return {"latest_ts": row.get("latest_ts"), "events": int(row.get("events") or 0)}
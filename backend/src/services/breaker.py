@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, Optional
+
+from . import config
+
+# --------------------------------------------------------------------------
+# Circuit breaker por endpoint do bq_client.
+# Fechado: as chamadas passam e os resultados entram numa janela móvel. Erro ou
+# chamada lenta (> BQ_BREAKER_SLOW_SECONDS) contam como falha. Com pelo menos
+# BQ_BREAKER_MIN_CALLS na janela e taxa de falha >= BQ_BREAKER_FAILURE_RATE, abre.
+# Aberto: falha na hora (CircuitOpen) durante BQ_BREAKER_OPEN_SECONDS, sem ocupar
+# thread esperando o BigQuery. Depois vira meio-aberto.
+# Meio-aberto: deixa passar até BQ_BREAKER_HALF_OPEN_PROBES chamadas de teste. Se
+# todas derem certo, fecha; se qualquer uma falhar, abre de novo.
+# --------------------------------------------------------------------------
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Circuito '{name}' aberto")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: int = config.BQ_BREAKER_WINDOW,
+        min_calls: int = config.BQ_BREAKER_MIN_CALLS,
+        failure_rate: float = config.BQ_BREAKER_FAILURE_RATE,
+        slow_seconds: float = config.BQ_BREAKER_SLOW_SECONDS,
+        open_seconds: float = config.BQ_BREAKER_OPEN_SECONDS,
+        half_open_probes: int = config.BQ_BREAKER_HALF_OPEN_PROBES,
+    ):
+        self.name = name
+        self.min_calls = max(1, int(min_calls))
+        self.failure_rate = float(failure_rate)
+        self.slow_seconds = float(slow_seconds)
+        self.open_seconds = float(open_seconds)
+        self.half_open_probes = max(1, int(half_open_probes))
+        self._outcomes: Deque[bool] = deque(maxlen=max(self.min_calls, int(window)))
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0  # chamadas de teste em andamento (meio-aberto)
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "failures": 0, "slow": 0, "rejected": 0, "opened": 0}
+
+    def _retry_after(self) -> int:
+        return max(1, int(self._opened_at + self.open_seconds - time.monotonic()) + 1)
+
+    def allow(self) -> None:
+        """Reserva a passagem de uma chamada ou levanta CircuitOpen."""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self._counters["rejected"] += 1
+                    raise CircuitOpen(self.name, self._retry_after())
+                self._state = HALF_OPEN
+                self._probes = 0
+                self._probe_successes = 0
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self._counters["rejected"] += 1
+                    raise CircuitOpen(self.name, max(1, int(self.open_seconds)))
+                self._probes += 1
+            self._counters["calls"] += 1
+
+    def release(self) -> None:
+        """Devolve a passagem sem registrar resultado (a chamada não chegou ao BigQuery)."""
+        with self._lock:
+            self._counters["calls"] -= 1
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def record(self, ok: bool, elapsed: float) -> None:
+        slow = elapsed > self.slow_seconds
+        failed = not ok or slow
+        with self._lock:
+            self._counters["failures"] += 0 if ok else 1
+            self._counters["slow"] += 1 if slow else 0
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed:
+                    self._trip()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._state = CLOSED
+                        self._outcomes.clear()
+                return
+            if self._state == OPEN:
+                return  # chamada admitida antes de abrir; não muda nada
+            self._outcomes.append(not failed)
+            if len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._trip()
+
+    def _trip(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._counters["opened"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self._state
+            if state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                state = HALF_OPEN
+            window = len(self._outcomes)
+            return {
+                "state": state,
+                "failure_rate": round(self._outcomes.count(False) / window, 2) if window else 0.0,
+                "window": window,
+                "retry_after": self._retry_after() if state == OPEN else 0,
+                **self._counters,
+            }
+
+
+# --------------------------------------------------------------------------
+# Marcação de resposta degradada: quem serve um resultado antigo no lugar de
+# uma consulta que falhou chama report_stale(idade). A API abre um
+# `degradation()` por pedido e devolve a idade em headers.
+# O dict é compartilhado com as threads do pedido (o contexto é copiado por referência).
+# --------------------------------------------------------------------------
+_degradation: ContextVar[Optional[Dict[str, Any]]] = ContextVar("degradation", default=None)
+
+
+@contextmanager
+def degradation() -> Iterator[Dict[str, Any]]:
+    state: Dict[str, Any] = {"stale": False, "age": 0.0}
+    token = _degradation.set(state)
+    try:
+        yield state
+    finally:
+        _degradation.reset(token)
+
+
+def report_stale(age: float) -> None:
+    state = _degradation.get()
+    if state is not None:
+        state["stale"] = True
+        state["age"] = max(state["age"], age)
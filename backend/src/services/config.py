@@ -9,4 +9,102 @@ GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
 BQ_DATASET = os.getenv("BQ_DATASET")
 BQ_TABLE_DTC = os.getenv("BQ_TABLE_DTC", "dtc_events")
 BQ_TABLE_TELEMETRY = os.getenv("BQ_TABLE_TELEMETRY", "telemetry_points")
-API_PORT = int(os.getenv("API_PORT", 8000))
\ No newline at end of file
+API_PORT = int(os.getenv("API_PORT", 8000))
+
+# Cache local em disco (resultados imutáveis, ex.: histórico de dias fechados)
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(__file__), "..", "..", ".cache"))
+# Limite dos arquivos JSON desse cache (histórico, tiles do mapa, índices de analytics);
+# passando dele, saem os lidos há mais tempo. 0 = sem limite
+DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", 2 * 1024**3))
+# Dias de tolerância para dados atrasados antes de considerar um intervalo "fechado"
+# (e imutável no cache). Com 0, ontem fecharia à meia-noite UTC, antes de os eventos
+# atrasados chegarem; por isso o padrão é 1
+HISTORY_SETTLE_DAYS = max(0, int(os.getenv("HISTORY_SETTLE_DAYS", 1)))
+
+# Eventos do mesmo (veículo, DTC, FMI) separados por até N minutos formam um episódio
+DTC_EPISODE_GAP_MINUTES = int(os.getenv("DTC_EPISODE_GAP_MINUTES", 10))
+
+# Feed ao vivo (/stream/dtc): intervalo entre leituras de cada conjunto de filtros
+LIVE_POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", 15))
+# cada leitura relê os últimos N segundos antes da marca d'água (eventos que chegam atrasados);
+# o que já foi entregue é descartado pelo id do evento
+LIVE_OVERLAP_SECONDS = float(os.getenv("LIVE_OVERLAP_SECONDS", 120))
+
+# Stale-while-revalidate das consultas dos dashboards (src/services/warm_cache.py)
+SWR_FRESH_SECONDS = float(os.getenv("SWR_FRESH_SECONDS", 120))
+SWR_MAX_STALE_SECONDS = float(os.getenv("SWR_MAX_STALE_SECONDS", 1800))
+# Aquecimento em segundo plano: as N combinações de filtros mais pedidas, a cada intervalo
+WARM_TOP_N = int(os.getenv("WARM_TOP_N", 10))
+WARM_INTERVAL_SECONDS = float(os.getenv("WARM_INTERVAL_SECONDS", 60))
+# sem nenhum pedido aos dashboards há mais que isso, o aquecedor não consulta nada
+WARM_IDLE_SECONDS = float(os.getenv("WARM_IDLE_SECONDS", 900))
+# fuso dos navegadores: as datas padrão das telas (ex.: últimos 7 dias do Histórico) são locais
+FRONTEND_TIMEZONE = os.getenv("FRONTEND_TIMEZONE", "America/Sao_Paulo")
+
+# BigQuery: tempo máximo de espera por consulta e circuit breaker por endpoint (src/services/breaker.py)
+BQ_QUERY_TIMEOUT_SECONDS = float(os.getenv("BQ_QUERY_TIMEOUT_SECONDS", 60))
+BQ_BREAKER_WINDOW = int(os.getenv("BQ_BREAKER_WINDOW", 20))
+BQ_BREAKER_MIN_CALLS = int(os.getenv("BQ_BREAKER_MIN_CALLS", 5))
+BQ_BREAKER_FAILURE_RATE = float(os.getenv("BQ_BREAKER_FAILURE_RATE", 0.5))
+BQ_BREAKER_SLOW_SECONDS = float(os.getenv("BQ_BREAKER_SLOW_SECONDS", 20))
+BQ_BREAKER_OPEN_SECONDS = float(os.getenv("BQ_BREAKER_OPEN_SECONDS", 30))
+BQ_BREAKER_HALF_OPEN_PROBES = int(os.getenv("BQ_BREAKER_HALF_OPEN_PROBES", 1))
+# Último resultado bom de cada consulta, servido (marcado como antigo) quando o BigQuery falha
+# (fica no cache compartilhado entre workers; o espaço é limitado por SHARED_CACHE_MAX_BYTES)
+BQ_LAST_GOOD_TTL_SECONDS = float(os.getenv("BQ_LAST_GOOD_TTL_SECONDS", 86400))
+
+# Escalonador de consultas (src/services/scheduler.py): vagas no processo e por chamador,
+# orçamento de bytes lidos por chamador numa janela e espera máxima na fila
+BQ_MAX_CONCURRENT = int(os.getenv("BQ_MAX_CONCURRENT", 8))
+# (o Histórico dispara 3 consultas em paralelo por tela)
+BQ_CALLER_MAX_CONCURRENT = int(os.getenv("BQ_CALLER_MAX_CONCURRENT", 4))
+BQ_CALLER_BYTES_PER_WINDOW = int(os.getenv("BQ_CALLER_BYTES_PER_WINDOW", 50 * 1024**3))
+BQ_BUDGET_WINDOW_SECONDS = float(os.getenv("BQ_BUDGET_WINDOW_SECONDS", 900))
+BQ_QUEUE_TIMEOUT_SECONDS = float(os.getenv("BQ_QUEUE_TIMEOUT_SECONDS", 60))
+# Proxies confiáveis (IPs, separados por vírgula): só deles valem X-User (usuário já
+# autenticado pelo proxy) e X-Forwarded-For para identificar o chamador
+TRUSTED_PROXIES = frozenset(ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "").split(",") if ip.strip())
+
+# Analytics de DTC (src/services/analytics.py): janelas de coocorrência aceitas (minutos),
+# dias máximos por consulta e quando reconsultar um dia ainda aberto (hoje)
+ANALYTICS_WINDOWS_MINUTES = tuple(
+    int(m) for m in os.getenv("ANALYTICS_WINDOWS_MINUTES", "15,60,240").split(",") if m.strip()
+)
+ANALYTICS_DEFAULT_WINDOW_MINUTES = int(os.getenv("ANALYTICS_DEFAULT_WINDOW_MINUTES", 60))
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", 90))
+ANALYTICS_OPEN_DAY_TTL_SECONDS = float(os.getenv("ANALYTICS_OPEN_DAY_TTL_SECONDS", 900))
+
+# Hotspots no mapa (src/services/geo.py): tiles geohash por consulta e DTCs por célula
+GEO_MAX_TILES = int(os.getenv("GEO_MAX_TILES", 64))
+GEO_TOP_DTCS = int(os.getenv("GEO_TOP_DTCS", 3))
+
+# Rollups HLL (sketches por dia) gravados no dataset BQ_DATASET (src/services/rollups.py):
+# desligados por padrão (criam tabelas e gravam no dataset); ligue com HLL_ROLLUPS_ENABLED=true.
+# A cada intervalo, refaz os últimos N dias (mais HISTORY_SETTLE_DAYS); 0 desliga
+HLL_ROLLUPS_ENABLED = os.getenv("HLL_ROLLUPS_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+HLL_ROLLUP_REFRESH_SECONDS = float(os.getenv("HLL_ROLLUP_REFRESH_SECONDS", 3600))
+HLL_ROLLUP_REFRESH_DAYS = int(os.getenv("HLL_ROLLUP_REFRESH_DAYS", 2))
+HLL_ROLLUP_TIMEOUT_SECONDS = float(os.getenv("HLL_ROLLUP_TIMEOUT_SECONDS", 600))
+
+# Snapshot de status de falhas por veículo (src/services/fault_snapshot.py, SQLite em CACHE_DIR):
+# intervalo do job (0 desliga), janela, sobreposição para eventos atrasados e idade máxima para ser usado
+FAULT_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("FAULT_SNAPSHOT_INTERVAL_SECONDS", 300))
+FAULT_SNAPSHOT_DAYS = int(os.getenv("FAULT_SNAPSHOT_DAYS", 30))
+FAULT_SNAPSHOT_OVERLAP_MINUTES = int(os.getenv("FAULT_SNAPSHOT_OVERLAP_MINUTES", 30))
+FAULT_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("FAULT_SNAPSHOT_MAX_AGE_SECONDS", 1800))
+FAULT_SNAPSHOT_TIMEOUT_SECONDS = float(os.getenv("FAULT_SNAPSHOT_TIMEOUT_SECONDS", 600))
+
+# Conjuntos de resultado (src/services/result_sets.py): history_base de um filtro materializado
+# em BQ_DATASET e reaproveitado via ?result=<handle>; validade e espaço total das tabelas
+RESULT_SET_TTL_SECONDS = int(os.getenv("RESULT_SET_TTL_SECONDS", 1800))
+RESULT_SET_MAX_BYTES = int(os.getenv("RESULT_SET_MAX_BYTES", 5 * 1024**3))
+# linhas por página lida na exportação (/history/export)
+RESULT_EXPORT_PAGE_ROWS = int(os.getenv("RESULT_EXPORT_PAGE_ROWS", 10000))
+
+# Cache compartilhado entre os workers do host (src/services/shared_cache.py, SQLite em CACHE_DIR):
+# tamanho máximo (0 desliga) e validade da resolução placa/IMEI/chassi -> veículo
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", 256 * 1024**2))
+VEHICLE_CACHE_TTL_SECONDS = float(os.getenv("VEHICLE_CACHE_TTL_SECONDS", 3600))
+# Só um worker do host roda os jobs em segundo plano (src/services/leader.py); os outros
+# tentam assumir a cada N segundos, caso o líder saia
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", 30))
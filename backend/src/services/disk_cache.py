@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Cache persistente em disco (um JSON por chave), para resultados que não
+# mudam mais — ex.: histórico de intervalos já fechados. Escrita atômica via
+# arquivo temporário + os.replace, então leitores nunca veem arquivo parcial.
+# O total fica limitado a DISK_CACHE_MAX_BYTES: a cada tanto gravado, os arquivos
+# lidos há mais tempo (mtime, renovado na leitura) saem até sobrar _PRUNE_TARGET
+# do limite. Namespaces de registro (_REGISTRIES) nunca saem por espaço.
+# --------------------------------------------------------------------------
+# result_sets.py: registro das tabelas de resultado, não cache (tem limpeza própria)
+_REGISTRIES = frozenset({"results"})
+# a leitura só renova o mtime se o último tiver mais que isso
+_TOUCH_SECONDS = 60.0
+# confere o tamanho depois de gravar esta fração do limite (e na primeira gravação)
+_PRUNE_EVERY = 0.05
+# ao passar do limite, apaga até ficar nesta fração dele
+_PRUNE_TARGET = 0.9
+
+_prune_lock = threading.Lock()
+_written_since_prune: Optional[int] = None  # None: ainda não conferiu neste processo
+
+
+def make_key(**parts: Any) -> str:
+    """Chave estável para um conjunto de parâmetros já normalizados."""
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _path(namespace: str, key: str) -> Path:
+    return Path(config.CACHE_DIR) / namespace / f"{key}.json"
+
+
+def get(namespace: str, key: str) -> Optional[Any]:
+    path = _path(namespace, key)
+    try:
+        value = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning("Entrada de cache ilegível, ignorando: %s", path)
+        return None
+    try:
+        if time.time() - path.stat().st_mtime > _TOUCH_SECONDS:
+            os.utime(path)  # mtime = último acesso (ordem da limpeza)
+    except OSError:
+        pass
+    return value
+
+
+def put(namespace: str, key: str, value: Any) -> None:
+    path = _path(namespace, key)
+    tmp: Optional[str] = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(value, fh, ensure_ascii=False, default=str)
+        os.replace(tmp, path)
+        tmp = None
+        size = path.stat().st_size
+    except OSError:
+        logger.warning("Não foi possível gravar o cache em %s", path, exc_info=True)
+        return
+    finally:
+        if tmp is not None:
+            # falha no meio (disco ou serialização): não deixa o temporário para trás
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+    if namespace not in _REGISTRIES:
+        _maybe_prune(size)
+
+
+def _maybe_prune(written: int) -> None:
+    global _written_since_prune
+    limit = config.DISK_CACHE_MAX_BYTES
+    if limit <= 0:
+        return
+    with _prune_lock:
+        if _written_since_prune is not None:
+            _written_since_prune += written
+            if _written_since_prune < limit * _PRUNE_EVERY:
+                return
+        _written_since_prune = 0
+    prune()
+
+
+def _entries() -> List[Tuple[float, int, Path]]:
+    """(mtime, tamanho, caminho) de todos os arquivos dos namespaces de cache."""
+    entries: List[Tuple[float, int, Path]] = []
+    root = Path(config.CACHE_DIR)
+    try:
+        namespaces = [d for d in root.iterdir() if d.is_dir() and d.name not in _REGISTRIES]
+    except OSError:
+        return entries
+    for directory in namespaces:
+        try:
+            with os.scandir(directory) as it:
+                for item in it:
+                    if not item.name.endswith(".json"):
+                        continue
+                    try:
+                        st = item.stat()
+                    except OSError:
+                        continue  # outro processo apagou
+                    entries.append((st.st_mtime, st.st_size, Path(item.path)))
+        except OSError:
+            continue
+    return entries
+
+
+def prune() -> int:
+    """Apaga os arquivos lidos há mais tempo até o total caber em _PRUNE_TARGET do limite."""
+    limit = config.DISK_CACHE_MAX_BYTES
+    if limit <= 0:
+        return 0
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    if total <= limit:
+        return 0
+    target = int(limit * _PRUNE_TARGET)
+    removed = 0
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= target:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass  # outro worker já apagou
+        except OSError:
+            logger.warning("Não foi possível remover %s do cache", path, exc_info=True)
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("Cache em disco: %d arquivos removidos para caber em %d bytes", removed, limit)
+    return removed
+
+
+def delete(namespace: str, key: str) -> None:
+    try:
+        _path(namespace, key).unlink()
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.warning("Não foi possível remover a entrada de cache %s/%s", namespace, key, exc_info=True)
+
+
+def keys(namespace: str) -> List[str]:
+    """Chaves gravadas em `namespace` (para registros pequenos, não para o cache de consultas)."""
+    directory = Path(config.CACHE_DIR) / namespace
+    try:
+        return sorted(path.stem for path in directory.glob("*.json"))
+    except OSError:
+        return []
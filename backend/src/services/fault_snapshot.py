@@ -0,0 +1,386 @@
+# backend/src/services/fault_snapshot.py
+"""
+Snapshot local do status das falhas de cada veículo × (IMEI, DTC, FMI).
+
+    python -m src.services.fault_snapshot            # uma atualização (incremental)
+    python -m src.services.fault_snapshot --full     # reconstrói do zero
+
+O job guarda, em SQLite (CACHE_DIR/fault_status.sqlite3), as contagens por hora de
+cada falha na janela (FAULT_SNAPSHOT_DAYS). Cada rodada só varre as horas a partir da
+última marca d'água menos FAULT_SNAPSHOT_OVERLAP_MINUTES (eventos atrasados até esse
+limite entram). As horas varridas substituem as guardadas, numa transação.
+O rótulo (persistente/intermitente/provavelmente resolvido), o intervalo desde o
+último evento e a ação recomendada são calculados na leitura, a partir das horas
+guardadas; o rótulo usa o mesmo CASE das consultas (bq_client._status_label_sql),
+executado no SQLite. Por isso um veículo que parou de falhar "envelhece" sem ser
+reconsultado.
+A leitura por veículo é uma busca indexada. Quem lê (agente, triagem, API) cai na
+consulta ao vivo quando o snapshot está velho ou a janela pedida é maior que a dele.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import bq_client
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# parâmetros por comando no SQLite (limite padrão: 999)
+_SQL_CHUNK = 500
+# linhas por veículo, como em get_dtc_summary
+_MAX_ROWS = 500
+# linhas rotuladas por comando (4 parâmetros cada)
+_LABEL_CHUNK = 200
+_LABEL_SQL = bq_client._status_label_sql("c.ev_24h", "c.ev_7d", "c.days_with_events")
+
+_COLUMNS = (
+    "vehicle_id", "imei", "dtc", "fmi", "spn", "plate", "chassi", "chassi_last8", "customer_name",
+    "dtc_description", "fmi_pt", "plan_active", "plan_type", "first_seen", "last_seen", "hours",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS faults (
+  vehicle_id TEXT NOT NULL,
+  imei TEXT NOT NULL,
+  dtc TEXT NOT NULL,
+  fmi INTEGER NOT NULL,          -- -1 = FMI ausente
+  spn INTEGER,
+  plate TEXT,
+  chassi TEXT,
+  chassi_last8 TEXT,
+  customer_name TEXT,
+  dtc_description TEXT,
+  fmi_pt TEXT,
+  plan_active INTEGER,
+  plan_type TEXT,
+  first_seen REAL,
+  last_seen REAL,
+  hours TEXT NOT NULL,           -- JSON [[início da hora (epoch), eventos], ...]
+  PRIMARY KEY (vehicle_id, imei, dtc, fmi)
+);
+CREATE INDEX IF NOT EXISTS faults_plate ON faults (plate);
+CREATE INDEX IF NOT EXISTS faults_imei ON faults (imei);
+CREATE INDEX IF NOT EXISTS faults_chassi_last8 ON faults (chassi_last8);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _epoch(value: Any) -> Optional[float]:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return None
+
+
+def _utc(epoch: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc) if epoch is not None else None
+
+
+def _chunks(items: List[Any], size: int = _SQL_CHUNK) -> Iterable[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _hour_floor(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+class FaultSnapshot:
+    def __init__(
+        self,
+        path: str = os.path.join(config.CACHE_DIR, "fault_status.sqlite3"),
+        days: int = config.FAULT_SNAPSHOT_DAYS,
+        interval: float = config.FAULT_SNAPSHOT_INTERVAL_SECONDS,
+        overlap_minutes: int = config.FAULT_SNAPSHOT_OVERLAP_MINUTES,
+        max_age: float = config.FAULT_SNAPSHOT_MAX_AGE_SECONDS,
+    ):
+        self.path = path
+        self.days = max(1, int(days))
+        self.interval = float(interval)
+        self.overlap = timedelta(minutes=max(0, overlap_minutes))
+        self.max_age = float(max_age)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.last_error: Optional[str] = None
+
+    # ------------------------------ armazenamento ------------------------------
+    def _db(self) -> sqlite3.Connection:
+        # chamado com self._lock
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _meta(self) -> Dict[str, str]:
+        with self._lock:
+            return {row["key"]: row["value"] for row in self._db().execute("SELECT key, value FROM meta")}
+
+    # --------------------------------- job ----------------------------------
+    def refresh(self, full: bool = False) -> Dict[str, Any]:
+        """Uma rodada do job. Devolve quantos veículos e falhas foram regravados."""
+        meta = self._meta()
+        watermark = meta.get("watermark")
+        incremental = not full and watermark is not None and meta.get("days") == str(self.days)
+
+        started = time.time()
+        if incremental:
+            scan_from = _hour_floor(datetime.fromisoformat(watermark) - self.overlap)
+        else:
+            scan_from = _hour_floor(datetime.now(timezone.utc) - timedelta(days=self.days))
+        rows = bq_client.get_fault_status_rows(scan_from)
+        records = [self._record(r) for r in rows]
+        vehicles = {r[0] for r in records}
+        cutoff = started - self.days * 86400
+        newest = max((r["last_seen_utc"] for r in rows if r.get("last_seen_utc")), default=None)
+
+        with self._lock:
+            conn = self._db()
+            with conn:
+                if incremental:
+                    records = [self._merge(conn, record, scan_from.timestamp(), cutoff) for record in records]
+                else:
+                    conn.execute("DELETE FROM faults")
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO faults ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    records,
+                )
+                # falhas sem evento na janela saem
+                conn.execute("DELETE FROM faults WHERE last_seen < ?", (cutoff,))
+                if newest is not None:
+                    new_mark = max(newest, datetime.fromisoformat(watermark)) if incremental else newest
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('watermark', ?)", (new_mark.isoformat(),))
+                elif not incremental:
+                    conn.execute("DELETE FROM meta WHERE key = 'watermark'")
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('days', ?)", (str(self.days),))
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('refreshed_at', ?)", (str(started),))
+        return {
+            "incremental": incremental,
+            "scan_from": scan_from.isoformat(),
+            "vehicles": len(vehicles),
+            "faults": len(records),
+        }
+
+    @staticmethod
+    def _merge(conn: sqlite3.Connection, record: Tuple[Any, ...], scan_from: float, cutoff: float) -> Tuple[Any, ...]:
+        """Junta as horas varridas (a partir de `scan_from`) com as horas guardadas antes dela."""
+        old = conn.execute(
+            "SELECT first_seen, last_seen, hours FROM faults WHERE vehicle_id = ? AND imei = ? AND dtc = ? AND fmi = ?",
+            record[:4],
+        ).fetchone()
+        if old is None:
+            return record
+        kept = [h for h in json.loads(old["hours"]) if cutoff < h[0] + 3600 and h[0] < scan_from]
+        merged = list(record)
+        merged[_COLUMNS.index("hours")] = json.dumps(kept + json.loads(record[_COLUMNS.index("hours")]), separators=(",", ":"))
+        seen = _COLUMNS.index("first_seen"), _COLUMNS.index("last_seen")
+        if kept and old["first_seen"] is not None:
+            merged[seen[0]] = min(v for v in (old["first_seen"], record[seen[0]]) if v is not None)
+        if old["last_seen"] is not None:
+            merged[seen[1]] = max(v for v in (old["last_seen"], record[seen[1]]) if v is not None)
+        return tuple(merged)
+
+    @staticmethod
+    def _record(r: Dict[str, Any]) -> Tuple[Any, ...]:
+        hours = [[int(h["hour"]), int(h["n"])] for h in r.get("hours") or []]
+        plan_active = r.get("plan_active")
+        return (
+            str(r.get("vehicle_id")),
+            r.get("imei") or "",
+            r.get("dtc"),
+            -1 if r.get("fmi") is None else int(r["fmi"]),
+            r.get("spn"),
+            r.get("plate"),
+            r.get("chassi"),
+            r.get("chassi_last8"),
+            r.get("customer_name"),
+            r.get("dtc_description"),
+            r.get("fmi_pt"),
+            None if plan_active is None else int(bool(plan_active)),
+            r.get("plan_type"),
+            _epoch(r.get("first_seen_utc")),
+            _epoch(r.get("last_seen_utc")),
+            json.dumps(hours, separators=(",", ":")),
+        )
+
+    # -------------------------------- leitura --------------------------------
+    def ready(self, days: int) -> bool:
+        """True se o snapshot cobre a janela pedida e foi atualizado há menos de FAULT_SNAPSHOT_MAX_AGE_SECONDS."""
+        if days > self.days:
+            return False
+        meta = self._meta()
+        if meta.get("days") != str(self.days) or "refreshed_at" not in meta:
+            return False
+        return time.time() - float(meta["refreshed_at"]) <= self.max_age
+
+    @staticmethod
+    def _summary_row(row: sqlite3.Row, now: float, days: int) -> Optional[Dict[str, Any]]:
+        """Linha de get_dtc_summary sem o rótulo (ver _label)."""
+        cutoff = now - days * 86400
+        hours = [(h, n) for h, n in json.loads(row["hours"]) if h + 3600 > cutoff]
+        if not hours:
+            return None
+
+        def since(seconds: int) -> int:
+            return sum(n for h, n in hours if h + 3600 > now - seconds)
+
+        first_seen = row["first_seen"] if row["first_seen"] and row["first_seen"] >= cutoff else max(hours[0][0], cutoff)
+        ev_24h, ev_7d = since(24 * 3600), since(7 * 86400)
+        days_with_events = len({int(h // 86400) for h, _ in hours})
+        return {
+            "vehicle_id": row["vehicle_id"],
+            "customer_name": row["customer_name"],
+            "plate": row["plate"],
+            "chassi": row["chassi"],
+            "chassi_last8": row["chassi_last8"],
+            "imei": row["imei"] or None,
+            "plan_active": None if row["plan_active"] is None else bool(row["plan_active"]),
+            "plan_type": row["plan_type"],
+            "dtc": row["dtc"],
+            "fmi": None if row["fmi"] == -1 else row["fmi"],
+            "spn": row["spn"],
+            "dtc_description": row["dtc_description"],
+            "fmi_pt": row["fmi_pt"],
+            "events_total": sum(n for _, n in hours),
+            "first_seen_utc": _utc(first_seen),
+            "last_seen_utc": _utc(row["last_seen"]),
+            "ev_6h": since(6 * 3600),
+            "ev_24h": ev_24h,
+            "ev_7d": ev_7d,
+            "days_with_events": days_with_events,
+        }
+
+    @staticmethod
+    def _label(conn: sqlite3.Connection, rows: List[Dict[str, Any]]) -> None:
+        """status_label de cada linha pelo CASE de bq_client._status_label_sql, no SQLite."""
+        for start in range(0, len(rows), _LABEL_CHUNK):
+            chunk = rows[start:start + _LABEL_CHUNK]
+            params: List[Any] = []
+            for i, r in enumerate(chunk):
+                params += [i, r["ev_24h"], r["ev_7d"], r["days_with_events"]]
+            labels = conn.execute(
+                f"WITH c (i, ev_24h, ev_7d, days_with_events) AS (VALUES {', '.join(['(?, ?, ?, ?)'] * len(chunk))})"
+                f" SELECT c.i, {_LABEL_SQL} FROM c",
+                params,
+            ).fetchall()
+            for i, label in labels:
+                chunk[i]["status_label"] = label
+
+    def _rows(self, where: str, params: List[Any], days: int) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            found = conn.execute(f"SELECT * FROM faults WHERE {where}", params).fetchall()
+            rows = [r for r in (self._summary_row(row, now, days) for row in found) if r is not None]
+            self._label(conn, rows)
+        rows.sort(key=lambda r: r["last_seen_utc"] or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
+        return bq_client.label_persistence(rows)
+
+    @staticmethod
+    def _key_filter(vehicle_key: str) -> Tuple[str, List[str]]:
+        key = (vehicle_key or "").strip().upper()
+        return "(plate = ? OR imei = ? OR chassi_last8 = ?)", [key, key, key[-8:]]
+
+    def vehicle_summary(self, vehicle_key: str, days: int = 30) -> Optional[List[Dict[str, Any]]]:
+        """Mesmas linhas de bq_client.get_dtc_summary, ou None se o snapshot não serve para este pedido."""
+        if not (vehicle_key or "").strip() or not self.ready(days):
+            return None
+        where, params = self._key_filter(vehicle_key)
+        return self._rows(where, params, days)[:_MAX_ROWS]
+
+    def vehicle_summaries(self, vehicle_keys: List[str], days: int = 30) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        {chave: {"vehicle", "summary"}} como em get_dtc_summary_batch, só para as chaves com
+        falha na janela (o resto segue pela consulta ao vivo). None se o snapshot não serve.
+        """
+        if not self.ready(days):
+            return None
+        items: Dict[str, Dict[str, Any]] = {}
+        for key in bq_client._normalize_keys(vehicle_keys):
+            where, params = self._key_filter(key)
+            rows = self._rows(where, params, days)[:_MAX_ROWS]
+            if not rows:
+                continue
+            first = rows[0]
+            vehicle = {
+                k: first.get(k)
+                for k in ("vehicle_id", "plate", "chassi", "chassi_last8", "imei", "customer_name", "plan_active", "plan_type")
+            }
+            items[key] = {"vehicle": vehicle, "summary": rows}
+        return items
+
+    # ------------------------------- agendador -------------------------------
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None or self.interval <= 0:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="fault-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop.set()
+            self._thread = None
+
+    def _run(self, stop: threading.Event) -> None:
+        while True:
+            try:
+                result = self.refresh()
+                self.last_error = None
+                logger.info("Snapshot de falhas: %s veículos, %s falhas", result["vehicles"], result["faults"])
+            except Exception as exc:
+                logger.exception("Falha ao atualizar o snapshot de falhas")
+                self.last_error = str(exc) or exc.__class__.__name__
+            if stop.wait(self.interval):
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        meta = self._meta()
+        with self._lock:
+            faults, vehicles = self._db().execute("SELECT COUNT(*), COUNT(DISTINCT vehicle_id) FROM faults").fetchone()
+        refreshed_at = float(meta["refreshed_at"]) if "refreshed_at" in meta else None
+        return {
+            "path": self.path,
+            "days": self.days,
+            "vehicles": vehicles,
+            "faults": faults,
+            "watermark": meta.get("watermark"),
+            "refreshed_at": _utc(refreshed_at).isoformat() if refreshed_at else None,
+            "ready": self.ready(self.days),
+            "last_error": self.last_error,
+        }
+
+
+fault_snapshot = FaultSnapshot()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Atualiza o snapshot local de status das falhas por veículo.")
+    parser.add_argument("--full", action="store_true", help="reconstrói do zero em vez de incremental")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    result = fault_snapshot.refresh(full=args.full)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import math
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import config
+from . import disk_cache
+from .breaker import degradation, report_stale
+
+# --------------------------------------------------------------------------
+# Hotspots de DTC no mapa: eventos agregados em células geohash no BigQuery.
+# A precisão da célula vem do zoom. As células são agrupadas em "tiles", que
+# são o geohash com um caractere a menos (32 células cada). A área visível vira
+# um conjunto fixo de tiles, no máximo GEO_MAX_TILES; se passar disso, a precisão
+# cai. Assim o tamanho da resposta não depende do volume de eventos. Para
+# intervalos fechados, cada tile fica no cache em disco, e mover o mapa só
+# consulta os tiles novos.
+# --------------------------------------------------------------------------
+BBox = Tuple[float, float, float, float]  # (min_lon, min_lat, max_lon, max_lat)
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+MAX_PRECISION = 8
+WORLD: BBox = (-180.0, -90.0, 180.0, 90.0)
+
+# zoom do mapa (0-20) -> caracteres do geohash (≈ 30 células na largura da tela)
+_ZOOM_PRECISION = ((3, 2), (6, 3), (8, 4), (11, 5), (13, 6), (15, 7))
+
+
+def precision_for_zoom(zoom: int) -> int:
+    for max_zoom, precision in _ZOOM_PRECISION:
+        if zoom <= max_zoom:
+            return precision
+    return MAX_PRECISION
+
+
+def parse_bbox(text: Optional[str]) -> BBox:
+    """`min_lon,min_lat,max_lon,max_lat` (ordem do GeoJSON); vazio = mundo inteiro."""
+    if not text:
+        return WORLD
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in text.split(","))
+    except ValueError:
+        raise ValueError("bbox inválido. Use min_lon,min_lat,max_lon,max_lat.") from None
+    if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise ValueError("bbox fora dos limites (lon -180..180, lat -90..90, mínimos antes dos máximos).")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+# ------------------------------- geohash ----------------------------------
+def _cell_size(precision: int) -> Tuple[float, float]:
+    """(graus de latitude, graus de longitude) de uma célula com `precision` caracteres."""
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def encode(lat: float, lon: float, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, value, bit, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[value])
+            value, bit = 0, 0
+    return "".join(chars)
+
+
+def bounds(geohash: str) -> BBox:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lon_range[0], lat_range[0], lon_range[1], lat_range[1]
+
+
+def covering_tiles(bbox: BBox, tile_precision: int) -> Optional[List[str]]:
+    """Tiles que cobrem o bbox, ou None se passar de GEO_MAX_TILES."""
+    if tile_precision <= 0:
+        return [""]
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lat_step, lon_step = _cell_size(tile_precision)
+    rows = range(math.floor((min_lat + 90) / lat_step), math.ceil((max_lat + 90) / lat_step))
+    cols = range(math.floor((min_lon + 180) / lon_step), math.ceil((max_lon + 180) / lon_step))
+    if len(rows) * len(cols) > config.GEO_MAX_TILES:
+        return None
+    return sorted(
+        {
+            encode(-90 + (r + 0.5) * lat_step, -180 + (c + 0.5) * lon_step, tile_precision)
+            for r in rows
+            for c in cols
+        }
+    )
+
+
+def plan(bbox: BBox, zoom: int) -> Tuple[int, List[str]]:
+    """(precisão das células, tiles). Baixa a precisão até a área caber em GEO_MAX_TILES."""
+    precision = precision_for_zoom(max(0, zoom))
+    while True:
+        tiles = covering_tiles(bbox, precision - 1)
+        if tiles is not None:
+            return precision, tiles
+        precision -= 1
+
+
+def tiles_bbox(tiles: List[str]) -> BBox:
+    """Retângulo que envolve os tiles (poda por lat/lon antes do geohash no SQL)."""
+    boxes = [bounds(tile) for tile in tiles]
+    return (
+        min(b[0] for b in boxes),
+        min(b[1] for b in boxes),
+        max(b[2] for b in boxes),
+        max(b[3] for b in boxes),
+    )
+
+
+# ------------------------------ cache de tiles ------------------------------
+def cached_tiles(
+    tiles: List[str],
+    fetch: Callable[[List[str]], Dict[str, List[Dict[str, Any]]]],
+    **key_parts: Any,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Células por tile para um intervalo fechado: o que está no disco vem de lá, e o
+    resto sai de UMA chamada a `fetch(tiles_faltantes)`. Tile vazio também é gravado.
+    Resultado degradado (último bom, com o BigQuery fora) é devolvido mas não gravado.
+    """
+    found: Dict[str, List[Dict[str, Any]]] = {}
+    missing: List[str] = []
+    for tile in tiles:
+        cells = disk_cache.get("geo", disk_cache.make_key(tile=tile, **key_parts))
+        if cells is None:
+            missing.append(tile)
+        else:
+            found[tile] = cells
+    if missing:
+        with degradation() as degraded:
+            fetched = fetch(missing)
+        if degraded["stale"]:
+            report_stale(degraded["age"])
+        for tile in missing:
+            found[tile] = fetched.get(tile) or []
+            if not degraded["stale"]:
+                disk_cache.put("geo", disk_cache.make_key(tile=tile, **key_parts), found[tile])
+    return found
+
+
+def hotspots_payload(
+    by_tile: Dict[str, List[Dict[str, Any]]],
+    tiles: List[str],
+    bbox: BBox,
+    precision: int,
+    start_date: str,
+    end_date: str,
+) -> Dict[str, Any]:
+    min_lon, min_lat, max_lon, max_lat = bbox
+    cells = [
+        cell
+        for tile in tiles
+        for cell in by_tile.get(tile) or []
+        if min_lon <= cell["lon"] <= max_lon and min_lat <= cell["lat"] <= max_lat
+    ]
+    cells.sort(key=lambda c: c["count"], reverse=True)
+    lat_step, lon_step = _cell_size(precision)
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "bbox": list(bbox),
+        "precision": precision,
+        "cell_size_deg": {"lat": lat_step, "lon": lon_step},
+        "tiles": len(tiles),
+        "total_events": sum(c["count"] for c in cells),
+        "cells": cells,
+    }
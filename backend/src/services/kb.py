@@ -1,19 +1,68 @@
 import json
+import logging
+import threading
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+SEED_PATH = Path(__file__).resolve().parents[2] / "kb" / "seed_severity.json"
+
 _seed = None
+_seed_lock = threading.Lock()
+
 
 def _load_seed():
+    # lido uma vez por processo; sem o arquivo (ou inválido) a kb fica vazia e o aviso sai uma vez só
     global _seed
     if _seed is None:
-        path = Path(__file__).resolve().parents[2] / "kb" / "seed_severity.json"
-        _seed = json.loads(path.read_text(encoding="utf-8"))
+        with _seed_lock:
+            if _seed is None:
+                try:
+                    _seed = json.loads(SEED_PATH.read_text(encoding="utf-8"))
+                except (OSError, ValueError) as exc:
+                    logger.warning("Base de severidade indisponível (%s): %s; severidades ficam em branco", SEED_PATH, exc)
+                    _seed = []
     return _seed
 
 
+def available() -> bool:
+    return bool(_load_seed())
+
+
+_index = None
+
+def _load_index():
+    # (spn, fmi) -> item; vale o primeiro item de cada par, como na busca linear
+    global _index
+    if _index is None:
+        _index = {(item.get("spn"), item.get("fmi")): item for item in reversed(_load_seed())}
+    return _index
+
+
 def lookup(spn: int, fmi: int):
-    data = _load_seed()
-    for item in data:
-        if item.get("spn") == spn and item.get("fmi") == fmi:
-            return item
-    return {"title": "Desconhecido", "severity": "Baixa", "sop": [], "can_run": True}
\ No newline at end of file
+    item = _load_index().get((spn, fmi))
+    if item is not None:
+        return item
+    return {"title": "Desconhecido", "severity": "Baixa", "sop": [], "can_run": True}
+
+
+# peso de cada nível de severidade (para ordenar/pontuar falhas)
+SEVERITY_WEIGHTS = {"crítica": 4, "critica": 4, "alta": 3, "média": 2, "media": 2, "baixa": 1}
+
+
+def severity_weight(severity) -> int:
+    return SEVERITY_WEIGHTS.get(str(severity or "").strip().lower(), 1)
+
+
+def severity_table():
+    """[{spn, fmi, severity, weight}] de toda a kb (vira parâmetro de consulta no ranking da frota)."""
+    table = []
+    for item in _load_seed():
+        if isinstance(item.get("spn"), int) and isinstance(item.get("fmi"), int):
+            table.append({
+                "spn": item["spn"],
+                "fmi": item["fmi"],
+                "severity": item.get("severity") or "Baixa",
+                "weight": severity_weight(item.get("severity")),
+            })
+    return table
@@ -0,0 +1,99 @@
+# backend/src/services/leader.py
+"""
+Eleição de um único processo para os jobs em segundo plano (aquecedor de cache,
+snapshot de falhas, analytics, rollups HLL) quando o uvicorn roda com vários
+workers no mesmo host.
+
+O líder é quem segura um flock exclusivo em CACHE_DIR/background.lock. O sistema
+operacional solta o lock quando o processo termina, e os outros workers tentam de
+novo a cada LEADER_RETRY_SECONDS: se o líder cair, outro assume sozinho.
+Sem fcntl (Windows), cada processo se considera líder.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from . import config
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - só em sistemas sem flock
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    def __init__(
+        self,
+        path: str = os.path.join(config.CACHE_DIR, "background.lock"),
+        retry_seconds: float = config.LEADER_RETRY_SECONDS,
+    ):
+        self.path = path
+        self.retry_seconds = max(0.1, float(retry_seconds))
+        self._fh: Optional[Any] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fh is not None
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._fh is not None:
+                return True
+            if fcntl is None:
+                self._fh = True
+                return True
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fh = open(self.path, "a+")
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fh.close()
+                return False
+            fh.seek(0)
+            fh.truncate()
+            fh.write(str(os.getpid()))
+            fh.flush()
+            self._fh = fh
+            return True
+
+    def start(self, on_elected: Callable[[], None]) -> None:
+        """Chama `on_elected` (uma vez) quando este processo virar o líder."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, args=(self._stop, on_elected), name="leader-election", daemon=True
+            )
+        self._thread.start()
+
+    def _run(self, stop: threading.Event, on_elected: Callable[[], None]) -> None:
+        while not self.try_acquire():
+            if stop.wait(self.retry_seconds):
+                return
+        if stop.is_set():
+            return
+        logger.info("Processo %s assumiu os jobs em segundo plano", os.getpid())
+        on_elected()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop.set()
+            self._thread = None
+            fh, self._fh = self._fh, None
+        if fh is not None and fh is not True:
+            fh.close()  # fechar solta o flock
+
+    def stats(self) -> Dict[str, Any]:
+        return {"leader": self.is_leader, "pid": os.getpid(), "lock": self.path}
+
+
+background_leader = LeaderLock()
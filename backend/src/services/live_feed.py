@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from . import bq_client
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Feed ao vivo de DTCs.
+# Um poller (thread) por conjunto distinto de filtros. Ele lê do BigQuery a partir
+# da marca d'água e distribui os eventos novos para todos os assinantes. Abas abertas
+# com os mesmos filtros compartilham as consultas. O poller para quando o último
+# assinante sai.
+# Cada leitura recomeça LIVE_OVERLAP_SECONDS antes da marca d'água e exclui os ids
+# já entregues. Assim eventos com o mesmo ts do cursor e eventos que chegam
+# atrasados (dentro da sobreposição) também são entregues, e nenhum se repete.
+# --------------------------------------------------------------------------
+FilterKey = Tuple[str, str, str]
+
+# eventos por leitura (rajadas maiores saem nas leituras seguintes, sem buracos)
+_BATCH_LIMIT = 500
+# lotes pendentes por assinante antes de considerá-lo atrasado
+_SUBSCRIBER_BUFFER = 64
+# leituras no máximo por recuperação de reconexão
+_CATCH_UP_PAGES = 10
+
+
+def filter_key(chassi: Optional[str], customer: Optional[str], dtc: Optional[str]) -> FilterKey:
+    # mesma normalização de bq_client._overview_filters
+    return (
+        (chassi or "").strip().upper(),
+        (customer or "").strip().lower(),
+        (dtc or "").strip().upper(),
+    )
+
+
+def _event(row: Dict) -> Dict:
+    return {
+        "id": row.get("event_id"),
+        "customer_name": row.get("customer_name"),
+        "chassi_last8": row.get("chassi_last8"),
+        "plate": row.get("plate"),
+        **bq_client.overview_event(row),
+    }
+
+
+class Subscription:
+    def __init__(self, key: FilterKey, loop: asyncio.AbstractEventLoop):
+        self.key = key
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=_SUBSCRIBER_BUFFER)
+        self.lagged = False
+
+    def _offer(self, batch: Dict) -> None:
+        # roda no event loop
+        try:
+            self.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            # cliente lento: descarta e avisa para ele recarregar a visão geral
+            self.lagged = True
+
+    def deliver(self, batch: Dict) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self._offer, batch)
+        except RuntimeError:  # loop encerrado
+            pass
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class _Poller:
+    def __init__(self, key: FilterKey, interval: float, overlap: float):
+        self.key = key
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self.subscribers: Set[Subscription] = set()
+        self.watermark: Optional[datetime] = None
+        # ids já lidos na janela de sobreposição -> ts
+        self._seen: Dict[str, datetime] = {}
+        self.polls = 0
+        self.delivered = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"live-dtc-{'|'.join(key)}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _query_kwargs(self) -> Dict[str, Any]:
+        chassi, customer, dtc = self.key
+        return {"chassi_last8": chassi, "customer": customer, "dtc": dtc}
+
+    def _read(self) -> List[Dict]:
+        """Linhas ainda não lidas desde marca d'água - sobreposição; registra os ids e avança a marca."""
+        assert self.watermark is not None
+        rows = bq_client.get_new_overview_events(
+            **self._query_kwargs(),
+            since_ts=self.watermark - self.overlap,
+            exclude_ids=list(self._seen),
+            limit=_BATCH_LIMIT,
+        )
+        for row in rows:
+            if row.get("event_id") and row.get("ts"):
+                self._seen[row["event_id"]] = row["ts"]
+        self.watermark = max((r["ts"] for r in rows if r.get("ts")), default=self.watermark)
+        floor = self.watermark - self.overlap
+        self._seen = {k: ts for k, ts in self._seen.items() if ts >= floor}
+        return rows
+
+    def _run(self) -> None:
+        # começa do último evento já existente: só o que chegar depois é "novo"
+        start: Optional[datetime] = None
+        while not self._stop.is_set() and self.watermark is None:
+            try:
+                latest = bq_client.get_overview_watermark(**self._query_kwargs())
+                self.watermark = start = latest or datetime.now(timezone.utc)
+            except Exception:
+                logger.exception("Feed ao vivo %s: falha ao obter a marca d'água", self.key)
+                self._stop.wait(self.interval)
+
+        while not self._stop.wait(self.interval):
+            try:
+                rows = self._read()
+            except Exception:
+                logger.exception("Feed ao vivo %s: falha na leitura", self.key)
+                continue
+            self.polls += 1
+            if start is not None:
+                # o que já existia quando o feed começou só é marcado como lido
+                rows = [r for r in rows if r.get("ts") and r["ts"] > start]
+            if not rows:
+                continue
+            batch = {"events": [_event(r) for r in rows], "watermark": self.watermark.isoformat()}
+            for sub in list(self.subscribers):
+                sub.deliver(batch)
+            self.delivered += len(rows)
+
+
+class LiveFeed:
+    def __init__(self, interval: float = config.LIVE_POLL_SECONDS, overlap: float = config.LIVE_OVERLAP_SECONDS):
+        self.interval = interval
+        self.overlap = overlap
+        self._pollers: Dict[FilterKey, _Poller] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(
+        self,
+        chassi: Optional[str] = None,
+        customer: Optional[str] = None,
+        dtc: Optional[str] = None,
+    ) -> Subscription:
+        key = filter_key(chassi, customer, dtc)
+        sub = Subscription(key, asyncio.get_running_loop())
+        with self._lock:
+            poller = self._pollers.get(key)
+            if poller is None:
+                poller = self._pollers[key] = _Poller(key, self.interval, self.overlap)
+                poller.start()
+            poller.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            poller = self._pollers.get(sub.key)
+            if poller is None:
+                return
+            poller.subscribers.discard(sub)
+            if not poller.subscribers:
+                poller.stop()
+                del self._pollers[sub.key]
+
+    def catch_up(self, sub: Subscription, since_ts: datetime) -> List[Dict]:
+        """
+        Eventos desde `since_ts` menos a sobreposição (reconexão do cliente), fora do poller.
+        Pagina pelo cursor (ts, ids no último ts), até _CATCH_UP_PAGES leituras. Pode repetir
+        eventos que o cliente já tinha; ele descarta pelo `id`.
+        """
+        chassi, customer, dtc = sub.key
+        cursor = since_ts - timedelta(seconds=self.overlap)
+        at_cursor: List[str] = []
+        events: List[Dict] = []
+        for _ in range(_CATCH_UP_PAGES):
+            rows = bq_client.get_new_overview_events(
+                chassi_last8=chassi,
+                customer=customer,
+                dtc=dtc,
+                since_ts=cursor,
+                exclude_ids=at_cursor,
+                limit=_BATCH_LIMIT,
+            )
+            events.extend(_event(r) for r in rows)
+            if len(rows) < _BATCH_LIMIT:
+                break
+            last = rows[-1]["ts"]
+            at_cursor = (at_cursor if last == cursor else []) + [r["event_id"] for r in rows if r["ts"] == last]
+            cursor = last
+        return events
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pollers = list(self._pollers.values())
+        return {
+            "pollers": len(pollers),
+            "subscribers": sum(len(p.subscribers) for p in pollers),
+            "feeds": [
+                {
+                    "chassi": p.key[0],
+                    "customer": p.key[1],
+                    "dtc": p.key[2],
+                    "subscribers": len(p.subscribers),
+                    "watermark": p.watermark.isoformat() if p.watermark else None,
+                    "polls": p.polls,
+                    "delivered": p.delivered,
+                }
+                for p in pollers
+            ],
+        }
+
+
+live_feed = LiveFeed()
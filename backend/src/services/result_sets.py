@@ -0,0 +1,191 @@
+# backend/src/services/result_sets.py
+"""
+Handles de conjuntos de resultado: o history_base de um filtro (cliente, chassi, DTC,
+intervalo) é materializado UMA vez numa tabela de BQ_DATASET. As telas seguintes
+(/history/daily, /history/events, /geo/dtc-hotspots, /history/export) recebem
+`?result=<handle>` e leem dessa tabela em vez de refazer a cadeia de joins.
+
+- O handle é derivado do filtro e do intervalo. Pedir o mesmo conjunto de novo
+  devolve o handle existente enquanto ele vale.
+- Cada tabela expira sozinha no BigQuery depois de RESULT_SET_TTL_SECONDS. O registro
+  local (disk_cache "results") para de aceitar o handle um pouco antes disso.
+- Se a soma das tabelas vivas passar de RESULT_SET_MAX_BYTES, as menos usadas são
+  apagadas. Um conjunto que sozinho passa do limite é recusado.
+- Um uso longo (a exportação) segura o handle com lease(): enquanto a reserva vale,
+  ele não é apagado para liberar espaço e a tabela não expira (a validade é estendida).
+- Intervalo aberto (até hoje) não é reaproveitado: cada pedido materializa de novo,
+  porque os eventos de hoje ainda mudam.
+"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from . import bq_client
+from . import config
+from . import disk_cache
+
+_NAMESPACE = "results"
+_HANDLE_RE = re.compile(r"[0-9a-f]{16}")
+# margem para não entregar uma tabela prestes a expirar no BigQuery
+_EXPIRY_MARGIN_SECONDS = 60
+# duração de uma reserva (lease); quem segura o handle renova a cada uso
+_LEASE_SECONDS = 300
+
+
+class ResultSets:
+    def __init__(self, ttl: int = config.RESULT_SET_TTL_SECONDS, max_bytes: int = config.RESULT_SET_MAX_BYTES):
+        self.ttl = max(120, int(ttl))
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+
+    def create(
+        self,
+        filters: Dict[str, str],
+        start_date: Optional[date],
+        end_date: Optional[date],
+        days: int = 7,
+    ) -> Dict[str, Any]:
+        """Materializa (ou reaproveita) o conjunto; devolve os metadados do handle."""
+        start, end = bq_client.resolve_history_range(start_date, end_date, days)
+        closed = bq_client.is_closed_range(end)
+        handle = disk_cache.make_key(
+            filters=filters,
+            start_date=start.isoformat(),
+            end_date=end.isoformat(),
+            created=None if closed else time.time(),
+        )[:16]
+        existing = self.get(handle) if closed else None
+        if existing is not None:
+            return {**existing, "reused": True}
+
+        table = bq_client.result_table_name(handle)
+        now = time.time()
+        stats = bq_client.create_result_set(
+            table,
+            self.ttl,
+            chassi_last8=filters.get("chassi"),
+            customer=filters.get("customer"),
+            dtc=filters.get("dtc"),
+            start_date=start,
+            end_date=end,
+        )
+        if stats["bytes"] > self.max_bytes:
+            bq_client.drop_result_set(table)
+            raise ValueError(
+                "Conjunto de resultado grande demais para materializar. Reduza o intervalo ou aplique mais filtros."
+            )
+
+        meta = {
+            "handle": handle,
+            "table": table,
+            "filters": filters,
+            "start_date": stats["start_date"],
+            "end_date": stats["end_date"],
+            "rows": stats["rows"],
+            "bytes": stats["bytes"],
+            "created_at": now,
+            "expires_at": now + self.ttl,
+            "last_used": now,
+        }
+        with self._lock:
+            disk_cache.put(_NAMESPACE, handle, meta)
+            evicted = self._evict(keep=handle)
+        for table_name in evicted:
+            bq_client.drop_result_set(table_name)
+        return {**meta, "reused": False}
+
+    def get(self, handle: str) -> Optional[Dict[str, Any]]:
+        """Metadados do handle ainda válido (marca o uso), ou None."""
+        if not _HANDLE_RE.fullmatch(handle or ""):
+            return None
+        with self._lock:
+            meta = disk_cache.get(_NAMESPACE, handle)
+            if meta is None:
+                return None
+            now = time.time()
+            if meta["expires_at"] - _EXPIRY_MARGIN_SECONDS <= now:
+                disk_cache.delete(_NAMESPACE, handle)
+                return None
+            meta["last_used"] = now
+            disk_cache.put(_NAMESPACE, handle, meta)
+        return meta
+
+    def lease(self, handle: str) -> Optional[Dict[str, Any]]:
+        """Reserva o handle por _LEASE_SECONDS (chame de novo para renovar); None se não vale mais.
+
+        Se a tabela expiraria antes do fim da reserva, a validade dela é estendida por mais `ttl`.
+        """
+        meta = self.get(handle)
+        if meta is None:
+            return None
+        now = time.time()
+        leased_until = now + _LEASE_SECONDS
+        extend = meta["expires_at"] - _EXPIRY_MARGIN_SECONDS < leased_until
+        if extend:
+            bq_client.extend_result_set(meta["table"], self.ttl)
+        with self._lock:
+            current = disk_cache.get(_NAMESPACE, handle)
+            if current is None:
+                return None  # apagado enquanto isso
+            current["leased_until"] = max(current.get("leased_until", 0), leased_until)
+            if extend:
+                current["expires_at"] = now + self.ttl
+            disk_cache.put(_NAMESPACE, handle, current)
+        return current
+
+    def delete(self, handle: str) -> bool:
+        meta = self.get(handle)
+        if meta is None:
+            return False
+        with self._lock:
+            disk_cache.delete(_NAMESPACE, handle)
+        bq_client.drop_result_set(meta["table"])
+        return True
+
+    def _live(self) -> List[Dict[str, Any]]:
+        # chamado com self._lock; registros expirados saem (a tabela já expira sozinha)
+        now = time.time()
+        live = []
+        for handle in disk_cache.keys(_NAMESPACE):
+            meta = disk_cache.get(_NAMESPACE, handle)
+            if meta is None:
+                continue
+            if meta["expires_at"] <= now:
+                disk_cache.delete(_NAMESPACE, handle)
+            else:
+                live.append(meta)
+        return live
+
+    def _evict(self, keep: str) -> List[str]:
+        """Tira do registro os menos usados até caber em max_bytes; devolve as tabelas a apagar."""
+        live = sorted(self._live(), key=lambda m: m["last_used"])
+        total = sum(m["bytes"] for m in live)
+        now = time.time()
+        evicted = []
+        for meta in live:
+            if total <= self.max_bytes:
+                break
+            if meta["handle"] == keep or meta.get("leased_until", 0) > now:
+                continue
+            disk_cache.delete(_NAMESPACE, meta["handle"])
+            evicted.append(meta["table"])
+            total -= meta["bytes"]
+        return evicted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            live = self._live()
+        return {
+            "enabled": bq_client.RESULT_SETS_ENABLED,
+            "handles": len(live),
+            "bytes": sum(m["bytes"] for m in live),
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+        }
+
+
+result_sets = ResultSets()
@@ -0,0 +1,132 @@
+# backend/src/services/rollups.py
+"""
+Manutenção dos rollups HLL (sketches de veículos/clientes/DTCs distintos por dia)
+que ficam em BQ_DATASET e são lidos por bq_client.get_dtc_distinct_counts e
+get_customer_distinct_counts.
+
+    python -m src.services.rollups --days 90          # carga inicial (em blocos de dias)
+    python -m src.services.rollups --start 2026-01-01 --end 2026-03-31
+
+Desligado por padrão: cria tabelas e grava no dataset, então só roda com
+HLL_ROLLUPS_ENABLED=true (e BQ_DATASET). Cada carga registra os dias em
+bq_client.TBL_HLL_DAYS, e as leituras informam quantos dias do intervalo faltam.
+
+A API mantém os dias recentes em dia: a cada HLL_ROLLUP_REFRESH_SECONDS refaz os
+últimos HLL_ROLLUP_REFRESH_DAYS dias (mais HISTORY_SETTLE_DAYS). Dias mais antigos
+não mudam e não são relidos.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import bq_client
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# dias por script na carga inicial (cada bloco é uma transação)
+BACKFILL_CHUNK_DAYS = 7
+
+
+def _chunks(start: date, end: date, size: int) -> List[Tuple[date, date]]:
+    out = []
+    while start <= end:
+        chunk_end = min(end, start + timedelta(days=size - 1))
+        out.append((start, chunk_end))
+        start = chunk_end + timedelta(days=1)
+    return out
+
+
+def backfill(start: date, end: date, chunk_days: int = BACKFILL_CHUNK_DAYS) -> int:
+    """Recalcula [start, end] em blocos; devolve quantos blocos foram gravados."""
+    chunks = _chunks(start, end, max(1, chunk_days))
+    for i, (chunk_start, chunk_end) in enumerate(chunks, 1):
+        logger.info("Rollups HLL %s..%s (%s/%s)", chunk_start, chunk_end, i, len(chunks))
+        bq_client.refresh_hll_rollups(chunk_start, chunk_end)
+    return len(chunks)
+
+
+class RollupRefresher:
+    def __init__(
+        self,
+        interval: float = config.HLL_ROLLUP_REFRESH_SECONDS,
+        days: int = config.HLL_ROLLUP_REFRESH_DAYS,
+    ):
+        self.interval = float(interval)
+        self.days = max(1, int(days)) + config.HISTORY_SETTLE_DAYS
+        self.last_run: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        today = datetime.now(timezone.utc).date()
+        bq_client.refresh_hll_rollups(today - timedelta(days=self.days - 1), today)
+        self.last_run = datetime.now(timezone.utc)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None or self.interval <= 0 or not bq_client.HLL_ROLLUPS_ENABLED:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="hll-rollups", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop.set()
+            self._thread = None
+
+    def _run(self, stop: threading.Event) -> None:
+        while True:
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as exc:
+                logger.exception("Falha ao atualizar os rollups HLL")
+                self.last_error = str(exc) or exc.__class__.__name__
+            if stop.wait(self.interval):
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": bq_client.HLL_ROLLUPS_ENABLED,
+            "tables": [bq_client.TBL_HLL_DTC, bq_client.TBL_HLL_CUSTOMER, bq_client.TBL_HLL_DAYS] if bq_client.HLL_ROLLUPS_ENABLED else [],
+            "refresh_days": self.days,
+            "interval_seconds": self.interval,
+            "running": self._thread is not None,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_error": self.last_error,
+        }
+
+
+rollup_refresher = RollupRefresher()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Carga/recálculo dos rollups HLL de DTC (BQ_DATASET).")
+    parser.add_argument("--days", type=int, default=90, help="últimos N dias até hoje")
+    parser.add_argument("--start", type=date.fromisoformat, help="primeiro dia (AAAA-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="último dia (padrão: hoje)")
+    parser.add_argument("--chunk-days", type=int, default=BACKFILL_CHUNK_DAYS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not bq_client.HLL_ROLLUPS_ENABLED:
+        print("Defina HLL_ROLLUPS_ENABLED=true e BQ_DATASET para gravar os rollups.", file=sys.stderr)
+        return 2
+
+    end = args.end or datetime.now(timezone.utc).date()
+    start = args.start or end - timedelta(days=max(1, args.days) - 1)
+    backfill(start, end, args.chunk_days)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
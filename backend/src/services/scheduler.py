@@ -0,0 +1,196 @@
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from . import config
+
+# --------------------------------------------------------------------------
+# Escalonador de consultas ao BigQuery (fair share).
+# Limita as consultas simultâneas do processo (BQ_MAX_CONCURRENT) e as de cada
+# chamador (BQ_CALLER_MAX_CONCURRENT). O chamador vem do header X-User, do token
+# ou do IP. Quem espera entra numa fila ordenada por classe de prioridade:
+# consultas pontuais de veículo > dashboards > exportações/lotes. Dentro de cada
+# classe, a ordem é de chegada. Um chamador no seu limite não bloqueia os que vêm
+# atrás. Quem passou de BQ_CALLER_BYTES_PER_WINDOW bytes lidos na janela
+# (BQ_BUDGET_WINDOW_SECONDS) continua sendo atendido, mas na classe mais baixa.
+# Esperar mais que BQ_QUEUE_TIMEOUT_SECONDS dá QueryQueueTimeout (a API responde 429).
+# --------------------------------------------------------------------------
+INTERACTIVE = "interactive"
+DASHBOARD = "dashboard"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, DASHBOARD, BATCH)
+
+
+class QueryQueueTimeout(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Fila de consultas cheia")
+        self.retry_after = retry_after
+
+
+# estado do pedido atual: chamador e tempo total na fila (preenchido pelo escalonador)
+_request: ContextVar[Optional[Dict[str, Any]]] = ContextVar("bq_request", default=None)
+# rebaixa a prioridade de tudo o que roda dentro do bloco (ex.: atualização em segundo plano)
+_priority_cap: ContextVar[Optional[str]] = ContextVar("bq_priority_cap", default=None)
+
+
+@contextmanager
+def caller_context(caller: Optional[str]) -> Iterator[Dict[str, Any]]:
+    state: Dict[str, Any] = {"caller": caller, "wait_seconds": 0.0}
+    token = _request.set(state)
+    try:
+        yield state
+    finally:
+        _request.reset(token)
+
+
+@contextmanager
+def priority_cap(priority: str) -> Iterator[None]:
+    token = _priority_cap.set(priority)
+    try:
+        yield
+    finally:
+        _priority_cap.reset(token)
+
+
+def _lowest(*priorities: Optional[str]) -> str:
+    return PRIORITIES[max(PRIORITIES.index(p) for p in priorities if p)]
+
+
+class _Ticket:
+    __slots__ = ("order", "caller", "priority")
+
+    def __init__(self, order: Tuple[int, int], caller: Optional[str], priority: str):
+        self.order = order
+        self.caller = caller
+        self.priority = priority
+
+
+class QueryScheduler:
+    def __init__(
+        self,
+        max_concurrent: int = config.BQ_MAX_CONCURRENT,
+        caller_max_concurrent: int = config.BQ_CALLER_MAX_CONCURRENT,
+        caller_bytes_per_window: int = config.BQ_CALLER_BYTES_PER_WINDOW,
+        budget_window: float = config.BQ_BUDGET_WINDOW_SECONDS,
+        queue_timeout: float = config.BQ_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.caller_max_concurrent = max(1, int(caller_max_concurrent))
+        self.caller_bytes_per_window = int(caller_bytes_per_window)
+        self.budget_window = float(budget_window)
+        self.queue_timeout = float(queue_timeout)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._running = 0
+        self._running_by: Dict[str, int] = {}
+        self._bytes_by: Dict[str, Deque[Tuple[float, int]]] = {}
+        self._avg_wait = {p: 0.0 for p in PRIORITIES}
+        self._counters = {"scheduled": 0, "queued": 0, "demoted": 0, "timeouts": 0}
+
+    # ------------------------------ orçamento -------------------------------
+    def _spent(self, caller: str, now: float) -> int:
+        window = self._bytes_by.get(caller)
+        while window and window[0][0] < now - self.budget_window:
+            window.popleft()
+        if not window:
+            self._bytes_by.pop(caller, None)
+            return 0
+        return sum(n for _, n in window)
+
+    def record_bytes(self, total_bytes: Optional[int]) -> None:
+        """Soma os bytes lidos por uma consulta ao orçamento do chamador atual."""
+        state = _request.get()
+        caller = state["caller"] if state else None
+        if caller is None or not total_bytes:
+            return
+        with self._cond:
+            self._bytes_by.setdefault(caller, deque()).append((time.monotonic(), int(total_bytes)))
+
+    # ------------------------------- fila -----------------------------------
+    def _runnable(self, ticket: _Ticket) -> bool:
+        if self._running >= self.max_concurrent:
+            return False
+        for waiting in self._waiting:
+            if waiting.caller is None or self._running_by.get(waiting.caller, 0) < self.caller_max_concurrent:
+                return waiting is ticket
+        return False
+
+    def _retry_after(self) -> int:
+        return max(1, min(60, int(self._avg_wait[BATCH] or self.queue_timeout)))
+
+    @contextmanager
+    def slot(self, priority: str = INTERACTIVE) -> Iterator[None]:
+        """Ocupa uma vaga de consulta (esperando na fila, se for o caso) durante o bloco."""
+        state = _request.get()
+        caller = state["caller"] if state else None
+        started = time.monotonic()
+        with self._cond:
+            effective = _lowest(priority, _priority_cap.get())
+            if caller is not None and self._spent(caller, started) >= self.caller_bytes_per_window:
+                effective = BATCH
+                self._counters["demoted"] += 1
+            ticket = _Ticket((PRIORITIES.index(effective), next(self._seq)), caller, effective)
+            self._waiting.append(ticket)
+            self._waiting.sort(key=lambda t: t.order)
+            deadline = started + self.queue_timeout
+            if not self._runnable(ticket):
+                self._counters["queued"] += 1
+            while not self._runnable(ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._counters["timeouts"] += 1
+                    self._cond.notify_all()
+                    raise QueryQueueTimeout(self._retry_after())
+                self._cond.wait(remaining)
+            self._waiting.remove(ticket)
+            self._running += 1
+            if caller is not None:
+                self._running_by[caller] = self._running_by.get(caller, 0) + 1
+            waited = time.monotonic() - started
+            self._avg_wait[effective] = 0.8 * self._avg_wait[effective] + 0.2 * waited
+            self._counters["scheduled"] += 1
+            self._cond.notify_all()
+        if state is not None:
+            state["wait_seconds"] += waited
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                if caller is not None:
+                    self._running_by[caller] -= 1
+                    if not self._running_by[caller]:
+                        del self._running_by[caller]
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            callers = set(self._running_by) | set(self._bytes_by) | {t.caller for t in self._waiting if t.caller}
+            return {
+                "max_concurrent": self.max_concurrent,
+                "caller_max_concurrent": self.caller_max_concurrent,
+                "running": self._running,
+                "waiting": {p: sum(1 for t in self._waiting if t.priority == p) for p in PRIORITIES},
+                "avg_wait_seconds": {p: round(w, 3) for p, w in self._avg_wait.items()},
+                **self._counters,
+                "callers": {
+                    caller: {
+                        "running": self._running_by.get(caller, 0),
+                        "waiting": sum(1 for t in self._waiting if t.caller == caller),
+                        "bytes_in_window": self._spent(caller, now),
+                        "over_budget": self._spent(caller, now) >= self.caller_bytes_per_window,
+                    }
+                    for caller in sorted(callers)
+                },
+            }
+
+
+scheduler = QueryScheduler()
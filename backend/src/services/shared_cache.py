@@ -0,0 +1,295 @@
+# backend/src/services/shared_cache.py
+"""
+Cache compartilhado entre os workers do uvicorn no mesmo host (SQLite em modo WAL,
+com leitura via mmap). Um arquivo só, CACHE_DIR/shared_cache.sqlite3. Assim um
+resultado consultado por um worker serve aos outros e sobrevive a um restart.
+
+- Valores são serializados com pickle e, acima de 1 KB, comprimidos com zlib.
+  O arquivo é local e só o próprio serviço grava nele.
+- Cada escrita é uma transação do SQLite, então leitores nunca veem valor parcial.
+- O tamanho do banco (páginas em uso) é limitado a SHARED_CACHE_MAX_BYTES e é
+  conferido a cada escrita: os expirados saem primeiro, depois os acessados há mais
+  tempo. As páginas liberadas são reaproveitadas, então o arquivo não cresce além disso. SHARED_CACHE_MAX_BYTES=0 desliga o cache
+  (get devolve o default e set não faz nada).
+- Falha no SQLite nunca derruba o pedido: vira miss e fica registrada no log.
+
+Usado pelo bq_client (resolução de veículos e último resultado bom de cada consulta)
+e pelo cache stale-while-revalidate dos dashboards (src/services/warm_cache.py).
+"""
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+_COMPRESS_MIN_BYTES = 1024
+_PLAIN, _ZLIB = b"p", b"z"
+# o acesso só é regravado se o último tiver mais que isso (leitura quase sem escrita)
+_TOUCH_SECONDS = 60.0
+# entradas removidas por vez ao liberar espaço
+_EVICT_BATCH = 64
+# ao passar do limite, libera até ficar nesta fração dele
+_EVICT_TARGET = 0.9
+# um valor maior que esta fração do limite não é guardado
+_MAX_ENTRY_FRACTION = 0.125
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+  namespace TEXT NOT NULL,
+  key TEXT NOT NULL,
+  value BLOB NOT NULL,
+  size INTEGER NOT NULL,
+  expires_at REAL NOT NULL,
+  accessed_at REAL NOT NULL,
+  PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+"""
+
+
+def dumps(value: Any) -> bytes:
+    raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(raw) >= _COMPRESS_MIN_BYTES:
+        return _ZLIB + zlib.compress(raw, 1)
+    return _PLAIN + raw
+
+
+def loads(blob: bytes) -> Any:
+    tag, body = blob[:1], blob[1:]
+    return pickle.loads(zlib.decompress(body) if tag == _ZLIB else body)
+
+
+class SharedCache:
+    def __init__(
+        self,
+        path: str = os.path.join(config.CACHE_DIR, "shared_cache.sqlite3"),
+        max_bytes: int = config.SHARED_CACHE_MAX_BYTES,
+    ):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0, "errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _db(self) -> sqlite3.Connection:
+        # uma conexão por thread e por processo (o worker pode ter sido criado por fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={max(0, self.max_bytes)}")
+        conn.executescript(_SCHEMA)
+        self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    def _failed(self, action: str) -> None:
+        self._count("errors")
+        logger.warning("Cache compartilhado: falha ao %s", action, exc_info=True)
+
+    # ------------------------------ leitura ---------------------------------
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        found = self.get_many(namespace, [key])
+        return found[key] if key in found else default
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """{chave: valor} só das chaves presentes e válidas."""
+        keys = list(dict.fromkeys(keys))
+        if not self.enabled or not keys:
+            return {}
+        now = time.time()
+        found: Dict[str, Any] = {}
+        try:
+            conn = self._db()
+            rows = conn.execute(
+                f"SELECT key, value, accessed_at FROM entries WHERE namespace = ? AND key IN ({','.join('?' * len(keys))})"
+                " AND expires_at > ?",
+                [namespace, *keys, now],
+            ).fetchall()
+            stale = [k for k, _, accessed_at in rows if now - accessed_at > _TOUCH_SECONDS]
+            if stale:
+                conn.execute(
+                    f"UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key IN ({','.join('?' * len(stale))})",
+                    [now, namespace, *stale],
+                )
+            for k, blob, _ in rows:
+                found[k] = loads(blob)
+        except (sqlite3.Error, pickle.UnpicklingError, zlib.error, EOFError):
+            self._failed("ler")
+            return {}
+        self._count("hits", len(found))
+        self._count("misses", len(keys) - len(found))
+        return found
+
+    # ------------------------------ escrita ---------------------------------
+    def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        self.set_many(namespace, {key: value}, ttl)
+
+    def set_many(self, namespace: str, items: Dict[str, Any], ttl: float) -> None:
+        if not self.enabled or not items:
+            return
+        now = time.time()
+        limit = self.max_bytes * _MAX_ENTRY_FRACTION
+        try:
+            rows = []
+            for key, value in items.items():
+                blob = dumps(value)
+                if len(blob) <= limit:
+                    rows.append((namespace, key, blob, len(blob), now + ttl, now))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            self._failed("serializar")
+            return
+        if not rows:
+            return
+        try:
+            conn = self._db()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error:
+            self._failed("gravar")
+            return
+        self._count("writes", len(rows))
+        try:
+            over = self._used_bytes(conn) > self.max_bytes
+        except sqlite3.Error:
+            self._failed("medir o tamanho")
+            return
+        if over:
+            self.evict()
+
+    def get_or_set(self, namespace: str, key: str, factory: Callable[[], Any], ttl: float) -> Any:
+        """Valor em cache ou `factory()` (guardado; None não é guardado)."""
+        value = self.get(namespace, key, MISSING)
+        if value is MISSING:
+            value = factory()
+            if value is not None:
+                self.set(namespace, key, value, ttl)
+        return value
+
+    def update(self, namespace: str, key: str, fn: Callable[[Any], Any], ttl: float) -> Any:
+        """
+        Grava `fn(valor atual ou MISSING)` numa transação só: escritas de outros workers
+        na mesma chave esperam e não se perdem. Devolve o valor gravado (MISSING se o
+        cache estiver desligado ou o SQLite falhar).
+        """
+        if not self.enabled:
+            return MISSING
+        now = time.time()
+        try:
+            conn = self._db()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                    (namespace, key, now),
+                ).fetchone()
+                value = fn(loads(row[0]) if row else MISSING)
+                blob = dumps(value)
+                if len(blob) > self.max_bytes * _MAX_ENTRY_FRACTION:
+                    return MISSING
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, key, blob, len(blob), now + ttl, now),
+                )
+        except (sqlite3.Error, pickle.PickleError, zlib.error, EOFError, TypeError, AttributeError):
+            self._failed("atualizar")
+            return MISSING
+        self._count("writes")
+        try:
+            over = self._used_bytes(conn) > self.max_bytes
+        except sqlite3.Error:
+            self._failed("medir o tamanho")
+            return value
+        if over:
+            self.evict()
+        return value
+
+    def delete(self, namespace: str, key: str) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._db().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error:
+            self._failed("remover")
+
+    # ------------------------------ eviction --------------------------------
+    @staticmethod
+    def _used_bytes(conn: sqlite3.Connection) -> int:
+        # páginas em uso (sem as livres): O(1), não depende do número de entradas
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0] - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return pages * page_size
+
+    def evict(self) -> int:
+        """Remove expirados e, enquanto passar de _EVICT_TARGET do limite, os acessados há mais tempo."""
+        if not self.enabled:
+            return 0
+        target = int(self.max_bytes * _EVICT_TARGET)
+        try:
+            conn = self._db()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                removed = conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),)).rowcount
+                while self._used_bytes(conn) > target:
+                    deleted = conn.execute(
+                        "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY accessed_at LIMIT ?)",
+                        (_EVICT_BATCH,),
+                    ).rowcount
+                    if not deleted:
+                        break
+                    removed += deleted
+        except sqlite3.Error:
+            self._failed("liberar espaço")
+            return 0
+        self._count("evicted", removed)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        out: Dict[str, Any] = {"enabled": self.enabled, "path": self.path, "max_bytes": self.max_bytes, **counters}
+        if not self.enabled:
+            return out
+        try:
+            rows = self._db().execute(
+                "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY namespace"
+            ).fetchall()
+        except sqlite3.Error:
+            self._failed("ler estatísticas")
+            return out
+        out["namespaces"] = {ns: {"entries": n, "bytes": size} for ns, n, size in rows}
+        out["bytes"] = sum(size for _, _, size in rows)
+        return out
+
+    def count(self, namespace: str) -> int:
+        return self.stats().get("namespaces", {}).get(namespace, {}).get("entries", 0)
+
+
+shared_cache = SharedCache()
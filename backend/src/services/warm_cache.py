@@ -0,0 +1,376 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import config
+from . import disk_cache
+from .bq_client import BigQueryUnavailable
+from .breaker import degradation, report_stale
+from .scheduler import BATCH, priority_cap
+from .shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Cache stale-while-revalidate para as consultas quentes dos dashboards.
+# Cada entrada guarda a função do bq_client e os argumentos usados, então dá
+# para recalcular sem o pedido original. Até SWR_FRESH_SECONDS o resultado é
+# servido direto. Até SWR_MAX_STALE_SECONDS ele ainda é servido na hora e a
+# atualização roda em segundo plano. Depois disso, a consulta volta a ser síncrona.
+# Um aquecedor (thread) conta os acessos por chave, com decaimento. A cada
+# WARM_INTERVAL_SECONDS ele atualiza as WARM_TOP_N mais pedidas e as visões fixas
+# (ex.: a tela padrão de cada página), para que elas nunca esfriem. Sem pedidos há
+# mais de WARM_IDLE_SECONDS, o ciclo não consulta nada. O aquecedor só roda entre
+# start() e stop() (a API chama no lifespan), e só no worker líder.
+# Por isso os acessos de todos os workers vão para um ranking no cache compartilhado
+# (somados a cada _FLUSH_SECONDS): o líder ordena e decide se está ocioso pelo
+# tráfego do host inteiro, não só pelo que ele mesmo atendeu.
+# Cada resultado também vai para o cache compartilhado (src/services/shared_cache.py).
+# Um worker que ainda não tem a chave, ou que vai atualizá-la, usa antes o que
+# outro worker já consultou, se estiver dentro da idade aceita.
+# --------------------------------------------------------------------------
+Query = Tuple[Callable[..., Any], Dict[str, Any]]
+
+# peso dos acessos antigos a cada ciclo do aquecedor (meia-vida de ~30 ciclos)
+_DECAY = 0.977
+_SHARED = "swr"
+# ranking de acessos de todos os workers: {"at": último acesso, "queries": {chave: [fn, kwargs, hits, at]}}
+_ACCESS = "swr_access"
+_RANKING = "ranking"
+_RANKING_TTL = 86400.0
+# cada worker soma os seus acessos ao ranking no máximo uma vez a cada tanto
+_FLUSH_SECONDS = 10.0
+
+
+class _Entry:
+    __slots__ = ("fn", "kwargs", "value", "fetched_at", "hits")
+
+    def __init__(self, fn: Callable[..., Any], kwargs: Dict[str, Any]):
+        self.fn = fn
+        self.kwargs = kwargs
+        self.value: Any = None
+        self.fetched_at: Optional[float] = None
+        self.hits = 0.0
+
+    def age(self) -> Optional[float]:
+        return None if self.fetched_at is None else time.monotonic() - self.fetched_at
+
+
+class WarmCache:
+    def __init__(
+        self,
+        fresh_seconds: float = config.SWR_FRESH_SECONDS,
+        max_stale_seconds: float = config.SWR_MAX_STALE_SECONDS,
+        top_n: int = config.WARM_TOP_N,
+        interval: float = config.WARM_INTERVAL_SECONDS,
+        idle_seconds: float = config.WARM_IDLE_SECONDS,
+        maxsize: int = 256,
+    ):
+        self.fresh_seconds = float(fresh_seconds)
+        self.max_stale_seconds = max(self.fresh_seconds, float(max_stale_seconds))
+        self.top_n = max(0, int(top_n))
+        self.interval = float(interval)
+        self.idle_seconds = float(idle_seconds)
+        self.maxsize = max(1, int(maxsize))
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._pinned: List[Callable[[], Iterable[Query]]] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="warm")
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_access: Optional[float] = None  # time.time(): comparado com o dos outros workers
+        self._pending: Dict[str, List[Any]] = {}  # acessos ainda não somados ao ranking: {chave: [fn, kwargs, hits]}
+        self._flushed_at = float("-inf")
+        self._counters = {"fresh": 0, "stale": 0, "miss": 0, "refreshes": 0, "errors": 0}
+
+    @staticmethod
+    def _key(fn: Callable[..., Any], kwargs: Dict[str, Any]) -> str:
+        return disk_cache.make_key(fn=fn.__name__, **kwargs)
+
+    # ------------------------------ leitura ---------------------------------
+    def get(self, fn: Callable[..., Any], **kwargs: Any) -> Tuple[Any, str, float]:
+        """
+        Resultado de `fn(**kwargs)` como (valor, estado, idade em segundos).
+        O estado é "fresh", "stale" (servido enquanto atualiza) ou "miss" (consultado agora).
+        """
+        key = self._key(fn, kwargs)
+        with self._lock:
+            self._last_access = time.time()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(fn, kwargs)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            age = entry.age()
+            self._pending.setdefault(key, [fn, kwargs, 0.0])[2] += 1
+            flush = time.monotonic() - self._flushed_at >= _FLUSH_SECONDS
+            if flush:
+                self._flushed_at = time.monotonic()
+        if flush:
+            self._executor.submit(self._flush)
+        if age is None and self._adopt_shared(key, entry, self.max_stale_seconds):
+            age = entry.age()
+        with self._lock:
+            value = entry.value
+
+        if age is not None and age <= self.fresh_seconds:
+            self._count("fresh")
+            return value, "fresh", age
+        if age is not None and age <= self.max_stale_seconds:
+            self._count("stale")
+            self._refresh_async(key, entry)
+            return value, "stale", age
+
+        self._count("miss")
+        try:
+            with degradation() as degraded:
+                value = self._refresh(key, entry).result()
+        except BigQueryUnavailable:
+            if age is None:
+                raise
+            # passou do limite de idade, mas é melhor que um erro enquanto o BigQuery não volta
+            report_stale(age)
+            return value, "stale", age
+        if degraded["stale"]:
+            report_stale(degraded["age"])
+            return value, "stale", degraded["age"]
+        return value, "miss", 0.0
+
+    # ---------------------------- atualização -------------------------------
+    def _adopt_shared(self, key: str, entry: _Entry, max_age: float) -> bool:
+        """Usa o resultado de outro worker se for mais novo que o local e tiver até `max_age`."""
+        shared = shared_cache.get(_SHARED, key)
+        if shared is None:
+            return False
+        stored_at, value = shared
+        age = max(0.0, time.time() - stored_at)
+        with self._lock:
+            current = entry.age()
+            if age > max_age or (current is not None and current <= age):
+                return False
+            entry.value = value
+            entry.fetched_at = time.monotonic() - age
+        return True
+
+    def _refresh(self, key: str, entry: _Entry) -> Future:
+        """Executa a consulta na thread atual; chamadas concorrentes da mesma chave esperam por ela."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._inflight[key] = Future()
+
+        if self._adopt_shared(key, entry, self.fresh_seconds):
+            # outro worker acabou de consultar
+            with self._lock:
+                self._inflight.pop(key, None)
+                future.set_result(entry.value)
+            return future
+
+        try:
+            with degradation() as degraded:
+                value = entry.fn(**entry.kwargs)
+        except BaseException as exc:
+            self._count("errors")
+            future.set_exception(exc)
+        else:
+            if degraded["stale"]:
+                # o bq_client devolveu o último resultado bom: não conta como atualização
+                report_stale(degraded["age"])
+                self._count("errors")
+            else:
+                with self._lock:
+                    entry.value = value
+                    entry.fetched_at = time.monotonic()
+                    self._counters["refreshes"] += 1
+                shared_cache.set(_SHARED, key, (time.time(), value), self.max_stale_seconds)
+            future.set_result(value)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return future
+
+    def _refresh_async(self, key: str, entry: _Entry) -> None:
+        with self._lock:
+            if key in self._inflight:
+                return
+
+        def job() -> None:
+            with priority_cap(BATCH):
+                future = self._refresh(key, entry)
+            if future.exception() is not None:
+                # mantém o valor antigo; a próxima leitura tenta de novo
+                logger.warning("Falha ao atualizar %s em segundo plano", entry.fn.__name__, exc_info=future.exception())
+
+        self._executor.submit(job)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    # ------------------------- ranking compartilhado -------------------------
+    def _decayed(self, hits: float, since: float, now: float) -> float:
+        # mesmo decaimento do ranking local: _DECAY por ciclo do aquecedor
+        return hits * _DECAY ** (max(0.0, now - since) / max(1.0, self.interval))
+
+    def _flush(self) -> None:
+        """Soma os acessos deste worker ao ranking compartilhado."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            last = self._last_access
+        if not pending and last is None:
+            return
+        now = time.time()
+
+        def merge(current: Any) -> Dict[str, Any]:
+            table = current if isinstance(current, dict) else {"at": 0.0, "queries": {}}
+            queries = {
+                key: [fn, kwargs, self._decayed(hits, at, now), now]
+                for key, (fn, kwargs, hits, at) in table["queries"].items()
+            }
+            for key, (fn, kwargs, hits) in pending.items():
+                queries.setdefault(key, [fn, kwargs, 0.0, now])[2] += hits
+            top = sorted(queries.items(), key=lambda item: item[1][2], reverse=True)[: self.maxsize]
+            return {"at": max(table["at"], last or 0.0), "queries": dict(top)}
+
+        shared_cache.update(_ACCESS, _RANKING, merge, _RANKING_TTL)
+
+    def _ranking(self) -> List[Tuple[str, _Entry, float]]:
+        """(chave, entrada, acessos) do host inteiro; sem cache compartilhado, só os deste worker."""
+        table = shared_cache.get(_ACCESS, _RANKING)
+        if table is None:
+            with self._lock:
+                return [(key, entry, entry.hits) for key, entry in self._entries.items()]
+        now = time.time()
+        ranked = []
+        for key, (fn, kwargs, hits, at) in table["queries"].items():
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = _Entry(fn, kwargs)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+            ranked.append((key, entry, self._decayed(hits, at, now)))
+        return ranked
+
+    # ------------------------------ aquecedor -------------------------------
+    def pin(self, queries: Callable[[], Iterable[Query]]) -> None:
+        """
+        Registra visões para manter sempre aquecidas. `queries` é chamada a cada ciclo,
+        então pode depender da data (ex.: "últimos 7 dias até hoje").
+        """
+        with self._lock:
+            if queries not in self._pinned:
+                self._pinned.append(queries)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None or self.interval <= 0:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="warm-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop.set()
+            self._thread = None
+        self._flush()
+
+    def idle(self) -> bool:
+        """Sem pedidos em nenhum worker há mais de WARM_IDLE_SECONDS."""
+        with self._lock:
+            last = self._last_access
+        table = shared_cache.get(_ACCESS, _RANKING)
+        if table is not None:
+            last = max(last or 0.0, table["at"]) or None
+        return last is None or time.time() - last > self.idle_seconds
+
+    def _targets(self) -> List[Tuple[str, _Entry]]:
+        with self._lock:
+            pinned = list(self._pinned)
+        targets: Dict[str, _Entry] = {}
+        for queries in pinned:
+            try:
+                items = list(queries())
+            except Exception:
+                logger.exception("Falha ao montar as visões fixas do aquecedor")
+                continue
+            for fn, kwargs in items:
+                key = self._key(fn, kwargs)
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is None:
+                        entry = self._entries[key] = _Entry(fn, kwargs)
+                targets[key] = entry
+
+        with self._lock:
+            for entry in self._entries.values():
+                entry.hits *= _DECAY
+        self._flush()
+        ranked = sorted(self._ranking(), key=lambda item: item[2], reverse=True)
+        for key, entry, hits in ranked[: self.top_n]:
+            if hits < 1:
+                break
+            # só o que já deu certo alguma vez, aqui ou em outro worker
+            # (filtro inválido não vira consulta periódica)
+            if entry.fetched_at is not None or self._adopt_shared(key, entry, self.max_stale_seconds):
+                targets.setdefault(key, entry)
+        return list(targets.items())
+
+    def warm(self) -> int:
+        """Atualiza as visões fixas e as mais pedidas que já passaram de um ciclo de idade."""
+        if self.idle():
+            return 0
+        refreshed = 0
+        for key, entry in self._targets():
+            age = entry.age()
+            if age is not None and age < self.interval:
+                continue
+            with priority_cap(BATCH):
+                future = self._refresh(key, entry)
+            if future.exception() is None:
+                refreshed += 1
+            else:
+                logger.warning("Falha ao aquecer %s", entry.fn.__name__)
+        return refreshed
+
+    def _run(self, stop: threading.Event) -> None:
+        while True:
+            try:
+                self.warm()
+            except Exception:
+                logger.exception("Falha no ciclo do aquecedor de cache")
+            if stop.wait(self.interval):
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e.hits, reverse=True)
+            top = [
+                {
+                    "query": e.fn.__name__,
+                    "params": {k: str(v) if v is not None else None for k, v in e.kwargs.items()},
+                    "hits": round(e.hits, 2),
+                    "age_seconds": round(e.age(), 1) if e.fetched_at is not None else None,
+                }
+                for e in entries[: self.top_n]
+            ]
+            return {
+                "entries": len(self._entries),
+                "pinned": len(self._pinned),
+                "running": self._thread is not None,
+                "fresh_seconds": self.fresh_seconds,
+                "max_stale_seconds": self.max_stale_seconds,
+                **self._counters,
+                "top": top,
+            }
+
+
+warm_cache = WarmCache()
@@ -0,0 +1,27 @@
+# backend/tests/conftest.py
+"""
+Configuração comum dos testes: `src` importável a partir de backend/ e CACHE_DIR
+num diretório temporário (os módulos de cache leem o config na importação).
+O bq_client cria o cliente do BigQuery na importação; aqui ele é importado uma vez
+com o cliente trocado por um mock (sem credenciais), e cada teste troca as funções
+de consulta que usa.
+"""
+import os
+import sys
+import tempfile
+from unittest import mock
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="backend-tests-"))
+
+try:
+    from google.cloud import bigquery
+except ImportError:  # pragma: no cover - testes que usam o bq_client são pulados
+    bigquery = None
+
+if bigquery is not None:
+    with mock.patch.object(bigquery, "Client"):
+        import src.services.bq_client  # noqa: F401
@@ -0,0 +1,123 @@
+# backend/tests/test_analytics.py
+from collections import Counter
+from datetime import date
+
+from src.services.analytics import _Aggregate
+
+
+def day_index(total_windows, dtcs):
+    """Mesmo formato de bq_client.get_dtc_day_index (pares só com other > dtc)."""
+    return {"total_windows": total_windows, "dtcs": dtcs}
+
+
+DAY1 = date(2024, 5, 1)
+DAY2 = date(2024, 5, 2)
+
+INDEX1 = day_index(
+    10,
+    {
+        "P0001": {
+            "description": "Sensor A",
+            "events": 7,
+            "windows": 3,
+            "vehicles": ["v1", "v2"],
+            "customers": ["c1"],
+            "pairs": {"P0002": [2, 1]},
+        },
+        "P0002": {"description": None, "events": 2, "windows": 2, "vehicles": ["v1"], "customers": ["c1"], "pairs": {}},
+    },
+)
+INDEX2 = day_index(
+    4,
+    {
+        "P0001": {"description": "Sensor A", "events": 1, "windows": 1, "vehicles": ["v3"], "customers": ["c2"], "pairs": {}},
+        "P0003": {
+            "description": "Sensor C",
+            "events": 5,
+            "windows": 2,
+            "vehicles": ["v1"],
+            "customers": ["c1"],
+            "pairs": {"P0004": [1, 1]},
+        },
+        "P0004": {"description": None, "events": 1, "windows": 1, "vehicles": ["v1"], "customers": ["c1"], "pairs": {}},
+    },
+)
+
+
+def counters(agg):
+    return {
+        "total_windows": agg.total_windows,
+        "events": agg.events,
+        "windows": agg.windows,
+        "day_counts": agg.day_counts,
+        "vehicles": agg.vehicles,
+        "customers": agg.customers,
+        "pairs": agg.pairs,
+        "pair_vehicle_days": agg.pair_vehicle_days,
+        "descriptions": agg.descriptions,
+        "days": agg.days,
+    }
+
+
+def empty():
+    return counters(_Aggregate(60, 30))
+
+
+def test_add_then_remove_returns_every_counter_to_zero():
+    agg = _Aggregate(60, 30)
+    agg.add(DAY1, INDEX1)
+    agg.remove(DAY1)
+    assert counters(agg) == empty()
+
+
+def test_add_two_days_then_remove_both():
+    agg = _Aggregate(60, 30)
+    agg.add(DAY1, INDEX1)
+    agg.add(DAY2, INDEX2)
+    agg.remove(DAY2)
+    agg.remove(DAY1)
+    assert counters(agg) == empty()
+
+
+def test_sums_across_days():
+    agg = _Aggregate(60, 30)
+    agg.add(DAY1, INDEX1)
+    agg.add(DAY2, INDEX2)
+    assert agg.total_windows == 14
+    assert agg.events["P0001"] == 8
+    assert agg.day_counts["P0001"] == 2
+    assert agg.vehicles["P0001"] == Counter({"v1": 1, "v2": 1, "v3": 1})
+    assert set(agg.customers["P0001"]) == {"c1", "c2"}
+    # pares ficam simétricos
+    assert agg.pairs["P0001"]["P0002"] == agg.pairs["P0002"]["P0001"] == 2
+    assert agg.pair_vehicle_days["P0004"]["P0003"] == 1
+    assert agg.descriptions == {"P0001": "Sensor A", "P0003": "Sensor C"}
+
+
+def test_removing_one_day_leaves_exactly_the_other():
+    agg = _Aggregate(60, 30)
+    agg.add(DAY1, INDEX1)
+    agg.add(DAY2, INDEX2)
+    agg.remove(DAY1)
+
+    only = _Aggregate(60, 30)
+    only.add(DAY2, INDEX2)
+    assert counters(agg) == counters(only)
+
+
+def test_re_adding_a_day_replaces_it():
+    agg = _Aggregate(60, 30)
+    agg.add(DAY1, INDEX1)
+    agg.add(DAY1, INDEX2)  # dia de hoje reconsultado
+
+    only = _Aggregate(60, 30)
+    only.add(DAY1, INDEX2)
+    assert counters(agg) == counters(only)
+
+
+def test_removing_unknown_day_is_noop():
+    agg = _Aggregate(60, 30)
+    agg.add(DAY1, INDEX1)
+    before = {k: (dict(v) if isinstance(v, dict) else v) for k, v in counters(agg).items()}
+    agg.remove(DAY2)
+    assert counters(agg) == before
@@ -0,0 +1,70 @@
+# backend/tests/test_assistant_api.py
+import pytest
+
+pytest.importorskip("agno")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from src.agent import answers  # noqa: E402
+from src.api import main  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def freshness_calls(monkeypatch):
+    """Chaves calculadas (cada uma custaria a consulta do último evento)."""
+    calls = []
+
+    def answer_key(prompt, **context):
+        calls.append(prompt)
+        return "chave"
+
+    monkeypatch.setattr(answers, "answer_key", answer_key)
+    return calls
+
+
+@pytest.fixture
+def full_pool(monkeypatch):
+    held = []
+    monkeypatch.setattr(main.agent_pool, "max_queue", 0)
+    for _ in range(main.agent_pool.size):
+        held.append(main.agent_pool.admit())
+    yield
+    for admission in held:
+        admission.release()
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/assistant/ask", {"prompt": "status do ABC1234"}),
+        ("/assistant/ask/stream", {"prompt": "status do ABC1234"}),
+        ("/chat", {"message": "status", "vehicle_key": "ABC1234"}),
+        ("/chat/stream", {"message": "status", "vehicle_key": "ABC1234"}),
+    ],
+)
+def test_rejected_request_does_not_compute_answer_key(client, freshness_calls, full_pool, path, body):
+    res = client.post(path, json=body)
+    assert res.status_code == 429
+    assert res.headers["retry-after"]
+    assert freshness_calls == []
+
+
+def test_cache_hit_returns_the_reserved_slot(client, freshness_calls, monkeypatch):
+    monkeypatch.setattr(answers, "get_answer", lambda key: "resposta guardada")
+    res = client.post("/assistant/ask", json={"prompt": "status do ABC1234"})
+    assert res.status_code == 200
+    assert res.headers["x-answer-cache"] == "hit"
+    assert res.json()["answer"] == "resposta guardada"
+    assert freshness_calls == ["status do ABC1234"]
+    stats = main.agent_pool.stats()
+    assert stats["active"] == 0 and stats["queued"] == 0
+    # nenhum lugar ficou preso: dá para reservar o pool inteiro de novo
+    held = [main.agent_pool.admit() for _ in range(main.agent_pool.size + main.agent_pool.max_queue)]
+    for admission in held:
+        admission.release()
@@ -0,0 +1,150 @@
+# backend/tests/test_breaker.py
+import pytest
+
+from src.services import breaker as breaker_module
+from src.services.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, degradation, report_stale
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(breaker_module.time, "monotonic", fake)
+    return fake
+
+
+def make(**overrides):
+    params = dict(window=10, min_calls=4, failure_rate=0.5, slow_seconds=5, open_seconds=30, half_open_probes=1)
+    params.update(overrides)
+    return CircuitBreaker("teste", **params)
+
+
+def call(cb, ok=True, elapsed=0.1):
+    cb.allow()
+    cb.record(ok, elapsed)
+
+
+def test_stays_closed_below_min_calls(clock):
+    cb = make()
+    for _ in range(3):
+        call(cb, ok=False)
+    assert cb.stats()["state"] == CLOSED
+
+
+def test_opens_at_failure_rate(clock):
+    cb = make()
+    call(cb)
+    call(cb)
+    call(cb, ok=False)
+    call(cb, ok=False)
+    stats = cb.stats()
+    assert stats["state"] == OPEN
+    assert stats["opened"] == 1
+    with pytest.raises(CircuitOpen) as exc:
+        cb.allow()
+    assert exc.value.name == "teste"
+    assert 1 <= exc.value.retry_after <= 31
+    assert cb.stats()["rejected"] == 1
+
+
+def test_slow_calls_count_as_failures(clock):
+    cb = make()
+    for _ in range(4):
+        call(cb, ok=True, elapsed=6)
+    stats = cb.stats()
+    assert stats["state"] == OPEN
+    assert stats["slow"] == 4
+    assert stats["failures"] == 0
+
+
+def test_half_open_probe_success_closes(clock):
+    cb = make()
+    for _ in range(4):
+        call(cb, ok=False)
+    clock.now += 30
+    assert cb.stats()["state"] == HALF_OPEN
+    cb.allow()
+    # só uma chamada de teste por vez
+    with pytest.raises(CircuitOpen):
+        cb.allow()
+    cb.record(True, 0.1)
+    stats = cb.stats()
+    assert stats["state"] == CLOSED
+    assert stats["window"] == 0
+
+
+def test_half_open_probe_failure_reopens(clock):
+    cb = make()
+    for _ in range(4):
+        call(cb, ok=False)
+    clock.now += 30
+    call(cb, ok=False)
+    stats = cb.stats()
+    assert stats["state"] == OPEN
+    assert stats["opened"] == 2
+    with pytest.raises(CircuitOpen):
+        cb.allow()
+
+
+def test_half_open_needs_every_probe(clock):
+    cb = make(half_open_probes=2)
+    for _ in range(4):
+        call(cb, ok=False)
+    clock.now += 30
+    call(cb)
+    assert cb.stats()["state"] == HALF_OPEN
+    call(cb)
+    assert cb.stats()["state"] == CLOSED
+
+
+def test_release_frees_probe_without_outcome(clock):
+    cb = make()
+    for _ in range(4):
+        call(cb, ok=False)
+    clock.now += 30
+    cb.allow()
+    cb.release()
+    cb.allow()  # a vaga de teste voltou
+    cb.record(True, 0.1)
+    assert cb.stats()["state"] == CLOSED
+
+
+def test_record_while_open_is_ignored(clock):
+    cb = make()
+    cb.allow()  # admitida antes de abrir
+    for _ in range(4):
+        call(cb, ok=False)
+    cb.record(True, 0.1)
+    assert cb.stats()["state"] == OPEN
+
+
+def test_window_slides(clock):
+    cb = make(window=4, min_calls=4)
+    call(cb, ok=False)
+    for _ in range(4):
+        call(cb)
+    call(cb, ok=False)
+    stats = cb.stats()
+    assert stats["state"] == CLOSED
+    assert stats["failure_rate"] == 0.25
+
+
+def test_report_stale_inside_degradation():
+    with degradation() as state:
+        report_stale(10.0)
+        report_stale(4.0)
+    assert state == {"stale": True, "age": 10.0}
+
+
+def test_report_stale_outside_degradation_is_noop():
+    report_stale(5.0)
+    with degradation() as state:
+        pass
+    assert state == {"stale": False, "age": 0.0}
@@ -0,0 +1,83 @@
+# backend/tests/test_disk_cache.py
+import os
+import time
+
+import pytest
+
+from src.services import config, disk_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "DISK_CACHE_MAX_BYTES", 0)
+    monkeypatch.setattr(disk_cache, "_written_since_prune", None)
+    return tmp_path
+
+
+def age(path, seconds):
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_put_get_round_trip(cache_dir):
+    disk_cache.put("history", "k", {"items": [1, 2]})
+    assert disk_cache.get("history", "k") == {"items": [1, 2]}
+    assert disk_cache.get("history", "outra") is None
+    assert disk_cache.keys("history") == ["k"]
+    disk_cache.delete("history", "k")
+    assert disk_cache.get("history", "k") is None
+
+
+def test_serialization_error_leaves_no_temp_file(cache_dir):
+    value = {}
+    value["self"] = value
+    with pytest.raises(ValueError):
+        disk_cache.put("history", "k", value)
+    assert os.listdir(cache_dir / "history") == []
+
+
+def test_get_refreshes_access_time(cache_dir):
+    disk_cache.put("geo", "k", [1])
+    path = cache_dir / "geo" / "k.json"
+    age(path, 3600)
+    disk_cache.get("geo", "k")
+    assert time.time() - path.stat().st_mtime < 60
+
+
+def test_prune_removes_least_recently_read(cache_dir, monkeypatch):
+    blob = "x" * 1000
+    for i in range(10):
+        disk_cache.put("history", f"k{i}", blob)
+        age(cache_dir / "history" / f"k{i}.json", 1000 - i)
+    disk_cache.put("results", "handle", {"table": "t"})
+    age(cache_dir / "results" / "handle.json", 5000)
+    # o mais antigo foi lido agora: fica
+    disk_cache.get("history", "k0")
+
+    monkeypatch.setattr(config, "DISK_CACHE_MAX_BYTES", 5000)
+    assert disk_cache.prune() == 6
+    left = disk_cache.keys("history")
+    assert left == ["k0", "k7", "k8", "k9"]
+    # registro não é cache: nunca sai por espaço
+    assert disk_cache.keys("results") == ["handle"]
+
+
+def test_put_prunes_when_over_limit(cache_dir, monkeypatch):
+    monkeypatch.setattr(config, "DISK_CACHE_MAX_BYTES", 20_000)
+    blob = "x" * 1000
+    for i in range(60):
+        disk_cache.put("analytics", f"k{i:02d}", blob)
+        age(cache_dir / "analytics" / f"k{i:02d}.json", 1000 - i)
+    total = sum(p.stat().st_size for p in (cache_dir / "analytics").iterdir())
+    # confere a cada 5% do limite: passa no máximo isso
+    assert total <= 20_000 * 1.05 + 1100
+    assert "k59" in disk_cache.keys("analytics")
+    assert "k00" not in disk_cache.keys("analytics")
+
+
+def test_no_limit_keeps_everything(cache_dir):
+    for i in range(5):
+        disk_cache.put("geo", f"k{i}", "x" * 1000)
+    assert disk_cache.prune() == 0
+    assert len(disk_cache.keys("geo")) == 5
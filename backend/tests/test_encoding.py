@@ -0,0 +1,172 @@
+# backend/tests/test_encoding.py
+import decimal
+import gzip
+import json
+from datetime import date, datetime
+
+import pytest
+from fastapi import HTTPException, Request, Response
+
+from src.api import encoding
+
+
+def make_request(accept_encoding=None):
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_check_format():
+    assert encoding.check_format(None) == "json"
+    assert encoding.check_format(" Columnar ") == "columnar"
+    with pytest.raises(HTTPException) as exc:
+        encoding.check_format("xml")
+    assert exc.value.status_code == 400
+
+
+def test_check_format_arrow_falls_back_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(encoding, "pa", None)
+    assert encoding.check_format("arrow") == "json"
+
+
+def test_variant():
+    assert encoding.variant("json") == ""
+    assert encoding.variant("columnar") == "columnar"
+
+
+def test_dumps_handles_bigquery_types():
+    payload = {
+        "inteiro": decimal.Decimal("5"),
+        "fracao": decimal.Decimal("2.5"),
+        "dia": date(2024, 3, 1),
+        "quando": datetime(2024, 3, 1, 12, 30),
+        "tupla": (1, 2),
+    }
+    assert json.loads(encoding.dumps(payload)) == {
+        "inteiro": 5,
+        "fracao": 2.5,
+        "dia": "2024-03-01",
+        "quando": "2024-03-01T12:30:00",
+        "tupla": [1, 2],
+    }
+
+
+def test_dumps_without_orjson(monkeypatch):
+    monkeypatch.setattr(encoding, "orjson", None)
+    assert json.loads(encoding.dumps({"n": decimal.Decimal("3"), "s": "ação"})) == {"n": 3, "s": "ação"}
+
+
+def test_columnar_dictionary_encodes_repetitive_strings():
+    rows = [
+        {"cliente": "A", "placa": "AAA1", "total": 1},
+        {"cliente": "B", "placa": "BBB2", "total": 2},
+        {"cliente": "A", "placa": None, "total": 3},
+        {"cliente": None, "placa": "CCC3", "total": None},
+    ]
+    table = encoding.columnar(rows)
+    assert table["length"] == 4
+    assert table["columns"] == ["cliente", "placa", "total"]
+    # 2 distintos em 4 valores: dictionary; null continua null
+    assert table["dictionaries"] == {"cliente": ["A", "B"]}
+    assert table["data"]["cliente"] == [0, 1, 0, None]
+    # 3 distintos em 4: fica como está
+    assert table["data"]["placa"] == ["AAA1", "BBB2", None, "CCC3"]
+    assert table["data"]["total"] == [1, 2, 3, None]
+
+
+def test_columnar_mixed_types_and_missing_keys():
+    rows = [{"a": "x"}, {"a": 1, "b": "y"}, {"a": "x", "b": "y"}, {"b": "y"}]
+    table = encoding.columnar(rows)
+    assert table["columns"] == ["a", "b"]
+    assert table["data"]["a"] == ["x", 1, "x", None]
+    assert table["dictionaries"] == {"b": ["y"]}
+    assert table["data"]["b"] == [None, 0, 0, 0]
+
+
+def test_columnar_explicit_columns_and_empty():
+    assert encoding.columnar([], ["a"]) == {"length": 0, "columns": ["a"], "data": {"a": []}, "dictionaries": {}}
+    table = encoding.columnar([{"a": 1, "b": 2}], ["b"])
+    assert table["columns"] == ["b"]
+    assert table["data"] == {"b": [2]}
+
+
+def test_overview_and_history_columnar():
+    overview = {
+        "items": [
+            {"plate": "AAA1", "events": [{"code": "P0001"}, {"code": "P0002"}]},
+            {"plate": "BBB2", "events": []},
+        ]
+    }
+    out = encoding.overview_columnar(overview)
+    assert out["format"] == "columnar"
+    assert out["vehicles"]["data"]["plate"] == ["AAA1", "BBB2"]
+    assert out["events"]["data"]["vehicle"] == [0, 0]
+
+    history = {"items": [{"code": "P1"}, {"code": "P1"}], "page": 2}
+    out = encoding.history_columnar(history)
+    assert out["page"] == 2
+    assert out["items"]["dictionaries"] == {"code": ["P1"]}
+
+
+def test_flatten():
+    items = [{"plate": "A", "x": 1, "events": [{"code": 1}, {"code": 2}]}, {"plate": "B", "events": None}]
+    assert encoding.flatten(items, "events", ("plate",)) == [{"plate": "A", "code": 1}, {"plate": "A", "code": 2}]
+
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(encoding, "brotli", None)
+    assert encoding.negotiate_encoding(None) is None
+    assert encoding.negotiate_encoding("gzip, deflate") == "gzip"
+    assert encoding.negotiate_encoding("br") is None
+    assert encoding.negotiate_encoding("gzip;q=0") is None
+    assert encoding.negotiate_encoding("*") == "gzip"
+    assert encoding.negotiate_encoding("*, gzip;q=0") is None
+
+
+def test_negotiate_prefers_br_when_available(monkeypatch):
+    monkeypatch.setattr(encoding, "brotli", object())
+    assert encoding.negotiate_encoding("gzip, br") == "br"
+    assert encoding.negotiate_encoding("gzip, br;q=0.5") == "gzip"
+
+
+def test_encoded_response_compresses_and_weakens_etag(monkeypatch):
+    monkeypatch.setattr(encoding, "brotli", None)
+    payload = {"items": [{"code": "P0001", "n": i} for i in range(200)]}
+    base = Response(headers={"ETag": '"abc"', "X-Cache": "HIT"})
+    out = encoding.encoded_response(make_request("gzip"), base, payload, "json")
+    assert out.headers["content-encoding"] == "gzip"
+    assert out.headers["etag"] == 'W/"abc"'
+    assert out.headers["x-cache"] == "HIT"
+    assert out.headers["vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(out.body)) == payload
+
+
+def test_encoded_response_small_or_uncompressed_keeps_strong_etag():
+    base = Response(headers={"ETag": '"abc"'})
+    out = encoding.encoded_response(make_request("gzip"), base, {"ok": True}, "json")
+    assert "content-encoding" not in out.headers
+    assert out.headers["etag"] == '"abc"'
+    assert json.loads(out.body) == {"ok": True}
+
+
+def test_encoded_response_columnar():
+    payload = {"items": [{"code": "P1"}, {"code": "P1"}]}
+    out = encoding.encoded_response(make_request(), Response(), payload, "columnar", to_columnar=encoding.history_columnar)
+    assert json.loads(out.body)["items"]["data"]["code"] == [0, 0]
+    assert out.media_type == "application/json"
+
+
+def test_encoded_response_passes_ready_response():
+    ready = Response(status_code=304)
+    assert encoding.encoded_response(make_request(), Response(), ready, "json") is ready
+
+
+def test_arrow_ipc_round_trip():
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.ipc as pa_ipc
+
+    rows = [{"code": "P1", "n": 1}, {"code": "P1", "n": 2}]
+    body = encoding.arrow_ipc(rows, {"page": 1})
+    table = pa_ipc.open_stream(pa.BufferReader(body)).read_all()
+    assert table.column("code").to_pylist() == ["P1", "P1"]
+    assert pa.types.is_dictionary(table.schema.field("code").type)
+    assert json.loads(table.schema.metadata[b"meta"]) == {"page": 1}
@@ -0,0 +1,130 @@
+# backend/tests/test_fault_snapshot.py
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.services import bq_client
+from src.services import fault_snapshot as fault_snapshot_module
+from src.services.fault_snapshot import FaultSnapshot
+
+T = datetime(2024, 5, 31, 12, tzinfo=timezone.utc)
+HOUR = 3600
+
+
+def at(hours):
+    return T + timedelta(hours=hours)
+
+
+CHASSI = "9BWZZZ377VT004251"
+
+
+def fault(dtc, hours, first_seen, last_seen):
+    return {
+        "vehicle_id": "1",
+        "imei": "IMEI1",
+        "dtc": dtc,
+        "fmi": 3,
+        "spn": 100,
+        "plate": "ABC1234",
+        "chassi": CHASSI,
+        "chassi_last8": CHASSI[-8:],
+        "customer_name": "Cliente",
+        "hours": [{"hour": int(at(h).timestamp()), "n": n} for h, n in hours],
+        "first_seen_utc": first_seen,
+        "last_seen_utc": last_seen,
+    }
+
+
+class Clock:
+    def __init__(self):
+        self.now = T.timestamp()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(fault_snapshot_module.time, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Linhas que o BigQuery devolve na próxima rodada; guarda o `since` de cada varredura."""
+    state = {"rows": [], "since": []}
+
+    def get_fault_status_rows(since):
+        state["since"].append(since)
+        return state["rows"]
+
+    monkeypatch.setattr(bq_client, "get_fault_status_rows", get_fault_status_rows)
+    return state
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    return FaultSnapshot(str(tmp_path / "faults.sqlite3"), days=2, interval=0, overlap_minutes=30, max_age=86400)
+
+
+def stored(snapshot):
+    conn = sqlite3.connect(snapshot.path)
+    rows = conn.execute("SELECT dtc, first_seen, last_seen, hours FROM faults ORDER BY dtc").fetchall()
+    conn.close()
+    faults = {}
+    for dtc, first, last, hours in rows:
+        hours = json.loads(hours)
+        # horas como deslocamento de T, para comparar com o que foi varrido
+        faults[dtc] = (first, last, [(h - T.timestamp()) / HOUR for h, _ in hours], hours)
+    return faults
+
+
+def test_incremental_merge_keeps_hours_before_scan_and_drops_expired(clock, scans, snapshot):
+    # rodada completa: P0001 com uma hora perto do limite da janela de 2 dias; P0009 só nessa hora
+    scans["rows"] = [
+        fault("P0001", [(-47, 1), (-5, 2), (-1, 3)], at(-47), at(-1) + timedelta(minutes=10)),
+        fault("P0009", [(-47, 1)], at(-47), at(-47) + timedelta(minutes=10)),
+    ]
+    result = snapshot.refresh()
+    assert result["incremental"] is False
+    assert set(stored(snapshot)) == {"P0001", "P0009"}
+
+    # 3 h depois: a varredura começa na marca d'água menos a sobreposição (hora cheia)
+    clock.now = at(3).timestamp()
+    scans["rows"] = [
+        fault("P0001", [(-1, 4), (2, 1)], at(-1), at(2) + timedelta(minutes=5)),
+        fault("P0002", [(2, 6)], at(2), at(2) + timedelta(minutes=30)),
+    ]
+    result = snapshot.refresh()
+    assert result["incremental"] is True
+    assert scans["since"][-1] == at(-2)
+
+    faults = stored(snapshot)
+    # P0009 saiu da janela; a hora -47 de P0001 também (limite: agora - 48 h = -45 h)
+    assert set(faults) == {"P0001", "P0002"}
+    first, last, offsets, hours = faults["P0001"]
+    # -5 é de antes da varredura e fica; -1 foi revarrida e substitui a guardada (3 -> 4)
+    assert offsets == [-5, -1, 2]
+    assert [n for _, n in hours] == [2, 4, 1]
+    assert last == (at(2) + timedelta(minutes=5)).timestamp()
+    assert first == at(-47).timestamp()
+    assert faults["P0002"][2] == [2]
+
+
+def test_summary_row_counts_and_first_seen_inside_window(clock, scans, snapshot):
+    scans["rows"] = [fault("P0001", [(-47, 1), (-30, 2), (-5, 3), (-1, 4)], at(-47), at(-1) + timedelta(minutes=10))]
+    snapshot.refresh()
+    clock.now = at(3).timestamp()
+    (row,) = snapshot.vehicle_summary("ABC1234", days=1)
+    # janela de 1 dia: só as horas -5 e -1
+    assert row["events_total"] == 7
+    assert row["ev_6h"] == 4
+    assert row["ev_24h"] == 7
+    assert row["first_seen_utc"] == at(-5)
+    assert row["last_seen_utc"] == at(-1) + timedelta(minutes=10)
+    assert row["status_label"]
+    assert snapshot.vehicle_summary("ABC1234", days=3) is None  # janela maior que a do snapshot
+
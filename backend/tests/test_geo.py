@@ -0,0 +1,130 @@
+# backend/tests/test_geo.py
+import pytest
+
+from src.services import config, geo
+from src.services.breaker import degradation, report_stale
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_encode_known_value():
+    assert geo.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geo.encode(-23.5505, -46.6333, 5) == "6gyf4"
+
+
+def test_bounds_contains_point_and_matches_cell_size():
+    for precision in range(1, geo.MAX_PRECISION + 1):
+        cell = geo.encode(-23.5505, -46.6333, precision)
+        min_lon, min_lat, max_lon, max_lat = geo.bounds(cell)
+        assert min_lon <= -46.6333 < max_lon
+        assert min_lat <= -23.5505 < max_lat
+        lat_step, lon_step = geo._cell_size(precision)
+        assert max_lat - min_lat == pytest.approx(lat_step)
+        assert max_lon - min_lon == pytest.approx(lon_step)
+
+
+def test_precision_for_zoom():
+    assert [geo.precision_for_zoom(z) for z in (0, 3, 4, 6, 8, 11, 13, 15, 16, 20)] == [2, 2, 3, 3, 4, 5, 6, 7, 8, 8]
+
+
+def test_parse_bbox():
+    assert geo.parse_bbox(None) == geo.WORLD
+    assert geo.parse_bbox("") == geo.WORLD
+    assert geo.parse_bbox("-47,-24,-46,-23") == (-47.0, -24.0, -46.0, -23.0)
+    for bad in ("1,2,3", "a,b,c,d", "-46,-24,-47,-23", "-47,-91,-46,-23", "-181,-24,-46,-23"):
+        with pytest.raises(ValueError):
+            geo.parse_bbox(bad)
+
+
+def test_covering_tiles_cover_the_bbox():
+    bbox = (-46.9, -23.9, -46.3, -23.3)
+    tiles = geo.covering_tiles(bbox, 3)
+    assert tiles == sorted(set(tiles))
+    assert all(len(tile) == 3 for tile in tiles)
+    # cada ponto do bbox cai num dos tiles
+    for lat in (-23.9, -23.6, -23.31):
+        for lon in (-46.9, -46.6, -46.31):
+            assert geo.encode(lat, lon, 3) in tiles
+    assert geo.covering_tiles(bbox, 0) == [""]
+
+
+def test_covering_tiles_respects_max_tiles(monkeypatch):
+    monkeypatch.setattr(config, "GEO_MAX_TILES", 4)
+    assert geo.covering_tiles(geo.WORLD, 1) is None
+    assert geo.covering_tiles((-1.0, -1.0, 1.0, 1.0), 1) == sorted(["7", "k", "e", "s"])
+
+
+def test_plan_lowers_precision_until_tiles_fit(monkeypatch):
+    monkeypatch.setattr(config, "GEO_MAX_TILES", 64)
+    precision, tiles = geo.plan(geo.WORLD, 20)
+    # mundo inteiro com 64 tiles: tiles de 1 caractere (32), células de 2
+    assert precision == 2
+    assert len(tiles) == 32
+    precision, tiles = geo.plan((-46.64, -23.56, -46.63, -23.55), 15)
+    assert precision == 7
+    assert 0 < len(tiles) <= 64
+    assert geo.plan((-46.64, -23.56, -46.63, -23.55), -5)[0] == 2
+
+
+def test_tiles_bbox():
+    tiles = ["6gyf", "6gyc"]
+    boxes = [geo.bounds(t) for t in tiles]
+    assert geo.tiles_bbox(tiles) == (
+        min(b[0] for b in boxes),
+        min(b[1] for b in boxes),
+        max(b[2] for b in boxes),
+        max(b[3] for b in boxes),
+    )
+
+
+def test_cached_tiles_fetches_only_missing(cache_dir):
+    calls = []
+
+    def fetch(missing):
+        calls.append(list(missing))
+        return {tile: [{"tile": tile}] for tile in missing if tile != "6gy"}
+
+    key = dict(start_date="2024-01-01", end_date="2024-01-31")
+    first = geo.cached_tiles(["6gy", "6gz"], fetch, **key)
+    assert first == {"6gy": [], "6gz": [{"tile": "6gz"}]}
+    second = geo.cached_tiles(["6gy", "6gz", "6gv"], fetch, **key)
+    assert second["6gy"] == [] and second["6gz"] == [{"tile": "6gz"}]
+    # tile vazio também foi gravado: só o novo vai ao fetch
+    assert calls == [["6gy", "6gz"], ["6gv"]]
+    geo.cached_tiles(["6gz"], fetch, start_date="2024-02-01", end_date="2024-02-29")
+    assert calls[-1] == ["6gz"]
+
+
+def test_cached_tiles_does_not_store_stale(cache_dir):
+    calls = []
+
+    def fetch(missing):
+        calls.append(list(missing))
+        report_stale(120.0)
+        return {tile: [{"tile": tile}] for tile in missing}
+
+    with degradation() as outer:
+        assert geo.cached_tiles(["6gy"], fetch) == {"6gy": [{"tile": "6gy"}]}
+    assert outer == {"stale": True, "age": 120.0}
+    geo.cached_tiles(["6gy"], fetch)
+    assert calls == [["6gy"], ["6gy"]]
+
+
+def test_hotspots_payload_filters_and_sorts():
+    by_tile = {
+        "a": [{"lat": 0.5, "lon": 0.5, "count": 2}, {"lat": 5.0, "lon": 0.5, "count": 50}],
+        "b": [{"lat": 0.2, "lon": 0.2, "count": 7}],
+        "c": [{"lat": 0.1, "lon": 0.1, "count": 100}],
+    }
+    payload = geo.hotspots_payload(by_tile, ["a", "b"], (0.0, 0.0, 1.0, 1.0), 4, "2024-01-01", "2024-01-31")
+    assert [c["count"] for c in payload["cells"]] == [7, 2]
+    assert payload["total_events"] == 9
+    assert payload["tiles"] == 2
+    assert payload["precision"] == 4
+    assert payload["bbox"] == [0.0, 0.0, 1.0, 1.0]
+    lat_step, lon_step = geo._cell_size(4)
+    assert payload["cell_size_deg"] == {"lat": lat_step, "lon": lon_step}
@@ -0,0 +1,101 @@
+# backend/tests/test_polling.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from src.api import main  # noqa: E402
+from src.services import bq_client  # noqa: E402
+
+T0 = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class Warehouse:
+    """Eventos do veículo; conta as consultas completas e as de marca d'água."""
+
+    def __init__(self, latest):
+        self.latest = latest
+        self.unknown_latest = None  # evento mais novo com DTC fora de dw_dtc_codes
+        self.full = 0
+        self.watermarks = []
+
+    def get_dtcs(self, vehicle_key, hours, mode="events", gap_minutes=None, since_ts=None):
+        self.full += 1
+        return [{"ts": self.latest - timedelta(minutes=5), "dtc": "P0001"}, {"ts": self.latest, "dtc": "P0002"}]
+
+    def get_event_watermark(self, vehicle_key, window, since_ts=None, known_dtcs=False):
+        self.watermarks.append(known_dtcs)
+        if not known_dtcs and self.unknown_latest is not None:
+            return max(self.latest, self.unknown_latest)
+        return self.latest
+
+
+@pytest.fixture
+def warehouse(monkeypatch):
+    fake = Warehouse(T0)
+    monkeypatch.setattr(bq_client, "get_dtcs", fake.get_dtcs)
+    monkeypatch.setattr(bq_client, "get_event_watermark", fake.get_event_watermark)
+    return fake
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def test_first_poll_returns_etag_and_latest_event(client, warehouse):
+    res = client.get("/vehicles/ABC1234/dtc")
+    assert res.status_code == 200
+    assert res.headers["x-latest-event"] == T0.isoformat()
+    assert res.headers["etag"]
+    assert warehouse.watermarks == []  # sem If-None-Match, nada de marca d'água
+
+
+def test_unchanged_poll_is_304_without_full_query(client, warehouse):
+    etag = client.get("/vehicles/ABC1234/dtc").headers["etag"]
+    res = client.get("/vehicles/ABC1234/dtc", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.headers["etag"] == etag
+    assert warehouse.full == 1
+    assert warehouse.watermarks == [True]
+
+
+def test_newer_event_returns_200_with_new_etag(client, warehouse):
+    etag = client.get("/vehicles/ABC1234/dtc").headers["etag"]
+    warehouse.latest = T0 + timedelta(minutes=1)
+    res = client.get("/vehicles/ABC1234/dtc", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["etag"] != etag
+    assert res.headers["x-latest-event"] == warehouse.latest.isoformat()
+    assert warehouse.full == 2
+
+
+def test_unknown_dtc_does_not_defeat_304(client, warehouse):
+    etag = client.get("/vehicles/ABC1234/dtc").headers["etag"]
+    warehouse.unknown_latest = T0 + timedelta(minutes=10)
+    res = client.get("/vehicles/ABC1234/dtc", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert warehouse.full == 1
+
+
+def test_etag_ignores_since_but_not_other_params(client, warehouse):
+    etag = client.get("/vehicles/ABC1234/dtc").headers["etag"]
+    assert client.get("/vehicles/ABC1234/dtc", params={"since": T0.isoformat()}).headers["etag"] == etag
+    assert client.get("/vehicles/ABC1234/dtc", params={"hours": 48}).headers["etag"] != etag
+
+
+def test_watermark_outage_falls_back_to_full_query(client, warehouse, monkeypatch):
+    etag = client.get("/vehicles/ABC1234/dtc").headers["etag"]
+
+    def unavailable(*args, **kwargs):
+        raise bq_client.BigQueryUnavailable("fora", 5)
+
+    monkeypatch.setattr(bq_client, "get_event_watermark", unavailable)
+    res = client.get("/vehicles/ABC1234/dtc", headers={"If-None-Match": etag})
+    # a consulta completa ainda decide o 304
+    assert res.status_code == 304
+    assert warehouse.full == 2
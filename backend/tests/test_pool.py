@@ -0,0 +1,67 @@
+# backend/tests/test_pool.py
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("agno")
+
+from src.agent.pool import AgentPool, AssistantBusy  # noqa: E402
+
+
+def test_stream_reports_whether_this_request_was_queued():
+    pool = AgentPool(lambda: None, size=1, max_queue=2, queue_timeout=5, run_timeout=5)
+    release = threading.Event()
+
+    def blocking():
+        release.wait(5)
+        yield "primeiro"
+
+    def quick():
+        yield "segundo"
+
+    async def main():
+        first, first_queued = pool.stream(blocking)
+        second, second_queued = pool.stream(quick)
+        third, third_queued = pool.stream(quick)
+        # 1 em execução + 2 na fila: o quarto passa do limite
+        with pytest.raises(AssistantBusy):
+            pool.stream(quick)
+        release.set()
+        items = [item async for item in first] + [item async for item in second] + [item async for item in third]
+        return first_queued, second_queued, third_queued, items
+
+    first_queued, second_queued, third_queued, items = asyncio.run(main())
+    assert (first_queued, second_queued, third_queued) == (False, True, True)
+    assert items == ["primeiro", "segundo", "segundo"]
+
+
+def test_stream_not_queued_when_a_worker_is_free():
+    pool = AgentPool(lambda: None, size=2, max_queue=0, queue_timeout=5, run_timeout=5)
+
+    def quick():
+        yield 1
+
+    async def main():
+        stream, queued = pool.stream(quick)
+        return queued, [item async for item in stream]
+
+    assert asyncio.run(main()) == (False, [1])
+    assert pool.stats()["rejected"] == 0
+
+
+def test_admission_is_used_once_or_released():
+    pool = AgentPool(lambda: None, size=1, max_queue=0, queue_timeout=5, run_timeout=5)
+    admission = pool.admit()
+    assert admission.queued is False
+    with pytest.raises(AssistantBusy):
+        pool.admit()  # o lugar já está reservado
+    admission.release()
+    admission.release()  # devolver de novo não libera outro lugar
+
+    admission = pool.admit()
+    assert asyncio.run(pool.run(lambda: "ok", admission)) == "ok"
+    admission.release()  # já usada: não faz nada
+    with pytest.raises(RuntimeError):
+        pool.submit(lambda: None, admission)
+    assert pool.admit().queued is False
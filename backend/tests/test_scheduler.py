@@ -0,0 +1,176 @@
+# backend/tests/test_scheduler.py
+import threading
+import time
+
+import pytest
+
+from src.services.scheduler import (
+    BATCH,
+    DASHBOARD,
+    INTERACTIVE,
+    QueryQueueTimeout,
+    QueryScheduler,
+    caller_context,
+    priority_cap,
+)
+
+
+def make(**overrides):
+    params = dict(max_concurrent=1, caller_max_concurrent=1, caller_bytes_per_window=1000, budget_window=60, queue_timeout=5)
+    params.update(overrides)
+    return QueryScheduler(**params)
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condição não ocorreu a tempo"
+        time.sleep(0.005)
+
+
+def start_waiter(sched, caller, priority, order, done=None):
+    def run():
+        with caller_context(caller):
+            with sched.slot(priority):
+                order.append(caller)
+                if done is not None:
+                    done.wait(2)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def waiting(sched):
+    return sum(sched.stats()["waiting"].values())
+
+
+def test_queue_orders_by_priority_then_arrival():
+    sched = make(caller_max_concurrent=10)
+    order = []
+    threads = []
+    with sched.slot():
+        for caller, priority in (("lote", BATCH), ("painel-1", DASHBOARD), ("veiculo", INTERACTIVE), ("painel-2", DASHBOARD)):
+            threads.append(start_waiter(sched, caller, priority, order))
+            wait_until(lambda n=len(threads): waiting(sched) == n)
+    for thread in threads:
+        thread.join(2)
+    assert order == ["veiculo", "painel-1", "painel-2", "lote"]
+    stats = sched.stats()
+    assert stats["queued"] == 4
+    assert stats["running"] == 0
+
+
+def test_caller_at_limit_does_not_block_others():
+    sched = make(max_concurrent=2, caller_max_concurrent=1)
+    order = []
+    release = threading.Event()
+    with caller_context("a"):
+        with sched.slot():
+            # "a" está no limite: a segunda consulta dele espera, a de "b" passa na frente
+            blocked = start_waiter(sched, "a", INTERACTIVE, order)
+            wait_until(lambda: waiting(sched) == 1)
+            other = start_waiter(sched, "b", BATCH, order, done=release)
+            wait_until(lambda: order == ["b"])
+            assert sched.stats()["callers"]["a"] == {
+                "running": 1,
+                "waiting": 1,
+                "bytes_in_window": 0,
+                "over_budget": False,
+            }
+        release.set()
+    blocked.join(2)
+    other.join(2)
+    assert order == ["b", "a"]
+
+
+def test_queue_timeout():
+    sched = make(queue_timeout=0.05)
+    with sched.slot():
+        with pytest.raises(QueryQueueTimeout) as exc:
+            with sched.slot():
+                pass
+    assert exc.value.retry_after >= 1
+    stats = sched.stats()
+    assert stats["timeouts"] == 1
+    assert stats["waiting"] == {INTERACTIVE: 0, DASHBOARD: 0, BATCH: 0}
+
+
+def test_over_budget_caller_is_demoted():
+    sched = make(caller_max_concurrent=10)
+    with caller_context("pesado"):
+        sched.record_bytes(600)
+        with sched.slot():
+            pass
+        assert sched.stats()["demoted"] == 0
+        sched.record_bytes(600)
+        assert sched.stats()["callers"]["pesado"]["over_budget"] is True
+
+    order = []
+    threads = []
+    with sched.slot():
+        threads.append(start_waiter(sched, "pesado", INTERACTIVE, order))
+        wait_until(lambda: sched.stats()["waiting"][BATCH] == 1)
+        threads.append(start_waiter(sched, "leve", DASHBOARD, order))
+        wait_until(lambda: waiting(sched) == 2)
+    for thread in threads:
+        thread.join(2)
+    assert order == ["leve", "pesado"]
+    assert sched.stats()["demoted"] == 1
+
+
+def test_budget_window_expires(monkeypatch):
+    sched = make(budget_window=10)
+    with caller_context("x"):
+        sched.record_bytes(5000)
+    assert sched.stats()["callers"]["x"]["bytes_in_window"] == 5000
+    later = time.monotonic() + 11
+    monkeypatch.setattr("src.services.scheduler.time.monotonic", lambda: later)
+    assert sched.stats()["callers"]["x"]["bytes_in_window"] == 0
+    assert "x" not in sched.stats()["callers"]
+
+
+def test_record_bytes_without_caller_is_ignored():
+    sched = make()
+    sched.record_bytes(10**9)
+    with caller_context(None):
+        sched.record_bytes(10**9)
+    assert sched.stats()["callers"] == {}
+
+
+def test_priority_cap_lowers_priority():
+    sched = make()
+    order = []
+    with sched.slot():
+
+        def run():
+            with priority_cap(BATCH):
+                with sched.slot(INTERACTIVE):
+                    order.append("capado")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        wait_until(lambda: sched.stats()["waiting"][BATCH] == 1)
+    thread.join(2)
+    assert order == ["capado"]
+
+
+def test_wait_seconds_is_reported():
+    sched = make()
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with sched.slot():
+            holding.set()
+            release.wait(2)
+
+    thread = threading.Thread(target=hold, daemon=True)
+    thread.start()
+    holding.wait(2)
+    threading.Timer(0.05, release.set).start()
+    with caller_context("c") as state:
+        with sched.slot():
+            pass
+    thread.join(2)
+    assert state["wait_seconds"] >= 0.04
@@ -0,0 +1,186 @@
+# backend/tests/test_shared_cache.py
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from src.services import shared_cache as shared_cache_module
+from src.services.shared_cache import MISSING, SharedCache, dumps, loads
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SharedCache(str(tmp_path / "shared.sqlite3"), max_bytes=4 * 1024**2)
+
+
+def test_dumps_loads_round_trip_and_compression():
+    small = {"a": 1}
+    big = {"rows": ["x" * 10] * 500}
+    assert dumps(small)[:1] == b"p"
+    assert dumps(big)[:1] == b"z"
+    assert len(dumps(big)) < len(dumps(small)) * 50
+    assert loads(dumps(small)) == small
+    assert loads(dumps(big)) == big
+
+
+def test_get_set_and_namespaces(cache):
+    assert cache.get("ns", "k") is None
+    assert cache.get("ns", "k", MISSING) is MISSING
+    cache.set("ns", "k", {"v": [1, 2]}, ttl=60)
+    assert cache.get("ns", "k") == {"v": [1, 2]}
+    assert cache.get("outro", "k") is None
+    stats = cache.stats()
+    assert stats["writes"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["namespaces"]["ns"]["entries"] == 1
+    assert cache.count("ns") == 1
+    assert cache.count("outro") == 0
+
+
+def test_get_many_and_set_many(cache):
+    cache.set_many("ns", {"a": 1, "b": None, "c": "três"}, ttl=60)
+    assert cache.get_many("ns", ["a", "b", "x", "a"]) == {"a": 1, "b": None}
+    assert cache.get_many("ns", []) == {}
+
+
+def test_expired_entries_are_misses(cache, monkeypatch):
+    cache.set("ns", "k", 1, ttl=10)
+    now = shared_cache_module.time.time()
+    monkeypatch.setattr(shared_cache_module.time, "time", lambda: now + 11)
+    assert cache.get("ns", "k") is None
+    assert cache.evict() == 1
+    assert cache.count("ns") == 0
+
+
+def test_get_or_set(cache):
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return "valor"
+
+    assert cache.get_or_set("ns", "k", factory, ttl=60) == "valor"
+    assert cache.get_or_set("ns", "k", factory, ttl=60) == "valor"
+    assert len(calls) == 1
+    # None não é guardado: a próxima chamada tenta de novo
+    assert cache.get_or_set("ns", "vazio", lambda: None, ttl=60) is None
+    assert cache.get("ns", "vazio", MISSING) is MISSING
+
+
+def test_delete(cache):
+    cache.set("ns", "k", 1, ttl=60)
+    cache.delete("ns", "k")
+    assert cache.get("ns", "k") is None
+
+
+def test_shared_between_instances(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    SharedCache(path, max_bytes=1024**2).set("ns", "k", "de outro worker", ttl=60)
+    assert SharedCache(path, max_bytes=1024**2).get("ns", "k") == "de outro worker"
+
+
+def test_shared_between_threads(cache):
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(20):
+                cache.set("ns", f"{n}-{i}", i, ttl=60)
+                assert cache.get("ns", f"{n}-{i}") == i
+        except Exception as exc:  # pragma: no cover - só aparece se falhar
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert cache.count("ns") == 80
+
+
+def test_oversized_value_is_not_stored(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.sqlite3"), max_bytes=64 * 1024)
+    big = os.urandom(16 * 1024)  # não comprime: passa de 1/8 do limite
+    cache.set("ns", "grande", big, ttl=60)
+    assert cache.get("ns", "grande") is None
+    assert cache.stats()["writes"] == 0
+
+
+def test_evicts_least_recently_accessed_over_limit(tmp_path):
+    limit = 512 * 1024
+    cache = SharedCache(str(tmp_path / "shared.sqlite3"), max_bytes=limit)
+    for i in range(100):
+        cache.set("ns", f"k{i:03d}", os.urandom(8 * 1024), ttl=60)
+    stats = cache.stats()
+    assert stats["evicted"] > 0
+    assert stats["bytes"] <= limit
+    conn = sqlite3.connect(cache.path)
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    used = conn.execute("PRAGMA page_count").fetchone()[0] - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.close()
+    assert used * page_size <= limit
+    # os mais antigos saíram primeiro, os últimos continuam
+    assert cache.get("ns", "k000") is None
+    assert cache.get("ns", "k099") is not None
+
+
+def test_disabled_cache_is_noop(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.sqlite3"), max_bytes=0)
+    assert cache.enabled is False
+    cache.set("ns", "k", 1, ttl=60)
+    assert cache.get("ns", "k", "padrão") == "padrão"
+    assert cache.evict() == 0
+    assert cache.stats() == {
+        "enabled": False,
+        "path": cache.path,
+        "max_bytes": 0,
+        "hits": 0,
+        "misses": 0,
+        "writes": 0,
+        "evicted": 0,
+        "errors": 0,
+    }
+    assert not os.path.exists(cache.path)
+
+
+def test_unpicklable_value_is_logged_not_raised(cache):
+    cache.set("ns", "k", lambda: None, ttl=60)
+    assert cache.get("ns", "k") is None
+    assert cache.stats()["errors"] == 1
+
+
+def test_corrupt_entry_is_a_miss(cache):
+    cache.set("ns", "k", 1, ttl=60)
+    conn = sqlite3.connect(cache.path)
+    conn.execute("UPDATE entries SET value = ?", (b"zlixo",))
+    conn.commit()
+    conn.close()
+    assert cache.get("ns", "k", MISSING) is MISSING
+    assert cache.stats()["errors"] == 1
+
+
+def test_update_is_atomic_across_instances(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    workers = [SharedCache(path, max_bytes=1024**2) for _ in range(4)]
+
+    def bump(current):
+        return (0 if current is MISSING else current) + 1
+
+    def worker(cache):
+        for _ in range(25):
+            cache.update("ns", "contador", bump, ttl=60)
+
+    threads = [threading.Thread(target=worker, args=(cache,)) for cache in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert workers[0].get("ns", "contador") == 100
+
+
+def test_update_disabled_returns_missing(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.sqlite3"), max_bytes=0)
+    assert cache.update("ns", "k", lambda current: 1, ttl=60) is MISSING
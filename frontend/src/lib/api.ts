@@ -18,7 +18,7 @@ const api = axios.create({
   headers: { "Content-Type": "application/json" },
 });
 
-type AskPayload = { prompt: string; plate?: string };
+type AskPayload = { prompt: string; plate?: string; session_id?: string };
 
 export async function askAssistant(payload: AskPayload) {
   const body: AskPayload = {
@@ -65,4 +65,113 @@ export async function askAssistant(payload: AskPayload) {
   }
 }
 
+export type AssistantStreamHandlers = {
+  onStatus?: (message: string) => void;
+  onToolStart?: (tool: string) => void;
+  onToolEnd?: (tool: string, failed: boolean) => void;
+  onToken?: (text: string) => void;
+  onSession?: (sessionId: string) => void;
+};
+
+const TOOL_LABELS: Record<string, string> = {
+  fetch_vehicle_summary: "resumo do veículo",
+  fetch_dtcs: "DTCs do veículo",
+  fetch_telemetry: "telemetria",
+  fetch_customer_summary: "resumo do cliente",
+};
+
+export function describeTool(tool: string) {
+  return TOOL_LABELS[tool] ?? tool;
+}
+
+function parseSseBlock(block: string) {
+  let event = "message";
+  const data: string[] = [];
+  for (const line of block.split("\n")) {
+    if (line.startsWith("event:")) event = line.slice(6).trim();
+    else if (line.startsWith("data:")) data.push(line.slice(5).trimStart());
+  }
+  if (!data.length) return null;
+  try {
+    return { event, data: JSON.parse(data.join("\n")) };
+  } catch {
+    return null;
+  }
+}
+
+/**
+ * Versão em streaming de askAssistant: consome o SSE de /assistant/ask/stream,
+ * repassa progresso/tokens aos handlers e resolve com a resposta final.
+ */
+export async function askAssistantStream(payload: AskPayload, handlers: AssistantStreamHandlers = {}) {
+  const body: AskPayload = {
+    ...payload,
+    prompt: payload.prompt.trim(),
+  };
+
+  if (!body.prompt) {
+    throw new AssistantError("Escreva uma pergunta antes de enviar.", "EMPTY_PROMPT");
+  }
+
+  let res: Response;
+  try {
+    res = await fetch(`${BASE}/assistant/ask/stream`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+      body: JSON.stringify(body),
+    });
+  } catch {
+    throw new AssistantError("Não foi possível consultar o assistente no momento.", "NETWORK_ERROR");
+  }
+
+  if (!res.ok || !res.body) {
+    let message = "Não foi possível consultar o assistente no momento.";
+    try {
+      const data = await res.json();
+      if (typeof data?.detail === "string" && data.detail.trim()) message = data.detail.trim();
+    } catch {
+      // corpo não-JSON: mantém a mensagem padrão
+    }
+    throw new AssistantError(message, `HTTP_${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let partial = "";
+  let answer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, "\n");
+
+    let sep = buffer.indexOf("\n\n");
+    while (sep !== -1) {
+      const parsed = parseSseBlock(buffer.slice(0, sep));
+      buffer = buffer.slice(sep + 2);
+      sep = buffer.indexOf("\n\n");
+      if (!parsed) continue;
+
+      const { event, data } = parsed;
+      if (event === "status") handlers.onStatus?.(String(data?.message ?? ""));
+      else if (event === "tool_start") handlers.onToolStart?.(String(data?.tool ?? ""));
+      else if (event === "tool_end") handlers.onToolEnd?.(String(data?.tool ?? ""), Boolean(data?.error));
+      else if (event === "token") {
+        partial += String(data?.text ?? "");
+        handlers.onToken?.(partial);
+      } else if (event === "answer") {
+        answer = String(data?.answer ?? "").trim();
+        if (data?.session_id) handlers.onSession?.(String(data.session_id));
+      }
+    }
+  }
+
+  const text = answer || partial.trim();
+  if (!text) {
+    throw new AssistantError("Não recebi conteúdo do servidor.", "EMPTY_ANSWER");
+  }
+  return text;
+}
+
 export default api;
@@ -1,5 +1,5 @@
 import { FormEvent, useEffect, useRef, useState } from "react";
-import { AssistantError, askAssistant } from "../lib/api";
+import { AssistantError, askAssistantStream, describeTool } from "../lib/api";
 
 type Msg = { id: string; role: "user" | "assistant"; content: string };
 
@@ -16,6 +16,10 @@ export default function Assistente() {
   const [plate, setPlate] = useState("");
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
+  const [progress, setProgress] = useState<string | null>(null);
+  const [partial, setPartial] = useState("");
+  // mantém a mesma sessão entre perguntas (histórico + cache das consultas no backend)
+  const sessionRef = useRef<string | undefined>(undefined);
   const listRef = useRef<HTMLDivElement>(null);
 
   const addMessage = (message: Omit<Msg, "id">) => {
@@ -30,7 +34,7 @@ export default function Assistente() {
 
   useEffect(() => {
     scrollToBottom();
-  }, [messages, loading]);
+  }, [messages, loading, partial]);
 
   async function handleSubmit(event: FormEvent<HTMLFormElement>) {
     event.preventDefault();
@@ -42,10 +46,24 @@ export default function Assistente() {
     addMessage({ role: "user", content: prompt });
     setMsg("");
     setError(null);
+    setProgress(null);
+    setPartial("");
     setLoading(true);
 
     try {
-      const answer = await askAssistant({ prompt, plate: plate || undefined });
+      const answer = await askAssistantStream(
+        { prompt, plate: plate || undefined, session_id: sessionRef.current },
+        {
+          onStatus: (message) => setProgress(message || null),
+          onToolStart: (tool) => setProgress(`Consultando ${describeTool(tool)}…`),
+          onToolEnd: (tool, failed) =>
+            setProgress(failed ? `Falha ao consultar ${describeTool(tool)}.` : "Analisando os dados…"),
+          onToken: (text) => setPartial(text),
+          onSession: (sessionId) => {
+            sessionRef.current = sessionId;
+          },
+        },
+      );
       addMessage({ role: "assistant", content: answer });
     } catch (err) {
       console.error(err);
@@ -58,6 +76,8 @@ export default function Assistente() {
       }
     } finally {
       setLoading(false);
+      setProgress(null);
+      setPartial("");
     }
   }
 
@@ -78,7 +98,7 @@ export default function Assistente() {
           {loading && (
             <div className="chat-msg assistant">
               <div className="avatar" aria-hidden />
-              <div className="bubble">pensando…</div>
+              <div className="bubble">{partial || progress || "pensando…"}</div>
             </div>
           )}
         </div>